@@ -11,6 +11,7 @@ interface Message {
   sender: "user" | "bot";
   status?: "sent" | "received" | "seen" | "ok";
   audio?: string; // Base64 encoded audio
+  intent?: string; // Lex intent behind a bot reply, kept for analytics
 }
 
 interface ChatbotProps {
@@ -89,52 +90,63 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
     }
   }, [open, openChatbox]);
 
+  // Play an audio source for a message, releasing the object URL when done
+  const playAudio = useCallback((audioSrc: string, messageId: number, revokeUrl: boolean) => {
+    setIsPlayingAudio(messageId);
+    const audio = new Audio(audioSrc);
+    audioRef.current = audio;
+    
+    // Add event listeners for debugging
+    audio.oncanplay = () => console.log("Audio can play now");
+    audio.onerror = (e) => console.error("Audio error:", e);
+    audio.onended = () => {
+      console.log("Audio playback ended");
+      if (revokeUrl) {
+        URL.revokeObjectURL(audioSrc);
+      }
+      setIsPlayingAudio(null);
+    };
+    
+    // Play with user interaction handling
+    const playPromise = audio.play();
+    
+    if (playPromise !== undefined) {
+      playPromise
+        .then(() => {
+          console.log("Audio playback started successfully");
+        })
+        .catch(error => {
+          console.error("Playback prevented by browser:", error);
+          // Reset playing state on error
+          setIsPlayingAudio(null);
+          
+          // Alert the user about autoplay restrictions if that's the issue
+          if (error.name === "NotAllowedError") {
+            console.warn("Audio playback was prevented due to browser autoplay policy");
+            // You could show a UI notification here if needed
+          }
+        });
+    }
+  }, []);
+
   // Function to convert text to speech using Amazon Polly - define BEFORE botResponse
   const textToSpeech = useCallback(async (text: string, messageId: number) => {
     try {
       setIsPlayingAudio(messageId);
       console.log("Requesting speech synthesis for:", text.substring(0, 30) + "...");
       
+      // Request raw MP3 bytes instead of base64 inside JSON
       const response = await axios.post(`${config.API_BASE_URL}/speech`, {
         text: text,
         voice: "Joanna"
+      }, {
+        headers: { 'Accept': 'audio/mpeg' },
+        responseType: 'blob'
       });
       
-      if (response.data.audio) {
-        console.log("Received audio data, length:", response.data.audio.length);
-        
-        // Create audio element
-        const audio = new Audio(`data:audio/mp3;base64,${response.data.audio}`);
-        audioRef.current = audio;
-        
-        // Add event listeners for debugging
-        audio.oncanplay = () => console.log("Audio can play now");
-        audio.onerror = (e) => console.error("Audio error:", e);
-        audio.onended = () => {
-          console.log("Audio playback ended");
-          setIsPlayingAudio(null);
-        };
-        
-        // Play with user interaction handling
-        const playPromise = audio.play();
-        
-        if (playPromise !== undefined) {
-          playPromise
-            .then(() => {
-              console.log("Audio playback started successfully");
-            })
-            .catch(error => {
-              console.error("Playback prevented by browser:", error);
-              // Reset playing state on error
-              setIsPlayingAudio(null);
-              
-              // Alert the user about autoplay restrictions if that's the issue
-              if (error.name === "NotAllowedError") {
-                console.warn("Audio playback was prevented due to browser autoplay policy");
-                // You could show a UI notification here if needed
-              }
-            });
-        }
+      if (response.data && response.data.size > 0) {
+        console.log("Received audio data, size:", response.data.size);
+        playAudio(URL.createObjectURL(response.data), messageId, true);
       } else {
         console.error("No audio data in response");
         setIsPlayingAudio(null);
@@ -143,14 +155,17 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
       console.error("Error converting text to speech:", error);
       setIsPlayingAudio(null);
     }
-  }, []);
+  }, [playAudio]);
 
   // Send message to bot and get response
   const botResponse = useCallback(async (message: string) => {
     try {
-      const response = await axios.post(`${config.API_BASE_URL}/chat`, {
+      // With auto-speak on, one request returns both the reply and its audio
+      const chatUrl = autoSpeakResponses ? `${config.API_BASE_URL}/chat?speak=true` : `${config.API_BASE_URL}/chat`;
+      const response = await axios.post(chatUrl, {
         message: message,
-        session_id: sessionId
+        session_id: sessionId,
+        voice: "Joanna"
       }, {
         headers: {
           'Content-Type': 'application/json',
@@ -176,6 +191,7 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
           }),
           date: new Date().toLocaleDateString(),
           sender: "bot",
+          intent: response.data.intent || undefined,
         };
 
         setMessages((prevMessages) => [...prevMessages, botMessage]);
@@ -183,8 +199,14 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
         // Auto-speak the response if enabled - moved after adding message to state
         if (autoSpeakResponses) {
           console.log("Auto-speak is enabled, playing audio...");
+          const audioData = response.data.audio;
           setTimeout(() => {
-            textToSpeech(response.data.text, botMessage.id);
+            if (audioData) {
+              playAudio(`data:audio/mp3;base64,${audioData}`, botMessage.id, false);
+            } else {
+              // Fall back to a separate synthesis request if the combined call had no audio
+              textToSpeech(response.data.text, botMessage.id);
+            }
           }, 800); // Increased timeout to ensure message is rendered first
         }
       } else {
@@ -205,9 +227,15 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
     } catch (error) {
       console.error("Error communicating with the server:", error);
       
+      // 429: the server is shedding load and says when to retry
+      const retryAfter = axios.isAxiosError(error) && error.response?.status === 429
+        ? error.response.headers['retry-after']
+        : null;
       const errorMessage: Message = {
         id: Date.now() + 1,
-        text: "Sorry, I'm having trouble connecting to the server. Please try again later.",
+        text: retryAfter
+          ? `We're receiving a lot of messages right now. Please try again in ${retryAfter} second${retryAfter === "1" ? "" : "s"}.`
+          : "Sorry, I'm having trouble connecting to the server. Please try again later.",
         time: new Date().toLocaleTimeString([], {
           hour: "2-digit",
           minute: "2-digit",
@@ -220,7 +248,7 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
     } finally {
       setIsLoading(false);
     }
-  }, [sessionId, autoSpeakResponses, textToSpeech]);
+  }, [sessionId, autoSpeakResponses, textToSpeech, playAudio]);
 
   // Handle initial message if provided
   useEffect(() => {
@@ -329,7 +357,10 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
   const startRecording = async () => {
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-      const mediaRecorder = new MediaRecorder(stream);
+      // Prefer Ogg/Opus where the browser supports it: it can be transcribed by the
+      // streaming path, while webm falls back to a batch transcription job
+      const mimeType = MediaRecorder.isTypeSupported('audio/ogg;codecs=opus') ? 'audio/ogg;codecs=opus' : 'audio/webm';
+      const mediaRecorder = new MediaRecorder(stream, { mimeType });
       mediaRecorderRef.current = mediaRecorder;
       chunksRef.current = [];
 
@@ -340,75 +371,47 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
       };
 
       mediaRecorder.onstop = async () => {
-        const audioBlob = new Blob(chunksRef.current, { type: 'audio/webm' });
+        const audioBlob = new Blob(chunksRef.current, { type: mimeType });
         
-        // Convert blob to base64
-        const reader = new FileReader();
-        reader.readAsDataURL(audioBlob);
-        reader.onloadend = async () => {
-          const base64data = reader.result?.toString().split(',')[1];
+        if (audioBlob.size > 0) {
+          console.log("Audio recorded, size:", audioBlob.size);
           
-          if (base64data) {
-            console.log("Audio converted to base64, size:", base64data.length);
+          try {
+            // Send the recording as a raw binary body rather than base64 JSON
+            console.log("Sending audio to transcribe endpoint...");
+            const transcribeResponse = await axios.post(`${config.API_BASE_URL}/transcribe`, audioBlob, {
+              headers: { 'Content-Type': mimeType }
+            });
+            
+            console.log("Transcribe response:", transcribeResponse.data);
             
-            try {
-              // Send audio to transcribe endpoint
-              console.log("Sending audio to transcribe endpoint...");
-              const transcribeResponse = await axios.post(`${config.API_BASE_URL}/transcribe`, {
-                audio: base64data,
-                content_type: 'audio/webm'
-              });
+            if (transcribeResponse.data.text) {
+              const transcribedText = transcribeResponse.data.text;
+              console.log("Transcribed text:", transcribedText);
               
-              console.log("Transcribe response:", transcribeResponse.data);
+              // Add user message with transcribed text
+              const newMessage: Message = {
+                id: Date.now(),
+                text: transcribedText,
+                time: new Date().toLocaleTimeString([], {
+                  hour: "2-digit",
+                  minute: "2-digit",
+                }),
+                date: new Date().toLocaleDateString(),
+                sender: "user",
+                status: "sent",
+              };
               
-              if (transcribeResponse.data.text) {
-                const transcribedText = transcribeResponse.data.text;
-                console.log("Transcribed text:", transcribedText);
-                
-                // Add user message with transcribed text
-                const newMessage: Message = {
-                  id: Date.now(),
-                  text: transcribedText,
-                  time: new Date().toLocaleTimeString([], {
-                    hour: "2-digit",
-                    minute: "2-digit",
-                  }),
-                  date: new Date().toLocaleDateString(),
-                  sender: "user",
-                  status: "sent",
-                };
-                
-                setMessages((prevMessages) => [...prevMessages, newMessage]);
-                botResponse(transcribedText);
-              } else if (transcribeResponse.data.error) {
-                console.error("Transcription error:", transcribeResponse.data.error);
-                setIsLoading(false);
-                
-                // Add an error message to the chat
-                const errorMessage: Message = {
-                  id: Date.now(),
-                  text: "Sorry, I couldn't understand the audio. Please try again or type your message.",
-                  time: new Date().toLocaleTimeString([], {
-                    hour: "2-digit",
-                    minute: "2-digit",
-                  }),
-                  date: new Date().toLocaleDateString(),
-                  sender: "bot",
-                };
-                
-                setMessages((prevMessages) => [...prevMessages, errorMessage]);
-              } else {
-                setIsLoading(false);
-                console.error("Empty transcription result");
-              }
-            } catch (error) {
+              setMessages((prevMessages) => [...prevMessages, newMessage]);
+              botResponse(transcribedText);
+            } else if (transcribeResponse.data.error) {
+              console.error("Transcription error:", transcribeResponse.data.error);
               setIsLoading(false);
-              console.error("Error transcribing audio:", error);
               
               // Add an error message to the chat
               const errorMessage: Message = {
                 id: Date.now(),
-                text: "Sorry, there was an error processing your audio. Please try again later or type your message.",
+                text: "Sorry, I couldn't understand the audio. Please try again or type your message.",
                 time: new Date().toLocaleTimeString([], {
                   hour: "2-digit",
                   minute: "2-digit",
@@ -418,9 +421,29 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
               };
               
               setMessages((prevMessages) => [...prevMessages, errorMessage]);
+            } else {
+              setIsLoading(false);
+              console.error("Empty transcription result");
             }
+          } catch (error) {
+            setIsLoading(false);
+            console.error("Error transcribing audio:", error);
+            
+            // Add an error message to the chat
+            const errorMessage: Message = {
+              id: Date.now(),
+              text: "Sorry, there was an error processing your audio. Please try again later or type your message.",
+              time: new Date().toLocaleTimeString([], {
+                hour: "2-digit",
+                minute: "2-digit",
+              }),
+              date: new Date().toLocaleDateString(),
+              sender: "bot",
+            };
+            
+            setMessages((prevMessages) => [...prevMessages, errorMessage]);
           }
-        };
+        }
         
         // Stop all tracks on the stream
         stream.getTracks().forEach(track => track.stop());
@@ -448,14 +471,20 @@ export default function Chatbot({ initialMessage, open }: ChatbotProps) {
   const saveConversation = useCallback(async () => {
     if (messages.length > 1 && sessionId) { // Only save if there are actual messages
       try {
+        // Same conversation state, same key: a retried or repeated save is not written twice
+        const lastMessage = messages[messages.length - 1];
         await axios.post(`${config.API_BASE_URL}/save-conversation`, {
           session_id: sessionId,
           messages: messages.map(msg => ({
+            id: msg.id,
             text: msg.text,
             time: msg.time, 
             date: msg.date,
-            sender: msg.sender
+            sender: msg.sender,
+            intent: msg.intent
           }))
+        }, {
+          headers: { 'Idempotency-Key': `${sessionId}:${messages.length}:${lastMessage.id}` }
         });
         console.log("Conversation saved to S3");
       } catch (error) {
@@ -1,15 +1,30 @@
 from chalice import Chalice, Response, BadRequestError, CORSConfig
 import uuid
 import logging
-import json
-import boto3
-import os
-from chalicelib.utils.lex_utils import init_lex_client, send_message_to_lex
-from chalicelib.utils.polly_utils import init_polly_client, text_to_speech
-from chalicelib.utils.dynamo_utils import init_dynamodb, store_conversation, get_conversation_history
-from chalicelib.utils.transcribe_utils import init_transcribe_client, speech_to_text
-from chalicelib.utils.s3_utils import init_s3_client, store_conversation_in_s3
-from datetime import datetime
+from chalicelib.utils.lex_utils import init_lex_client, send_message_to_lex, get_lex_gateway, last_dialog_action
+from chalicelib.utils.faq_cache_utils import lookup_faq_answer, learn_faq_answer, get_faq_cache_stats
+from chalicelib.utils.polly_utils import init_polly_client, text_to_speech, speech_to_audio, speech_to_url, synthesize_segments
+from chalicelib.utils.audio_cache_utils import get_cache_stats
+from chalicelib.utils.prompt_pack_utils import get_prompt_pack_stats
+from chalicelib.utils.dynamo_utils import init_dynamodb, store_conversation, query_conversation_history
+from chalicelib.utils.dynamo_writer_utils import DYNAMO_FLUSH_ON_RESPONSE, DYNAMO_FLUSH_TIMEOUT, flush_writes, get_write_metrics
+from chalicelib.utils.transcribe_utils import (
+    init_transcribe_client, speech_to_text, submit_speech_to_text, get_transcription_result,
+    transcribe_audio_bytes, start_transcription, create_upload_url, transcribe_uploaded_audio
+)
+from chalicelib.utils.s3_utils import init_s3_client
+from chalicelib.utils.manifest_utils import save_conversation_delta
+from chalicelib.utils.archive_utils import ARCHIVE_FLUSH_ON_RESPONSE, ARCHIVE_FLUSH_TIMEOUT, flush_archive, get_archive_metrics
+from chalicelib.utils.startup_utils import warm_up, timed_init, mark_first_request, get_startup_report
+from chalicelib.utils.tracing_utils import start_trace, end_trace, submit_with_context, get_tracing_stats
+from chalicelib.utils.admission_utils import admit, get_admission_stats
+from chalicelib.utils.resilience_utils import start_deadline, end_deadline, time_left, get_resilience_stats
+from chalicelib.utils.preclassifier_utils import classify, local_answer, record_shadow, get_preclassifier_stats
+from chalicelib.utils.audio_preprocess_utils import get_audio_preprocess_stats
+from chalicelib.utils.prefetch_utils import (
+    PREFETCH_FLUSH_ON_RESPONSE, PREFETCH_FLUSH_TIMEOUT, observe_turn, flush_prefetches, get_prefetch_stats
+)
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -21,18 +36,97 @@ app = Chalice(app_name='dental-chatbot')
 # Configure CORS for frontend integration
 cors_config = CORSConfig(
     allow_origin='*',  # For development; restrict in production
-    allow_headers=['Content-Type', 'X-Amz-Date', 'Authorization', 'X-Api-Key'],
+    allow_headers=['Content-Type', 'X-Amz-Date', 'Authorization', 'X-Api-Key', 'Idempotency-Key'],
     max_age=600,
-    expose_headers=['X-Request-ID'],
+    expose_headers=['X-Request-ID', 'X-Audio-Cache', 'Server-Timing', 'Retry-After'],
     allow_credentials=True
 )
 
-# Initialize clients on cold starts
-lex_initialized = init_lex_client()
-polly_initialized = init_polly_client()
-dynamo_initialized = init_dynamodb()
-transcribe_initialized = init_transcribe_client()
-s3_initialized = init_s3_client()
+# Clients are initialized lazily by the endpoints that need them, so /chat never
+# waits on Transcribe or S3. Services listed in WARMUP_SERVICES are warmed concurrently
+# on cold start; resource existence checks run at deploy time (tools/provision.py).
+initializers = {
+    'lex': init_lex_client,
+    'polly': init_polly_client,
+    'dynamodb': init_dynamodb,
+    'transcribe': init_transcribe_client,
+    's3': init_s3_client
+}
+warmed = warm_up(initializers)
+lex_initialized = warmed.get('lex', False)
+polly_initialized = warmed.get('polly', False)
+dynamo_initialized = warmed.get('dynamodb', False)
+transcribe_initialized = warmed.get('transcribe', False)
+s3_initialized = warmed.get('s3', False)
+
+def request_session_key(request):
+    """Key a request's per-session bucket on its session ID, or on the caller's IP when there is none"""
+    session_id = request.headers.get('x-session-id')
+    if not session_id and request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            body = request.json_body
+            session_id = body.get('session_id') if isinstance(body, dict) else None
+        except BadRequestError:
+            session_id = None
+    if session_id:
+        return str(session_id)
+    return request.context.get('identity', {}).get('sourceIp')
+
+@app.middleware('http')
+def record_first_request(event, get_response):
+    """Log the startup report once, when the first request arrives"""
+    mark_first_request()
+    return get_response(event)
+
+@app.middleware('http')
+def trace_requests(event, get_response):
+    """Time each request by stage and return X-Request-ID and Server-Timing headers"""
+    request_id = event.headers.get('x-request-id') or event.context.get('requestId')
+    trace, token = start_trace(request_id, event.context.get('resourcePath') or event.path)
+    if trace is None:
+        return get_response(event)
+    response = get_response(event)
+    response.headers.update(end_trace(trace, token, response.status_code))
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.middleware('http')
+def admit_requests(event, get_response):
+    """Shed load with a fast 429 when the session's or the route's token bucket is empty"""
+    if event.method == 'OPTIONS':
+        return get_response(event)
+    route = event.context.get('resourcePath') or event.path
+    admitted, retry_after = admit(route, request_session_key(event))
+    if admitted:
+        return get_response(event)
+    logger.warning(f"Shedding {event.method} {route} (retry after {retry_after}s)")
+    return Response(
+        body={'error': 'Too many requests, please retry shortly', 'status': 'error', 'retry_after': retry_after},
+        # Returned before routing, so the CORS headers are added here
+        headers=dict(cors_config.get_access_control_headers(), **{'Retry-After': str(retry_after)}),
+        status_code=429
+    )
+
+@app.middleware('http')
+def apply_deadline(event, get_response):
+    """Bound upstream calls by the time this invocation has left"""
+    token = start_deadline(event.lambda_context)
+    try:
+        return get_response(event)
+    finally:
+        end_deadline(token)
+
+@app.middleware('http')
+def flush_conversation_writes(event, get_response):
+    """Drain queued DynamoDB writes, due archive buffers and prompt prefetches before the invocation ends and Lambda freezes, within the deadline"""
+    response = get_response(event)
+    if DYNAMO_FLUSH_ON_RESPONSE and not flush_writes(time_left(DYNAMO_FLUSH_TIMEOUT)):
+        logger.warning("Conversation writes still pending after flush timeout")
+    if ARCHIVE_FLUSH_ON_RESPONSE and not flush_archive(time_left(ARCHIVE_FLUSH_TIMEOUT), force=False):
+        logger.warning("Archive buffers due to roll still pending after flush timeout")
+    if PREFETCH_FLUSH_ON_RESPONSE and not flush_prefetches(time_left(PREFETCH_FLUSH_TIMEOUT)):
+        logger.warning("Prompt prefetches still running after flush timeout")
+    return response
 
 @app.route('/', methods=['GET'], cors=cors_config)
 def index():
@@ -41,7 +135,7 @@ def index():
         'status': 'ok',
         'message': 'Dental Chatbot API is running (Serverless)',
         'version': '1.0',
-        'endpoints': ['/chat', '/health', '/speech', '/transcribe', '/save-conversation']
+        'endpoints': ['/chat', '/health', '/history/{session_id}', '/speech', '/transcribe', '/save-conversation']
     }
 
 @app.route('/health', methods=['GET'], cors=cors_config)
@@ -52,9 +146,106 @@ def health_check():
         'timestamp': str(app.current_request.context['requestTimeEpoch'])
     }
 
+@app.route('/health/startup', methods=['GET'], cors=cors_config)
+def startup_report():
+    """Report cold-start initialization timings for this container"""
+    return {
+        'status': 'ok',
+        'startup': get_startup_report()
+    }
+
+@app.route('/health/writes', methods=['GET'], cors=cors_config)
+def write_metrics():
+    """Report queue depth and drop counters for conversation writes"""
+    return {
+        'status': 'ok',
+        'writes': get_write_metrics(),
+        'archive': get_archive_metrics()
+    }
+
+@app.route('/health/admission', methods=['GET'], cors=cors_config)
+def admission_metrics():
+    """Report token bucket limits and admitted/shed counts per route"""
+    return {
+        'status': 'ok',
+        'admission': get_admission_stats()
+    }
+
+@app.route('/health/tracing', methods=['GET'], cors=cors_config)
+def tracing_metrics():
+    """Report per-stage and per-route latency percentiles collected in this container"""
+    return {
+        'status': 'ok',
+        'tracing': get_tracing_stats()
+    }
+
+@app.route('/health/resilience', methods=['GET'], cors=cors_config)
+def resilience_metrics():
+    """Report circuit breaker state, deadline and hedge counters for Lex and Polly"""
+    return {
+        'status': 'ok',
+        'resilience': get_resilience_stats()
+    }
+
+@app.route('/health/preclassifier', methods=['GET'], cors=cors_config)
+def preclassifier_metrics():
+    """Report local intent answers and shadow-mode agreement with Lex"""
+    return {
+        'status': 'ok',
+        'preclassifier': get_preclassifier_stats()
+    }
+
+@app.route('/health/audio', methods=['GET'], cors=cors_config)
+def audio_preprocess_metrics():
+    """Report how much recordings shrank (bytes and seconds) before transcription"""
+    return {
+        'status': 'ok',
+        'audio': get_audio_preprocess_stats()
+    }
+
+@app.route('/health/prefetch', methods=['GET'], cors=cors_config)
+def prefetch_metrics():
+    """Report how often prefetched prompts were the bot's next reply, and what they cost"""
+    return {
+        'status': 'ok',
+        'prefetch': get_prefetch_stats()
+    }
+
+# Shared pool for work that overlaps within a single chat turn
+turn_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='turn')
+
+def store_turn(session_id, message, lex_response):
+    """Store one chat turn in DynamoDB, initializing the client if needed"""
+    global dynamo_initialized
+    if not dynamo_initialized:
+        dynamo_initialized = timed_init('dynamodb', init_dynamodb)
+    
+    if not dynamo_initialized:
+        logger.warning("DynamoDB not initialized, conversation not stored")
+        return False
+    
+    stored = store_conversation(
+        session_id=session_id,
+        message=message,
+        response=lex_response["text"],
+        intent=lex_response.get("intent"),
+        intent_source=lex_response.get("intent_source")
+    )
+    logger.info(f"Conversation queued for DynamoDB for session {session_id}")
+    return stored
+
+def speak_reply(text, voice):
+    """Synthesize a bot reply through the audio cache, initializing Polly if needed"""
+    global polly_initialized
+    if not polly_initialized:
+        polly_initialized = timed_init('polly', init_polly_client)
+        if not polly_initialized:
+            return {'error': 'Speech synthesis service is currently unavailable.'}
+    return text_to_speech(text, voice)
+
 @app.route('/chat', methods=['POST'], cors=cors_config)
 def process_chat_message():
-    """Process user message and return a response from Amazon Lex"""
+    """Process user message and return a response from Amazon Lex (with audio when speak=true)"""
     try:
         # Parse request body
         request_body = app.current_request.json_body
@@ -75,49 +266,82 @@ def process_chat_message():
             
         logger.info(f"Received chat message: {message}")
         
-        # Ensure Lex client is initialized
-        global lex_initialized
-        if not lex_initialized:
-            lex_initialized = init_lex_client()
+        # Static questions (hours, location, ...) are answered from the FAQ cache without calling Lex,
+        # and small talk (greetings, thanks, ...) by the local pre-classifier when it is confident
+        # and Lex is not in the middle of an intent
+        lex_response = lookup_faq_answer(message)
+        prediction = None
+        if lex_response is None:
+            prediction = classify(message)
+            lex_response = local_answer(prediction, last_dialog_action(session_id), new_session=not request_body.get('session_id'))
+            if lex_response is not None:
+                logger.info(f"Answered by pre-classifier (intent {lex_response['intent']})")
+        
+        if lex_response is None:
+            # Ensure Lex client is initialized
+            global lex_initialized
             if not lex_initialized:
-                logger.error("Failed to initialize Lex client")
+                lex_initialized = timed_init('lex', init_lex_client)
+                if not lex_initialized:
+                    logger.error("Failed to initialize Lex client")
+                    return {
+                        'text': 'Sorry, the dental assistant service is currently unavailable.',
+                        'status': 'error'
+                    }
+            
+            # Send the message to Lex
+            lex_response = send_message_to_lex(session_id, message)
+            
+            if "error" in lex_response:
+                logger.error(f"Error from Lex: {lex_response['error']}")
                 return {
-                    'text': 'Sorry, the dental assistant service is currently unavailable.',
+                    'text': lex_response["text"],
                     'status': 'error'
                 }
+            
+            if lex_response.get("degraded"):
+                logger.warning("Lex unavailable, replying with the fallback message")
+            else:
+                learn_faq_answer(message, lex_response)
+                record_shadow(prediction, lex_response.get("intent"))
+        elif prediction is None:
+            logger.info(f"Answered from FAQ cache (intent {lex_response['intent']})")
         
-        # Send the message to Lex
-        lex_response = send_message_to_lex(session_id, message)
-        
-        if "error" in lex_response:
-            logger.error(f"Error from Lex: {lex_response['error']}")
-            return {
-                'text': lex_response["text"],
-                'status': 'error'
-            }
-        
-        # Store conversation in DynamoDB
-        global dynamo_initialized
-        if not dynamo_initialized:
-            dynamo_initialized = init_dynamodb()
-        
-        if dynamo_initialized:
-            store_conversation(
-                session_id=session_id,
-                message=message,
-                response=lex_response["text"],
-                intent=lex_response.get("intent")
-            )
-            logger.info(f"Conversation stored in DynamoDB for session {session_id}")
-        else:
-            logger.warning("DynamoDB not initialized, conversation not stored")
-        
-        return {
+        result = {
             'text': lex_response["text"],
+            'messages': lex_response.get("messages") or [lex_response["text"]],
             'intent': lex_response.get("intent"),
             'status': 'ok',
             'session_id': session_id
         }
+        if lex_response.get("degraded"):
+            result['degraded'] = True
+        
+        query_params = app.current_request.query_params or {}
+        speak = query_params.get('speak') == 'true' or request_body.get('speak') is True
+        
+        # Learn the dialog flow from Lex's session state; for spoken replies, start synthesizing
+        # the likely next prompts while this one is stored and spoken
+        observe_turn(session_id, lex_response, request_body.get('voice', 'Joanna'), prefetch=speak)
+        
+        if not speak:
+            store_turn(session_id, message, lex_response)
+            return result
+        
+        # Chat-and-speak: persist in the background while synthesizing on this thread
+        store_future = submit_with_context(turn_executor, store_turn, session_id, message, lex_response)
+        speech_response = speak_reply(lex_response["text"], request_body.get('voice', 'Joanna'))
+        store_future.result()
+        
+        if "error" in speech_response:
+            logger.error(f"Error from Polly: {speech_response['error']}")
+            result['audio'] = None
+            result['speech_error'] = speech_response["error"]
+        else:
+            result['audio'] = speech_response["audio"]
+            result['format'] = speech_response["format"]
+            result['voice'] = speech_response["voice"]
+        return result
         
     except Exception as e:
         logger.error(f"Error processing chat message: {str(e)}", exc_info=True)
@@ -135,11 +359,69 @@ def chat_health():
                 logger.warning("Lex client not initialized")
                 return {"status": "warning", "message": "Lex client not connected"}
                 
-        return {"status": "ok", "message": "Chat service is healthy"}
+        gateway = get_lex_gateway()
+        return {
+            "status": "ok",
+            "message": "Chat service is healthy",
+            "gateway": gateway.get_stats() if gateway else None,
+            "faq_cache": get_faq_cache_stats()
+        }
     except Exception as e:
         logger.error(f"Error checking chat health: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+@app.route('/history/{session_id}', methods=['GET'], cors=cors_config)
+def conversation_history(session_id):
+    """Return a page of a session's conversation history"""
+    try:
+        params = app.current_request.query_params or {}
+        try:
+            limit = min(max(int(params.get('limit', 10)), 1), 100)
+        except ValueError:
+            raise BadRequestError('limit must be an integer')
+        order = params.get('order', 'oldest')
+        if order not in ('oldest', 'latest'):
+            raise BadRequestError("order must be 'oldest' or 'latest'")
+        fields = [name.strip() for name in params['fields'].split(',') if name.strip()] if params.get('fields') else None
+        
+        # Ensure DynamoDB is initialized
+        global dynamo_initialized
+        if not dynamo_initialized:
+            dynamo_initialized = timed_init('dynamodb', init_dynamodb)
+            if not dynamo_initialized:
+                logger.error("Failed to initialize DynamoDB")
+                return {
+                    'status': 'error',
+                    'error': 'History service is currently unavailable.'
+                }
+        
+        try:
+            page = query_conversation_history(
+                session_id,
+                limit=limit,
+                cursor=params.get('cursor'),
+                latest=order == 'latest',
+                attributes=fields
+            )
+        except ValueError as e:
+            raise BadRequestError(str(e))
+        
+        return {
+            'status': 'ok',
+            'session_id': session_id,
+            'items': page['items'],
+            'next_cursor': page['next_cursor']
+        }
+        
+    except BadRequestError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading conversation history: {str(e)}", exc_info=True)
+        return Response(
+            body={'status': 'error', 'error': f'Error reading history: {str(e)}'},
+            status_code=500
+        )
+
 @app.route('/speech', methods=['POST'], cors=cors_config)
 def text_to_speech_endpoint():
     """Convert text to speech using Amazon Polly"""
@@ -154,6 +436,7 @@ def text_to_speech_endpoint():
         
         text = request_body.get('text')
         voice = request_body.get('voice', 'Joanna')
+        mode = request_body.get('mode', 'json')
         
         if not text:
             return Response(
@@ -166,13 +449,62 @@ def text_to_speech_endpoint():
         # Ensure Polly client is initialized
         global polly_initialized
         if not polly_initialized:
-            polly_initialized = init_polly_client()
+            polly_initialized = timed_init('polly', init_polly_client)
             if not polly_initialized:
                 logger.error("Failed to initialize Polly client")
                 return {
                     'error': 'Speech synthesis service is currently unavailable.'
                 }
         
+        # Binary mode: raw MP3 body, no base64 or JSON copies
+        accept = app.current_request.headers.get('accept', '')
+        if mode == 'binary' or 'audio/mpeg' in accept:
+            if 'audio/mpeg' not in accept:
+                return Response(
+                    body={'error': 'Binary mode requires an Accept: audio/mpeg header'},
+                    status_code=400
+                )
+            speech_response = speech_to_audio(text, voice)
+            if "error" in speech_response:
+                logger.error(f"Error from Polly: {speech_response['error']}")
+                return Response(
+                    body={'error': speech_response["error"]},
+                    status_code=502
+                )
+            return Response(
+                # Prompt pack hits are memoryviews; Chalice only base64-encodes bytes
+                body=bytes(speech_response["audio"]),
+                headers={
+                    'Content-Type': 'audio/mpeg',
+                    'X-Audio-Cache': 'hit' if speech_response["cached"] else 'miss'
+                },
+                status_code=200
+            )
+        
+        # Segmented mode: sentences synthesized concurrently and cached independently
+        if request_body.get('segmented'):
+            speech_response = synthesize_segments(text, voice, messages=request_body.get('messages'))
+            if "error" in speech_response:
+                logger.error(f"Error from Polly: {speech_response['error']}")
+                return {
+                    'error': speech_response["error"]
+                }
+            return speech_response
+        
+        # Redirect mode: point the client at the cached object in S3
+        if mode == 'redirect':
+            speech_response = speech_to_url(text, voice)
+            if "error" in speech_response:
+                logger.error(f"Error preparing audio URL: {speech_response['error']}")
+                return {
+                    'error': speech_response["error"]
+                }
+            return Response(
+                body=speech_response,
+                headers={'Location': speech_response["url"]},
+                status_code=303
+            )
+        
         # Convert text to speech
         speech_response = text_to_speech(text, voice)
         
@@ -191,22 +523,55 @@ def text_to_speech_endpoint():
             status_code=500
         )
 
-@app.route('/transcribe', methods=['POST'], cors=cors_config)
+@app.route('/speech/cache', methods=['GET'], cors=cors_config)
+def speech_cache_stats():
+    """Return hit/miss counters for the Polly audio cache and the deployed prompt pack"""
+    return {
+        'status': 'ok',
+        'cache': get_cache_stats(),
+        'prompt_pack': get_prompt_pack_stats()
+    }
+
+# Binary audio types accepted as a raw /transcribe body (all in Chalice's default binary_types)
+RAW_AUDIO_TYPES = ['audio/webm', 'audio/ogg', 'audio/wav', 'audio/mpeg', 'audio/mp4', 'application/octet-stream']
+
+@app.route('/transcribe', methods=['POST'], cors=cors_config,
+           content_types=['application/json'] + RAW_AUDIO_TYPES)
 def transcribe_audio():
-    """Convert audio to text using Amazon Transcribe"""
+    """
+    Convert audio to text using Amazon Transcribe
+
+    The audio can be sent as a raw binary body (Content-Type: audio/webm etc., ?async=true for a
+    job token), as JSON with a recording 'key' from /transcribe/upload-url, or as base64 JSON.
+    """
     try:
-        # Parse request body
-        request_body = app.current_request.json_body
-        if not request_body:
-            return Response(
-                body={'error': 'Missing request body'},
-                status_code=400
-            )
+        request = app.current_request
+        request_type = request.headers.get('content-type', 'application/json')
+        raw_upload = not request_type.lower().startswith('application/json')
+        
+        if raw_upload:
+            # Binary body: Chalice hands over the decoded bytes without a JSON/base64 copy
+            request_body = {
+                'content_type': request_type,
+                'async': (request.query_params or {}).get('async', '').lower() == 'true'
+            }
+            audio_data = request.raw_body
+            if request_type.lower().startswith('application/octet-stream'):
+                request_body['content_type'] = (request.query_params or {}).get('content_type', 'audio/webm')
+        else:
+            # Parse request body
+            request_body = request.json_body
+            if not request_body:
+                return Response(
+                    body={'error': 'Missing request body'},
+                    status_code=400
+                )
+            audio_data = request_body.get('audio')
         
-        audio_data = request_body.get('audio')
         content_type = request_body.get('content_type', 'audio/webm')
+        recording_key = request_body.get('key')
         
-        if not audio_data:
+        if not audio_data and not recording_key:
             return Response(
                 body={'error': 'Missing audio parameter'},
                 status_code=400
@@ -217,15 +582,38 @@ def transcribe_audio():
         # Ensure Transcribe client is initialized
         global transcribe_initialized
         if not transcribe_initialized:
-            transcribe_initialized = init_transcribe_client()
+            transcribe_initialized = timed_init('transcribe', init_transcribe_client)
             if not transcribe_initialized:
                 logger.error("Failed to initialize Transcribe client")
                 return {
                     'error': 'Speech recognition service is currently unavailable.'
                 }
         
+        # Async mode: start the job and hand back a token instead of holding the connection open
+        if request_body.get('async'):
+            if recording_key:
+                submit_response = transcribe_uploaded_audio(recording_key, content_type, wait=False)
+            elif raw_upload:
+                submit_response = start_transcription(audio_data, content_type)
+            else:
+                submit_response = submit_speech_to_text(audio_data, content_type)
+            if "error" in submit_response:
+                logger.error(f"Error starting transcription: {submit_response['error']}")
+                return {
+                    'error': submit_response["error"]
+                }
+            return Response(
+                body={'token': submit_response["token"], 'status': 'IN_PROGRESS'},
+                status_code=202
+            )
+        
         # Convert speech to text
-        transcribe_response = speech_to_text(audio_data, content_type)
+        if recording_key:
+            transcribe_response = transcribe_uploaded_audio(recording_key, content_type)
+        elif raw_upload:
+            transcribe_response = transcribe_audio_bytes(audio_data, content_type)
+        else:
+            transcribe_response = speech_to_text(audio_data, content_type)
         
         if "error" in transcribe_response:
             logger.error(f"Error from Transcribe: {transcribe_response['error']}")
@@ -233,9 +621,12 @@ def transcribe_audio():
                 'error': transcribe_response["error"]
             }
         
-        return {
+        result = {
             'text': transcribe_response["text"]
         }
+        if "partials" in transcribe_response:
+            result['partials'] = transcribe_response["partials"]
+        return result
         
     except Exception as e:
         logger.error(f"Error processing transcription request: {str(e)}", exc_info=True)
@@ -244,9 +635,66 @@ def transcribe_audio():
             status_code=500
         )
 
+@app.route('/transcribe/upload-url', methods=['POST'], cors=cors_config)
+def transcribe_upload_url():
+    """Presign a direct browser upload to the recordings bucket; pass the returned key to /transcribe"""
+    try:
+        request_body = app.current_request.json_body or {}
+        upload = create_upload_url(request_body.get('content_type', 'audio/webm'))
+        
+        if "error" in upload:
+            return Response(
+                body={'error': upload["error"]},
+                status_code=400
+            )
+        return upload
+        
+    except Exception as e:
+        logger.error(f"Error creating upload URL: {str(e)}", exc_info=True)
+        return Response(
+            body={'error': f'Error creating upload URL: {str(e)}'},
+            status_code=500
+        )
+
+@app.route('/transcribe/{token}', methods=['GET'], cors=cors_config)
+def transcribe_result(token):
+    """Return the status or result of an asynchronous transcription"""
+    try:
+        result = get_transcription_result(token)
+        
+        if result["status"] == 'FAILED':
+            logger.error(f"Transcription {token} failed: {result['error']}")
+            return {
+                'status': 'FAILED',
+                'error': result["error"]
+            }
+        
+        if result["status"] == 'IN_PROGRESS':
+            return Response(
+                body={'token': token, 'status': 'IN_PROGRESS'},
+                status_code=202
+            )
+        
+        return {
+            'status': 'COMPLETED',
+            'text': result["text"]
+        }
+        
+    except Exception as e:
+        logger.error(f"Error fetching transcription result: {str(e)}", exc_info=True)
+        return Response(
+            body={'error': f'Error fetching transcription result: {str(e)}'},
+            status_code=500
+        )
+
 @app.route('/save-conversation', methods=['POST'], cors=cors_config)
 def save_conversation():
-    """Save a complete conversation to S3"""
+    """
+    Save a conversation to S3
+
+    Only messages not stored by an earlier save of the same session are written. Repeating a
+    request with the same Idempotency-Key header returns the first result without writing again.
+    """
     try:
         # Parse request body
         request_body = app.current_request.json_body
@@ -264,13 +712,18 @@ def save_conversation():
                 body={'error': 'Missing required parameters'},
                 status_code=400
             )
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            return Response(
+                body={'error': 'messages must be a list of objects'},
+                status_code=400
+            )
             
         logger.info(f"Saving conversation for session {session_id}")
         
         # Ensure S3 client is initialized
         global s3_initialized
         if not s3_initialized:
-            s3_initialized = init_s3_client()
+            s3_initialized = timed_init('s3', init_s3_client)
             if not s3_initialized:
                 logger.error("Failed to initialize S3 client")
                 return {
@@ -278,24 +731,23 @@ def save_conversation():
                     'error': 'Storage service is currently unavailable.'
                 }
         
-        # Format conversation data
-        conversation_data = {
-            'session_id': session_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'messages': messages
-        }
-        
-        # Store in S3
-        success = store_conversation_in_s3(session_id, conversation_data)
+        # Store the messages that are new since the last save
+        idempotency_key = app.current_request.headers.get('idempotency-key')
+        save_response = save_conversation_delta(session_id, messages, idempotency_key)
         
-        if not success:
+        if "error" in save_response:
+            logger.error(f"Error saving conversation: {save_response['error']}")
             return {
                 'success': False,
                 'error': 'Failed to store conversation'
             }
         
         return {
-            'success': True
+            'success': True,
+            'stored': save_response["stored"],
+            'total': save_response["total"],
+            'duplicate': save_response["duplicate"],
+            'pending': save_response["pending"]
         }
         
     except Exception as e:
@@ -0,0 +1,382 @@
+"""
+Asyncio serving mode for container deployments, next to the Chalice/Lambda entry point in app.py.
+
+Serves /chat, /speech, /transcribe and /save-conversation from one event loop. Blocking util
+calls run on a thread pool behind a semaphore per upstream service (chalicelib/utils/async_utils.py),
+so one process keeps many Lex, Polly and Transcribe calls in flight at once:
+
+    pip install uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+import logging
+import uuid
+from urllib.parse import parse_qsl
+from chalicelib.utils.lex_utils import init_lex_client, last_dialog_action
+from chalicelib.utils.faq_cache_utils import lookup_faq_answer, learn_faq_answer
+from chalicelib.utils.polly_utils import init_polly_client, speech_to_url
+from chalicelib.utils.dynamo_utils import init_dynamodb
+from chalicelib.utils.dynamo_writer_utils import flush_writes
+from chalicelib.utils.transcribe_utils import (
+    init_transcribe_client, start_transcription, submit_speech_to_text, transcribe_uploaded_audio
+)
+from chalicelib.utils.s3_utils import init_s3_client
+from chalicelib.utils.archive_utils import flush_archive
+from chalicelib.utils.startup_utils import warm_up, timed_init, mark_first_request
+from chalicelib.utils.tracing_utils import start_trace, end_trace
+from chalicelib.utils.admission_utils import ADMISSION_BACKEND, admit
+from chalicelib.utils.resilience_utils import start_deadline, end_deadline, get_resilience_stats
+from chalicelib.utils.preclassifier_utils import classify, local_answer, record_shadow
+from chalicelib.utils.prefetch_utils import observe_turn
+from chalicelib.utils.async_utils import (
+    run_blocking, get_async_stats, send_message_to_lex_async, text_to_speech_async, speech_to_audio_async,
+    synthesize_segments_async, transcribe_audio_bytes_async, speech_to_text_async,
+    transcribe_uploaded_audio_async, store_conversation_async, save_conversation_delta_async
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'X-Request-ID,X-Audio-Cache,Server-Timing,Retry-After'
+}
+PREFLIGHT_HEADERS = dict(
+    CORS_HEADERS,
+    **{
+        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,Idempotency-Key',
+        'Access-Control-Max-Age': '600'
+    }
+)
+RAW_AUDIO_TYPES = ['audio/webm', 'audio/ogg', 'audio/wav', 'audio/mpeg', 'audio/mp4', 'application/octet-stream']
+
+# Same lazy/warm initialization as app.py
+initializers = {
+    'lex': init_lex_client,
+    'polly': init_polly_client,
+    'dynamodb': init_dynamodb,
+    'transcribe': init_transcribe_client,
+    's3': init_s3_client
+}
+initialized = warm_up(initializers)
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_params = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        self.raw_body = body
+        self.client_ip = (scope.get('client') or (None,))[0]
+
+    @property
+    def json_body(self):
+        if not self.raw_body:
+            return None
+        return json.loads(self.raw_body)
+
+    def session_key(self):
+        """Session ID for admission control, or the caller's IP when there is none"""
+        session_id = self.headers.get('x-session-id')
+        if not session_id and self.headers.get('content-type', '').startswith('application/json'):
+            try:
+                body = self.json_body
+                session_id = body.get('session_id') if isinstance(body, dict) else None
+            except ValueError:
+                session_id = None
+        return str(session_id) if session_id else self.client_ip
+
+async def admit_request(request: Request):
+    """Token bucket check; the DynamoDB backend blocks, so it runs off the event loop"""
+    if ADMISSION_BACKEND == 'dynamodb':
+        return await run_blocking('dynamodb', admit, request.path, request.session_key())
+    return admit(request.path, request.session_key())
+
+async def ensure_initialized(name: str) -> bool:
+    """Initialize a service client off the event loop if warm-up did not"""
+    if not initialized.get(name):
+        loop = asyncio.get_running_loop()
+        initialized[name] = await loop.run_in_executor(None, timed_init, name, initializers[name])
+    return initialized[name]
+
+async def chat(request: Request):
+    """Process a user message through the FAQ cache or Lex (with audio when speak=true)"""
+    request_body = request.json_body
+    if not request_body:
+        return 400, {'text': 'Missing request body', 'status': 'error'}
+
+    message = request_body.get('message')
+    session_id = request_body.get('session_id') or str(uuid.uuid4())
+    if not message:
+        return 400, {'text': 'Missing message parameter', 'status': 'error'}
+
+    lex_response = lookup_faq_answer(message)
+    prediction = None
+    if lex_response is None:
+        prediction = classify(message)
+        lex_response = local_answer(prediction, last_dialog_action(session_id), new_session=not request_body.get('session_id'))
+    if lex_response is None:
+        lex_response = await send_message_to_lex_async(session_id, message)
+        if "error" in lex_response:
+            logger.error(f"Error from Lex: {lex_response['error']}")
+            return 200, {'text': lex_response["text"], 'status': 'error'}
+        if not lex_response.get("degraded"):
+            learn_faq_answer(message, lex_response)
+            record_shadow(prediction, lex_response.get("intent"))
+
+    result = {
+        'text': lex_response["text"],
+        'messages': lex_response.get("messages") or [lex_response["text"]],
+        'intent': lex_response.get("intent"),
+        'status': 'ok',
+        'session_id': session_id
+    }
+    if lex_response.get("degraded"):
+        result['degraded'] = True
+    store = store_conversation_async(session_id, message, lex_response["text"], lex_response.get("intent"),
+                                     lex_response.get("intent_source"))
+
+    speak = request.query_params.get('speak') == 'true' or request_body.get('speak') is True
+    observe_turn(session_id, lex_response, request_body.get('voice', 'Joanna'), prefetch=speak)
+    if not speak:
+        await store
+        return 200, result
+
+    # The DynamoDB write and the synthesis overlap, as in app.py
+    _, speech_response = await asyncio.gather(store, text_to_speech_async(lex_response["text"], request_body.get('voice', 'Joanna')))
+    if "error" in speech_response:
+        logger.error(f"Error from Polly: {speech_response['error']}")
+        result['audio'] = None
+        result['speech_error'] = speech_response["error"]
+    else:
+        result['audio'] = speech_response["audio"]
+        result['format'] = speech_response["format"]
+        result['voice'] = speech_response["voice"]
+    return 200, result
+
+async def speech(request: Request):
+    """Convert text to speech (JSON, binary, segmented or redirect), as POST /speech in app.py"""
+    request_body = request.json_body
+    if not request_body:
+        return 400, {'error': 'Missing request body'}
+
+    text = request_body.get('text')
+    voice = request_body.get('voice', 'Joanna')
+    mode = request_body.get('mode', 'json')
+    if not text:
+        return 400, {'error': 'Missing text parameter'}
+
+    accept = request.headers.get('accept', '')
+    if mode == 'binary' or 'audio/mpeg' in accept:
+        if 'audio/mpeg' not in accept:
+            return 400, {'error': 'Binary mode requires an Accept: audio/mpeg header'}
+        speech_response = await speech_to_audio_async(text, voice)
+        if "error" in speech_response:
+            return 502, {'error': speech_response["error"]}
+        return 200, speech_response["audio"], {
+            'Content-Type': 'audio/mpeg',
+            'X-Audio-Cache': 'hit' if speech_response["cached"] else 'miss'
+        }
+
+    if request_body.get('segmented'):
+        speech_response = await synthesize_segments_async(text, voice, request_body.get('messages'))
+    elif mode == 'redirect':
+        speech_response = await run_blocking('polly', speech_to_url, text, voice)
+        if "error" not in speech_response:
+            return 303, speech_response, {'Location': speech_response["url"]}
+    else:
+        speech_response = await text_to_speech_async(text, voice)
+
+    if "error" in speech_response:
+        logger.error(f"Error from Polly: {speech_response['error']}")
+        return 200, {'error': speech_response["error"]}
+    return 200, speech_response
+
+async def transcribe(request: Request):
+    """Convert audio to text from a raw body, an uploaded recording key or base64 JSON"""
+    request_type = request.headers.get('content-type', 'application/json')
+    raw_upload = not request_type.lower().startswith('application/json')
+
+    if raw_upload:
+        if request_type.lower().split(';')[0].strip() not in RAW_AUDIO_TYPES:
+            return 415, {'error': f'Unsupported content type {request_type}'}
+        request_body = {
+            'content_type': request_type,
+            'async': request.query_params.get('async', '').lower() == 'true'
+        }
+        audio_data = request.raw_body
+        if request_type.lower().startswith('application/octet-stream'):
+            request_body['content_type'] = request.query_params.get('content_type', 'audio/webm')
+    else:
+        request_body = request.json_body
+        if not request_body:
+            return 400, {'error': 'Missing request body'}
+        audio_data = request_body.get('audio')
+
+    content_type = request_body.get('content_type', 'audio/webm')
+    recording_key = request_body.get('key')
+    if not audio_data and not recording_key:
+        return 400, {'error': 'Missing audio parameter'}
+
+    if not await ensure_initialized('transcribe'):
+        return 200, {'error': 'Speech recognition service is currently unavailable.'}
+
+    if request_body.get('async'):
+        if recording_key:
+            submit_response = await run_blocking('transcribe', transcribe_uploaded_audio, recording_key, content_type, False)
+        elif raw_upload:
+            submit_response = await run_blocking('transcribe', start_transcription, audio_data, content_type)
+        else:
+            submit_response = await run_blocking('transcribe', submit_speech_to_text, audio_data, content_type)
+        if "error" in submit_response:
+            return 200, {'error': submit_response["error"]}
+        return 202, {'token': submit_response["token"], 'status': 'IN_PROGRESS'}
+
+    if recording_key:
+        transcribe_response = await transcribe_uploaded_audio_async(recording_key, content_type)
+    elif raw_upload:
+        transcribe_response = await transcribe_audio_bytes_async(audio_data, content_type)
+    else:
+        transcribe_response = await speech_to_text_async(audio_data, content_type)
+
+    if "error" in transcribe_response:
+        logger.error(f"Error from Transcribe: {transcribe_response['error']}")
+        return 200, {'error': transcribe_response["error"]}
+
+    result = {'text': transcribe_response["text"]}
+    if "partials" in transcribe_response:
+        result['partials'] = transcribe_response["partials"]
+    return 200, result
+
+async def save_conversation(request: Request):
+    """Store the messages of a conversation that are new since its last save"""
+    request_body = request.json_body
+    if not request_body:
+        return 400, {'error': 'Missing request body'}
+
+    session_id = request_body.get('session_id')
+    messages = request_body.get('messages')
+    if not session_id or not messages:
+        return 400, {'error': 'Missing required parameters'}
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        return 400, {'error': 'messages must be a list of objects'}
+
+    if not await ensure_initialized('s3'):
+        return 200, {'success': False, 'error': 'Storage service is currently unavailable.'}
+
+    save_response = await save_conversation_delta_async(session_id, messages, request.headers.get('idempotency-key'))
+    if "error" in save_response:
+        logger.error(f"Error saving conversation: {save_response['error']}")
+        return 200, {'success': False, 'error': 'Failed to store conversation'}
+    return 200, {
+        'success': True,
+        'stored': save_response["stored"],
+        'total': save_response["total"],
+        'duplicate': save_response["duplicate"],
+        'pending': save_response["pending"]
+    }
+
+async def health(request: Request):
+    return 200, {'status': 'healthy', 'mode': 'asgi'}
+
+async def async_health(request: Request):
+    """Report per-service concurrency and queueing in async mode"""
+    return 200, {'status': 'ok', 'services': get_async_stats()}
+
+async def resilience_health(request: Request):
+    """Report circuit breaker state, deadline and hedge counters for Lex and Polly"""
+    return 200, {'status': 'ok', 'resilience': get_resilience_stats()}
+
+routes = {
+    ('POST', '/chat'): chat,
+    ('POST', '/speech'): speech,
+    ('POST', '/transcribe'): transcribe,
+    ('POST', '/save-conversation'): save_conversation,
+    ('GET', '/health'): health,
+    ('GET', '/health/async'): async_health,
+    ('GET', '/health/resilience'): resilience_health
+}
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def send_response(send, status: int, body, headers: dict):
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        payload = bytes(body)
+        headers.setdefault('Content-Type', 'application/octet-stream')
+    else:
+        payload = json.dumps(body).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/json')
+    headers['Content-Length'] = str(len(payload))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Queued DynamoDB writes and buffered archive records are written before the worker exits
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, flush_writes)
+            await loop.run_in_executor(None, flush_archive)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    mark_first_request()
+    if scope['method'] == 'OPTIONS':
+        await send_response(send, 200, b'', dict(PREFLIGHT_HEADERS))
+        return
+
+    request = Request(scope, await read_body(receive))
+    handler = routes.get((request.method, request.path))
+    trace, token = start_trace(request.headers.get('x-request-id'), request.path)
+    # No Lambda context here: every request gets DEADLINE_DEFAULT_MS
+    deadline_token = start_deadline()
+    try:
+        if handler is None:
+            result = 404, {'error': f'No route for {request.method} {request.path}'}
+        else:
+            admitted, retry_after = await admit_request(request)
+            if admitted:
+                result = await handler(request)
+            else:
+                result = 429, {'error': 'Too many requests, please retry shortly', 'status': 'error',
+                               'retry_after': retry_after}, {'Retry-After': str(retry_after)}
+    except ValueError as e:
+        # Malformed JSON body
+        result = 400, {'error': f'Invalid request body: {str(e)}'}
+    except Exception as e:
+        logger.error(f"Error handling {request.method} {request.path}: {str(e)}", exc_info=True)
+        result = 500, {'error': f'Error processing request: {str(e)}'}
+    end_deadline(deadline_token)
+
+    status, body = result[0], result[1]
+    headers = dict(CORS_HEADERS, **(result[2] if len(result) > 2 else {}))
+    if trace is not None:
+        headers.update(end_trace(trace, token, status))
+        headers['Timing-Allow-Origin'] = '*'
+    await send_response(send, status, body, headers)
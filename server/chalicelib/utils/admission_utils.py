@@ -0,0 +1,337 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.dynamo_schema_utils import TTL_ATTRIBUTE, wait_until_active
+from chalicelib.utils.tracing_utils import traced
+
+logger = logging.getLogger(__name__)
+
+# Admission control configuration from Chalice config
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory')
+ADMISSION_TABLE = os.environ.get('ADMISSION_TABLE', 'dental-chat-admission')
+# 'route=rate:burst' pairs, rate in requests per second
+ADMISSION_ROUTE_LIMITS = os.environ.get('ADMISSION_ROUTE_LIMITS', '/chat=50:100,/speech=20:40,/transcribe=5:10,/save-conversation=10:20')
+ADMISSION_SESSION_LIMITS = os.environ.get('ADMISSION_SESSION_LIMITS', '/chat=2:10,/speech=2:10,/transcribe=0.5:3,/save-conversation=1:5')
+ADMISSION_MAX_KEYS = int(os.environ.get('ADMISSION_MAX_KEYS', '10000'))
+ADMISSION_MAX_RETRIES = int(os.environ.get('ADMISSION_MAX_RETRIES', '3'))
+# With the dynamodb backend, each container takes route tokens in batches covering this many seconds of the route's rate
+ADMISSION_ROUTE_LEASE_SECONDS = float(os.environ.get('ADMISSION_ROUTE_LEASE_SECONDS', '0.2'))
+
+def parse_limits(spec: str) -> dict:
+    """
+    Parse bucket limits
+
+    Args:
+        spec (str): Comma-separated 'route=rate:burst' pairs, e.g. '/chat=50:100,/transcribe=5:10'
+
+    Returns:
+        dict: Route to (rate per second, burst)
+    """
+    limits = {}
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        route, _, values = part.partition('=')
+        rate, _, burst = values.partition(':')
+        limits[route.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+ROUTE_LIMITS = parse_limits(ADMISSION_ROUTE_LIMITS)
+SESSION_LIMITS = parse_limits(ADMISSION_SESSION_LIMITS)
+
+def refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+    """Tokens in a bucket at `now`, given its level at `updated_at` (seconds)"""
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+class MemoryBuckets:
+    """Token buckets held in this process; limits apply per container"""
+
+    def __init__(self, max_keys: int = ADMISSION_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0):
+        """
+        Take `cost` tokens if the bucket has them
+
+        Returns:
+            tuple: (admitted, seconds until enough tokens would be available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            admitted = tokens >= cost
+            if admitted:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Idle buckets are full again by now, so dropping the oldest loses nothing
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return admitted, 0.0 if admitted else (cost - tokens) / rate
+
+    def give(self, key: str, rate: float, burst: float, amount: float = 1.0):
+        """Return tokens taken for a request that was not served after all"""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(burst, refill(tokens, updated_at, now, rate, burst) + amount), now)
+
+class DynamoBuckets:
+    """Token buckets shared by all containers, one DynamoDB item per bucket, updated optimistically"""
+
+    def __init__(self, table_name: str = ADMISSION_TABLE, max_retries: int = ADMISSION_MAX_RETRIES):
+        self.table_name = table_name
+        self.max_retries = max_retries
+
+    def _client(self):
+        return get_client('dynamodb', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0):
+        """
+        Take `cost` tokens if the bucket has them
+
+        The bucket is read, refilled and written back on the condition that nobody else wrote it
+        in between; on a conflict the read is retried.
+
+        Returns:
+            tuple: (admitted, seconds until enough tokens would be available)
+        """
+        client = self._client()
+        for _ in range(self.max_retries):
+            item = client.get_item(
+                TableName=self.table_name,
+                Key={'bucket_key': {'S': key}},
+                ConsistentRead=True
+            ).get('Item')
+            now = time.time()
+            if item:
+                previous = item['updated_at']['N']
+                tokens = refill(float(item['tokens']['N']), float(previous), now, rate, burst)
+            else:
+                previous = None
+                tokens = burst
+            if tokens < cost:
+                # Rejections do not write, so a flood of them costs reads only
+                return False, (cost - tokens) / rate
+
+            values = {
+                ':tokens': {'N': f"{tokens - cost:.6f}"},
+                ':now': {'N': f"{now:.6f}"},
+                # A bucket idle long enough to refill completely is the same as no item
+                ':expires': {'N': str(int(now + burst / rate) + 60)}
+            }
+            if previous is None:
+                condition = 'attribute_not_exists(bucket_key)'
+            else:
+                condition = '#updated = :previous'
+                values[':previous'] = {'N': previous}
+            try:
+                client.update_item(
+                    TableName=self.table_name,
+                    Key={'bucket_key': {'S': key}},
+                    UpdateExpression='SET #tokens = :tokens, #updated = :now, #expires = :expires',
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={'#tokens': 'tokens', '#updated': 'updated_at', '#expires': TTL_ATTRIBUTE},
+                    ExpressionAttributeValues=values
+                )
+                return True, 0.0
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+        # Still contended after every retry: the bucket is hot, so shed this request
+        return False, 1.0 / rate
+
+    def give(self, key: str, rate: float, burst: float, amount: float = 1.0):
+        """
+        Return tokens taken for a request that was not served after all
+
+        Best effort: the refund is skipped if it would overfill the bucket, and is lost if
+        another container's take, conditioned on the earlier update, lands first.
+        """
+        try:
+            self._client().update_item(
+                TableName=self.table_name,
+                Key={'bucket_key': {'S': key}},
+                UpdateExpression='SET #tokens = #tokens + :amount',
+                ConditionExpression='attribute_exists(bucket_key) AND #tokens <= :limit',
+                ExpressionAttributeNames={'#tokens': 'tokens'},
+                ExpressionAttributeValues={':amount': {'N': str(amount)}, ':limit': {'N': str(burst - amount)}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                logger.warning(f"Could not return tokens to {key}: {str(e)}")
+
+class LeasedBuckets:
+    """
+    A per-container share of shared token buckets, taken from the store in batches
+
+    Every container taking each request's token from one shared route item turns the item into
+    a hot key: writes conflict, conflicts shed requests that were within the limit, and each
+    request pays the round trips. Instead a container takes `lease_seconds` worth of the
+    route's rate at a time and admits from it locally. Unused tokens are dropped once the
+    lease is that old again, so an idle container does not hold on to capacity.
+    """
+
+    def __init__(self, store, lease_seconds: float = ADMISSION_ROUTE_LEASE_SECONDS):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0):
+        """
+        Take `cost` tokens from this container's lease, renewing it from the store when it runs out
+
+        Returns:
+            tuple: (admitted, seconds until enough tokens would be available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, leased_at = self._leases.get(key, (0.0, now))
+            if tokens >= cost and now - leased_at < self.lease_seconds:
+                self._leases[key] = (tokens - cost, leased_at)
+                return True, 0.0
+
+        batch = max(cost, min(burst, math.ceil(rate * self.lease_seconds)))
+        admitted, wait = self.store.take(key, rate, burst, batch)
+        if not admitted and batch > cost:
+            # Not enough left for a whole lease; fall back to just this request
+            batch = cost
+            admitted, wait = self.store.take(key, rate, burst, batch)
+        if admitted:
+            now = time.monotonic()
+            with self._lock:
+                # Another thread may have renewed the lease meanwhile; keep what is left of it
+                tokens, leased_at = self._leases.get(key, (0.0, now))
+                left = tokens if now - leased_at < self.lease_seconds else 0.0
+                self._leases[key] = (left + batch - cost, now)
+        return admitted, wait
+
+backend = None
+route_backend = None
+_backend_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+metrics = {}
+
+def get_backend():
+    """Return the configured bucket store, creating it on first use"""
+    global backend
+    if backend is None:
+        with _backend_lock:
+            if backend is None:
+                backend = DynamoBuckets() if ADMISSION_BACKEND == 'dynamodb' else MemoryBuckets()
+    return backend
+
+def get_route_backend():
+    """Return the store for route buckets: the shared store through per-container leases, when it is remote"""
+    global route_backend
+    if route_backend is None:
+        store = get_backend()
+        with _backend_lock:
+            if route_backend is None:
+                leased = isinstance(store, DynamoBuckets) and ADMISSION_ROUTE_LEASE_SECONDS > 0
+                route_backend = LeasedBuckets(store) if leased else store
+    return route_backend
+
+def _count(route: str, name: str):
+    with _metrics_lock:
+        route_metrics = metrics.setdefault(route, {'admitted': 0, 'rejected_session': 0, 'rejected_route': 0, 'errors': 0})
+        route_metrics[name] += 1
+
+@traced('admission')
+def admit(route: str, session_key: str = None):
+    """
+    Decide whether to serve a request now or shed it
+
+    The session's bucket for the route is checked first, then the route's shared bucket; a
+    session token taken for a request the route then rejects is given back. Routes without
+    configured limits are always admitted, and a failing backend admits rather than turning
+    an outage of the limiter into an outage of the API.
+
+    Args:
+        route (str): Route path, e.g. '/chat'
+        session_key (str): Session ID, or another per-client key such as the source IP
+
+    Returns:
+        tuple: (admitted, Retry-After seconds)
+    """
+    if not ADMISSION_ENABLED or (route not in SESSION_LIMITS and route not in ROUTE_LIMITS):
+        return True, 0
+    store = get_backend()
+    session_bucket = None
+    try:
+        if session_key and route in SESSION_LIMITS:
+            rate, burst = SESSION_LIMITS[route]
+            admitted, wait = store.take(f"session#{route}#{session_key}", rate, burst)
+            if not admitted:
+                _count(route, 'rejected_session')
+                return False, max(1, math.ceil(wait))
+            session_bucket = (f"session#{route}#{session_key}", rate, burst)
+        if route in ROUTE_LIMITS:
+            rate, burst = ROUTE_LIMITS[route]
+            admitted, wait = get_route_backend().take(f"route#{route}", rate, burst)
+            if not admitted:
+                _count(route, 'rejected_route')
+                if session_bucket:
+                    store.give(*session_bucket)
+                return False, max(1, math.ceil(wait))
+    except Exception as e:
+        logger.warning(f"Admission check failed for {route}, admitting: {str(e)}")
+        _count(route, 'errors')
+        return True, 0
+    _count(route, 'admitted')
+    return True, 0
+
+def get_admission_stats() -> dict:
+    """Return admitted/rejected counters per route and the configured limits"""
+    with _metrics_lock:
+        routes = {route: dict(counts) for route, counts in metrics.items()}
+    return {
+        'enabled': ADMISSION_ENABLED,
+        'backend': ADMISSION_BACKEND,
+        'route_lease_seconds': ADMISSION_ROUTE_LEASE_SECONDS if isinstance(get_route_backend(), LeasedBuckets) else None,
+        'route_limits': {route: {'rate': rate, 'burst': burst} for route, (rate, burst) in ROUTE_LIMITS.items()},
+        'session_limits': {route: {'rate': rate, 'burst': burst} for route, (rate, burst) in SESSION_LIMITS.items()},
+        'routes': routes
+    }
+
+def provision_admission_table(table_name: str = ADMISSION_TABLE) -> bool:
+    """
+    Create the on-demand table used by the DynamoDB backend, with TTL on expired buckets
+
+    Returns:
+        bool: True if the table exists
+    """
+    client = get_client('dynamodb', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+    try:
+        try:
+            client.describe_table(TableName=table_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ResourceNotFoundException':
+                raise
+            client.create_table(
+                TableName=table_name,
+                KeySchema=[{'AttributeName': 'bucket_key', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'bucket_key', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            logger.info(f"Created admission table '{table_name}'")
+        wait_until_active(client, table_name)
+        status = client.describe_time_to_live(TableName=table_name).get('TimeToLiveDescription', {})
+        if status.get('TimeToLiveStatus') not in ('ENABLED', 'ENABLING'):
+            client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': TTL_ATTRIBUTE}
+            )
+        return True
+    except Exception as e:
+        logger.error(f"Error provisioning admission table '{table_name}': {str(e)}")
+        return False
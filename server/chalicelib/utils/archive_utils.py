@@ -0,0 +1,348 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+from chalicelib.utils.aws_utils import get_client
+
+logger = logging.getLogger(__name__)
+
+# Conversation archive configuration from Chalice config
+CONVERSATION_ARCHIVE_MODE = os.environ.get('CONVERSATION_ARCHIVE_MODE', 'batched')
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', os.environ.get('S3_BUCKET_NAME', 'dental-chat-conversations'))
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'archive/')
+ARCHIVE_COMPRESSION = os.environ.get('ARCHIVE_COMPRESSION', 'gzip')
+ARCHIVE_MAX_BYTES = int(os.environ.get('ARCHIVE_MAX_BYTES', str(8 * 1024 * 1024)))
+ARCHIVE_MAX_AGE = float(os.environ.get('ARCHIVE_MAX_AGE', '60'))
+ARCHIVE_FLUSH_TIMEOUT = float(os.environ.get('ARCHIVE_FLUSH_TIMEOUT', '5'))
+# Write buffers that are due at the end of each invocation; the roll thread does not run while Lambda is frozen
+ARCHIVE_FLUSH_ON_RESPONSE = os.environ.get('ARCHIVE_FLUSH_ON_RESPONSE', 'true').lower() == 'true'
+
+# Object suffix and content type per codec
+CODECS = {
+    'gzip': ('.jsonl.gz', 'application/gzip'),
+    'zstd': ('.jsonl.zst', 'application/zstd')
+}
+INDEX_SUFFIX = '.index.json'
+
+def _zstd():
+    # Imported lazily so gzip archives work without the optional zstandard package
+    import zstandard
+    return zstandard
+
+def resolve_compression(name: str = ARCHIVE_COMPRESSION) -> str:
+    """Return the codec to use, falling back to gzip if zstd is unavailable"""
+    if name == 'zstd':
+        try:
+            _zstd()
+            return 'zstd'
+        except ImportError:
+            logger.warning("zstandard is not installed, archiving with gzip instead")
+    return 'gzip'
+
+def compress_record(line: bytes, compression: str) -> bytes:
+    """
+    Compress one JSON line as a self-contained gzip member or zstd frame
+
+    Members concatenate into a valid stream, and each can be read on its own with a ranged GET.
+    """
+    if compression == 'zstd':
+        return _zstd().ZstdCompressor().compress(line)
+    return gzip.compress(line, compresslevel=6)
+
+def decompress_records(data: bytes, compression: str) -> bytes:
+    """Decompress one member or a whole archive object of concatenated members"""
+    if compression == 'zstd':
+        reader = _zstd().ZstdDecompressor().stream_reader(BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return gzip.decompress(data)
+
+def encode_record(conversation_data: dict) -> bytes:
+    """Serialize a conversation as one compact JSON line"""
+    return json.dumps(conversation_data, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+
+def record_count(buffer: dict) -> int:
+    """Number of conversations held in a buffer"""
+    return sum(len(ranges) for ranges in buffer['sessions'].values())
+
+def partition_for(now: datetime) -> str:
+    """Hive-style date/hour partition, e.g. 'dt=2024-05-01/hr=13'"""
+    return f"dt={now:%Y-%m-%d}/hr={now:%H}"
+
+class ConversationArchive:
+    """
+    Buffers conversations per date/hour partition and rolls them into large compressed
+    JSON Lines objects, each with an index sidecar of session byte ranges
+    """
+
+    def __init__(self, bucket: str = ARCHIVE_BUCKET, prefix: str = ARCHIVE_PREFIX,
+                 compression: str = None, max_bytes: int = ARCHIVE_MAX_BYTES, max_age: float = ARCHIVE_MAX_AGE):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.compression = compression or resolve_compression()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Distinguishes objects written by concurrent containers in the same partition
+        self.writer_id = uuid.uuid4().hex[:12]
+        self._sequence = 0
+        self._buffers = {}
+        self._writing = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.metrics = {
+            'records': 0,
+            'objects': 0,
+            'raw_bytes': 0,
+            'compressed_bytes': 0,
+            'dropped': 0,
+            'flush_timeouts': 0
+        }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+                    self._thread.start()
+
+    def append(self, session_id: str, conversation_data: dict, on_written=None) -> bool:
+        """
+        Buffer a conversation for the current partition
+
+        Args:
+            session_id (str): Session ID
+            conversation_data (dict): Conversation data to archive
+            on_written (callable): Called once the buffer is written, with the record's location
+                ({'bucket', 'object', 'compression', 'partition', 'offset', 'length'}), or with None if the
+                object could not be written
+
+        Returns:
+            bool: True once the record is buffered
+        """
+        line = encode_record(conversation_data)
+        member = compress_record(line, self.compression)
+        partition = partition_for(datetime.utcnow())
+
+        self._ensure_thread()
+        with self._cond:
+            buffer = self._buffers.get(partition)
+            if buffer is None:
+                buffer = self._buffers[partition] = {
+                    'chunks': [], 'size': 0, 'sessions': {}, 'callbacks': [], 'opened_at': time.monotonic()
+                }
+                # Wake the writer so it schedules the age-based roll for the new buffer
+                self._cond.notify_all()
+            buffer['sessions'].setdefault(session_id, []).append([buffer['size'], len(member)])
+            if on_written is not None:
+                buffer['callbacks'].append((on_written, buffer['size'], len(member)))
+            buffer['chunks'].append(member)
+            buffer['size'] += len(member)
+            self.metrics['records'] += 1
+            self.metrics['raw_bytes'] += len(line)
+            if buffer['size'] >= self.max_bytes:
+                self._cond.notify_all()
+        return True
+
+    def _due(self, force: bool = False):
+        """Partitions whose buffers are full, old enough or (when forced) non-empty, oldest first; caller holds the lock"""
+        now = time.monotonic()
+        return sorted(
+            (partition for partition, buffer in self._buffers.items()
+             if force or buffer['size'] >= self.max_bytes or now - buffer['opened_at'] >= self.max_age),
+            key=lambda partition: self._buffers[partition]['opened_at']
+        )
+
+    def _take_due(self, force: bool = False, limit: int = None):
+        """Remove and return the due buffers; caller holds the lock"""
+        due = self._due(force)[:limit]
+        taken = [(partition, self._buffers.pop(partition)) for partition in due]
+        self._writing += len(taken)
+        return taken
+
+    def _next_wait(self):
+        if not self._buffers:
+            return None
+        oldest = min(buffer['opened_at'] for buffer in self._buffers.values())
+        return max(oldest + self.max_age - time.monotonic(), 0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                taken = self._take_due()
+                while not taken:
+                    self._cond.wait(self._next_wait())
+                    taken = self._take_due()
+            self._write_all(taken)
+
+    def _write_all(self, taken):
+        for partition, buffer in taken:
+            location = None
+            try:
+                location = {
+                    'bucket': self.bucket, 'object': self._write_object(partition, buffer),
+                    'compression': self.compression, 'partition': partition
+                }
+            except Exception as e:
+                records = record_count(buffer)
+                self.metrics['dropped'] += records
+                logger.error(f"Error writing archive object for {partition} ({records} records): {str(e)}")
+            try:
+                self._notify(buffer, location)
+            finally:
+                with self._cond:
+                    self._writing -= 1
+                    self._cond.notify_all()
+
+    def _notify(self, buffer: dict, location: dict):
+        for on_written, offset, length in buffer['callbacks']:
+            try:
+                on_written(dict(location, offset=offset, length=length) if location else None)
+            except Exception as e:
+                logger.error(f"Error in archive write callback: {str(e)}")
+
+    def _next_key(self, partition: str) -> str:
+        with self._cond:
+            self._sequence += 1
+            sequence = self._sequence
+        suffix = CODECS[self.compression][0]
+        return f"{self.prefix}{partition}/part-{self.writer_id}-{sequence:05d}{suffix}"
+
+    def _write_object(self, partition: str, buffer: dict):
+        key = self._next_key(partition)
+        body = b''.join(buffer['chunks'])
+        s3_client = get_client('s3', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+        s3_client.put_object(
+            Body=body,
+            Bucket=self.bucket,
+            Key=key,
+            ContentType=CODECS[self.compression][1]
+        )
+        # The index is written after its object, so it never points at data that is not there
+        index = {
+            'object': key,
+            'compression': self.compression,
+            'partition': partition,
+            'records': record_count(buffer),
+            'sessions': buffer['sessions']
+        }
+        s3_client.put_object(
+            Body=json.dumps(index, separators=(',', ':')),
+            Bucket=self.bucket,
+            Key=key + INDEX_SUFFIX,
+            ContentType='application/json'
+        )
+        self.metrics['objects'] += 1
+        self.metrics['compressed_bytes'] += len(body)
+        logger.info(f"Archived {index['records']} conversations to {key} ({len(body)} bytes)")
+        return key
+
+    def flush(self, timeout: float = ARCHIVE_FLUSH_TIMEOUT, force: bool = True) -> bool:
+        """
+        Write out buffered partitions now, oldest first, until the timeout
+
+        Args:
+            timeout (float): Seconds to spend writing, including writes already in progress
+            force (bool): Write every buffer; otherwise only those that are full or past ARCHIVE_MAX_AGE
+
+        Returns:
+            bool: True if nothing that was asked for is left buffered or being written
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # One object at a time, so a short deadline leaves the rest buffered rather than half-written
+            with self._cond:
+                taken = self._take_due(force=force, limit=1)
+            if not taken:
+                break
+            self._write_all(taken)
+
+        with self._cond:
+            while self._writing > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._due(force)
+
+    def abandon(self) -> int:
+        """Count the records still buffered as dropped, when the process is about to go away"""
+        with self._cond:
+            records = sum(record_count(buffer) for buffer in self._buffers.values())
+            self._buffers.clear()
+            self.metrics['dropped'] += records
+        if records:
+            logger.error(f"Dropping {records} archived conversations still buffered at shutdown")
+        return records
+
+    def get_metrics(self) -> dict:
+        """Return archive counters and the amount currently buffered"""
+        with self._cond:
+            metrics = dict(self.metrics)
+            metrics['buffered_partitions'] = len(self._buffers)
+            metrics['buffered_bytes'] = sum(buffer['size'] for buffer in self._buffers.values())
+        metrics['compression'] = self.compression
+        return metrics
+
+archive = None
+
+def get_archive():
+    """Return the process-wide archive writer, creating it on first use"""
+    global archive
+    if archive is None:
+        archive = ConversationArchive()
+    return archive
+
+def archive_conversation(session_id: str, conversation_data: dict, on_written=None) -> bool:
+    """Buffer a conversation for the batched archive; `on_written` is told where it lands once its object is written"""
+    try:
+        return get_archive().append(session_id, conversation_data, on_written)
+    except Exception as e:
+        logger.error(f"Error archiving conversation: {str(e)}")
+        return False
+
+def flush_archive(timeout: float = ARCHIVE_FLUSH_TIMEOUT, force: bool = True) -> bool:
+    """Flush buffered conversations (only those due to roll unless forced), if an archive writer exists"""
+    if archive is None:
+        return True
+    if archive.flush(timeout, force):
+        return True
+    archive.metrics['flush_timeouts'] += 1
+    return False
+
+def get_archive_metrics() -> dict:
+    """Return archive metrics for monitoring"""
+    metrics = archive.get_metrics() if archive else {'buffered_partitions': 0, 'buffered_bytes': 0}
+    metrics['mode'] = CONVERSATION_ARCHIVE_MODE
+    return metrics
+
+def read_record(location: dict) -> dict:
+    """
+    Read one stored conversation from where it was written
+
+    Args:
+        location (dict): 'bucket' and 'object', plus 'offset', 'length' and 'compression' for
+            a record inside an archive object, as passed to an append's on_written
+
+    Returns:
+        dict: The conversation data
+    """
+    s3_client = get_client('s3', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+    params = {'Bucket': location['bucket'], 'Key': location['object']}
+    if 'offset' in location:
+        params['Range'] = f"bytes={location['offset']}-{location['offset'] + location['length'] - 1}"
+    body = s3_client.get_object(**params)['Body'].read()
+    if location.get('compression'):
+        body = decompress_records(body, location['compression'])
+    return json.loads(body)
+
+def _flush_on_exit():
+    if not flush_archive(ARCHIVE_FLUSH_TIMEOUT):
+        archive.abandon()
+
+# Buffered conversations are written when the interpreter exits (SIGTERM exits via dynamo_writer_utils)
+atexit.register(_flush_on_exit)
@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chalicelib.utils.lex_utils import send_message_to_lex
+from chalicelib.utils.polly_utils import text_to_speech, speech_to_audio, synthesize_segments
+from chalicelib.utils.transcribe_utils import transcribe_audio_bytes, speech_to_text, transcribe_uploaded_audio
+from chalicelib.utils.dynamo_utils import store_conversation
+from chalicelib.utils.manifest_utils import save_conversation_delta
+
+logger = logging.getLogger(__name__)
+
+# Async serving configuration from Chalice config: concurrent calls allowed per upstream service
+ASYNC_CONCURRENCY = {
+    'lex': int(os.environ.get('ASYNC_LEX_CONCURRENCY', os.environ.get('LEX_MAX_CONCURRENCY', '10'))),
+    'polly': int(os.environ.get('ASYNC_POLLY_CONCURRENCY', '16')),
+    'transcribe': int(os.environ.get('ASYNC_TRANSCRIBE_CONCURRENCY', '8')),
+    'dynamodb': int(os.environ.get('ASYNC_DYNAMODB_CONCURRENCY', '16')),
+    's3': int(os.environ.get('ASYNC_S3_CONCURRENCY', '16'))
+}
+# Threads that run blocking boto3 calls; enough for every service to use its full allowance
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', str(sum(ASYNC_CONCURRENCY.values()))))
+
+blocking_executor = None
+_executor_lock = threading.Lock()
+
+# asyncio semaphores belong to one event loop; they are recreated if the loop changes
+_loop = None
+_semaphores = {}
+_stats = {service: {'calls': 0, 'active': 0, 'waiting': 0, 'peak_active': 0, 'wait_ms': 0.0} for service in ASYNC_CONCURRENCY}
+
+def get_blocking_executor():
+    """Return the thread pool that blocking util calls run on in async mode"""
+    global blocking_executor
+    if blocking_executor is None:
+        with _executor_lock:
+            if blocking_executor is None:
+                blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='async-io')
+    return blocking_executor
+
+def _semaphore(service: str) -> asyncio.Semaphore:
+    global _loop
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        _semaphores.clear()
+        _loop = loop
+    semaphore = _semaphores.get(service)
+    if semaphore is None:
+        semaphore = _semaphores[service] = asyncio.Semaphore(ASYNC_CONCURRENCY[service])
+    return semaphore
+
+async def run_blocking(service: str, fn, *args, **kwargs):
+    """
+    Run a blocking util call on the executor, bounded by the service's semaphore
+
+    The call runs in a copy of the caller's context, so tracing stages land in the request's trace.
+
+    Args:
+        service (str): Key of ASYNC_CONCURRENCY that the call counts against
+        fn (callable): Blocking function
+
+    Returns:
+        The function's return value
+    """
+    stats = _stats[service]
+    queued = time.perf_counter()
+    stats['waiting'] += 1
+    async with _semaphore(service):
+        stats['waiting'] -= 1
+        stats['wait_ms'] += (time.perf_counter() - queued) * 1000
+        stats['calls'] += 1
+        stats['active'] += 1
+        stats['peak_active'] = max(stats['peak_active'], stats['active'])
+        try:
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, fn, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(get_blocking_executor(), call)
+        finally:
+            stats['active'] -= 1
+
+async def send_message_to_lex_async(session_id: str, message: str):
+    return await run_blocking('lex', send_message_to_lex, session_id, message)
+
+async def text_to_speech_async(text: str, voice_id: str = 'Joanna'):
+    return await run_blocking('polly', text_to_speech, text, voice_id)
+
+async def speech_to_audio_async(text: str, voice_id: str = 'Joanna'):
+    return await run_blocking('polly', speech_to_audio, text, voice_id)
+
+async def synthesize_segments_async(text: str, voice_id: str = 'Joanna', messages=None):
+    return await run_blocking('polly', synthesize_segments, text, voice_id, messages)
+
+async def transcribe_audio_bytes_async(audio_data: bytes, content_type='audio/webm'):
+    return await run_blocking('transcribe', transcribe_audio_bytes, audio_data, content_type)
+
+async def speech_to_text_async(audio_data_base64, content_type='audio/webm'):
+    return await run_blocking('transcribe', speech_to_text, audio_data_base64, content_type)
+
+async def transcribe_uploaded_audio_async(key: str, content_type='audio/webm'):
+    return await run_blocking('transcribe', transcribe_uploaded_audio, key, content_type)
+
+async def store_conversation_async(session_id: str, message: str, response: str, intent: str = None, intent_source: str = None):
+    return await run_blocking('dynamodb', store_conversation, session_id, message, response, intent, intent_source)
+
+async def save_conversation_delta_async(session_id: str, messages: list, idempotency_key: str = None):
+    return await run_blocking('s3', save_conversation_delta, session_id, messages, idempotency_key)
+
+def get_async_stats() -> dict:
+    """Return per-service call counts, current and peak concurrency and time spent queued"""
+    return {
+        service: dict(stats, limit=ASYNC_CONCURRENCY[service], wait_ms=round(stats['wait_ms'], 2))
+        for service, stats in _stats.items()
+    }
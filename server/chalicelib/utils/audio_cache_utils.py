@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.prompt_pack_utils import get_prompt_pack
+from chalicelib.utils.tracing_utils import traced
+
+logger = logging.getLogger(__name__)
+s3_client = None
+
+# Cache configuration from Chalice config
+AUDIO_CACHE_BUCKET = os.environ.get('AUDIO_CACHE_BUCKET', os.environ.get('S3_BUCKET_NAME', 'dental-chat-conversations'))
+AUDIO_CACHE_PREFIX = os.environ.get('AUDIO_CACHE_PREFIX', 'polly-cache/')
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+AUDIO_CACHE_S3_ENABLED = os.environ.get('AUDIO_CACHE_S3_ENABLED', 'true').lower() == 'true'
+
+# Bump when the key layout changes so old S3 objects are ignored
+CACHE_KEY_VERSION = 'v1'
+
+AUDIO_URL_EXPIRES = int(os.environ.get('AUDIO_URL_EXPIRES', '300'))
+# Most S3 object names remembered as present, so the set stays bounded in a warm container
+AUDIO_CACHE_KNOWN_KEYS = int(os.environ.get('AUDIO_CACHE_KNOWN_KEYS', '10000'))
+
+_WHITESPACE = re.compile(r'\s+')
+
+class KnownKeys:
+    """Bounded, least-recently-used set of cache keys"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: str):
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def __contains__(self, key: str):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def __len__(self):
+        return len(self._keys)
+
+class LRUAudioCache:
+    """In-process LRU cache for audio bytes bounded by total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            audio = self._items.get(key)
+            if audio is not None:
+                self._items.move_to_end(key)
+            return audio
+
+    def put(self, key: str, audio: bytes):
+        size = len(audio)
+        if size > self.max_bytes:
+            # Never let one oversized clip flush the whole cache
+            return
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= len(self._items.pop(key))
+            self._items[key] = audio
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+# Module-level so the memory tier survives across warm Lambda invocations
+memory_cache = LRUAudioCache(AUDIO_CACHE_MAX_BYTES)
+# Cache keys known to exist in the S3 tier, so presigning does not need a HEAD request
+_s3_known_keys = KnownKeys(AUDIO_CACHE_KNOWN_KEYS)
+
+_stats_lock = threading.Lock()
+cache_stats = {
+    'pack_hits': 0,
+    'memory_hits': 0,
+    'memory_misses': 0,
+    's3_hits': 0,
+    's3_misses': 0,
+    'puts': 0,
+    'errors': 0
+}
+
+def _count(name: str):
+    with _stats_lock:
+        cache_stats[name] += 1
+
+def init_audio_cache():
+    """Initialize the S3 client used by the shared cache tier"""
+    global s3_client
+    try:
+        region = os.environ.get('AWS_REGION', 'ca-central-1')
+        s3_client = get_client('s3', region_name=region)
+        logger.info(f"Audio cache initialized (bucket '{AUDIO_CACHE_BUCKET}', prefix '{AUDIO_CACHE_PREFIX}')")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to initialize audio cache: {str(e)}")
+        return False
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different prompts share one cache entry"""
+    return _WHITESPACE.sub(' ', text).strip()
+
+def make_cache_key(text: str, voice_id: str, output_format: str = 'mp3', engine: str = 'standard') -> str:
+    """
+    Build a content-addressed key for a synthesized clip
+
+    Args:
+        text (str): Text that is synthesized
+        voice_id (str): Polly voice ID
+        output_format (str): Polly output format
+        engine (str): Polly engine
+
+    Returns:
+        str: Hex SHA-256 digest identifying the audio
+    """
+    material = '\x1f'.join([CACHE_KEY_VERSION, normalize_text(text), voice_id, output_format, engine])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def s3_key_for(cache_key: str, output_format: str = 'mp3') -> str:
+    """Return the S3 object key for a cache entry"""
+    return f"{AUDIO_CACHE_PREFIX}{cache_key[:2]}/{cache_key}.{output_format}"
+
+@traced('audio_cache')
+def get_cached_audio(cache_key: str, output_format: str = 'mp3'):
+    """
+    Look up audio in the deployed prompt pack, then the memory tier, then the S3 tier
+
+    Args:
+        cache_key (str): Key from make_cache_key
+        output_format (str): Polly output format
+
+    Returns:
+        bytes: Cached audio or None on a miss; prompt pack hits are read-only memoryviews
+    """
+    pack = get_prompt_pack()
+    if pack is not None:
+        audio = pack.get(cache_key)
+        if audio is not None:
+            _count('pack_hits')
+            return audio
+
+    audio = memory_cache.get(cache_key)
+    if audio is not None:
+        _count('memory_hits')
+        return audio
+    _count('memory_misses')
+
+    if not AUDIO_CACHE_S3_ENABLED:
+        return None
+    if not s3_client:
+        if not init_audio_cache():
+            return None
+
+    try:
+        response = s3_client.get_object(Bucket=AUDIO_CACHE_BUCKET, Key=s3_key_for(cache_key, output_format))
+        audio = response['Body'].read()
+        memory_cache.put(cache_key, audio)
+        _s3_known_keys.add(cache_key)
+        _count('s3_hits')
+        return audio
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', '')
+        if error_code in ('NoSuchKey', '404'):
+            _count('s3_misses')
+        else:
+            _count('errors')
+            logger.warning(f"Audio cache S3 lookup failed ({error_code}): {str(e)}")
+        return None
+    except Exception as e:
+        _count('errors')
+        logger.warning(f"Audio cache S3 lookup failed: {str(e)}")
+        return None
+
+@traced('audio_cache')
+def put_cached_audio(cache_key: str, audio: bytes, output_format: str = 'mp3'):
+    """
+    Store audio in both cache tiers
+
+    Args:
+        cache_key (str): Key from make_cache_key
+        audio (bytes): Synthesized audio
+        output_format (str): Polly output format
+
+    Returns:
+        bool: True if the audio was stored in every enabled tier
+    """
+    memory_cache.put(cache_key, audio)
+    _count('puts')
+
+    if not AUDIO_CACHE_S3_ENABLED:
+        return True
+    if not s3_client:
+        if not init_audio_cache():
+            return False
+
+    try:
+        s3_client.put_object(
+            Body=bytes(audio),
+            Bucket=AUDIO_CACHE_BUCKET,
+            Key=s3_key_for(cache_key, output_format),
+            ContentType='audio/mpeg' if output_format == 'mp3' else 'application/octet-stream'
+        )
+        _s3_known_keys.add(cache_key)
+        return True
+    except Exception as e:
+        _count('errors')
+        logger.warning(f"Audio cache S3 write failed: {str(e)}")
+        return False
+
+def get_cached_audio_url(cache_key: str, audio: bytes, output_format: str = 'mp3', expires: int = AUDIO_URL_EXPIRES):
+    """
+    Return a presigned GET URL for a clip, uploading it to the S3 tier first if needed
+
+    Args:
+        cache_key (str): Key from make_cache_key
+        audio (bytes): The clip, used if the S3 object is missing
+        output_format (str): Polly output format
+        expires (int): URL lifetime in seconds
+
+    Returns:
+        str: Presigned URL or None if the S3 tier is unavailable
+    """
+    if not AUDIO_CACHE_S3_ENABLED:
+        return None
+    if not s3_client:
+        if not init_audio_cache():
+            return None
+
+    object_key = s3_key_for(cache_key, output_format)
+    if cache_key not in _s3_known_keys:
+        try:
+            s3_client.head_object(Bucket=AUDIO_CACHE_BUCKET, Key=object_key)
+            _s3_known_keys.add(cache_key)
+        except ClientError:
+            if not put_cached_audio(cache_key, audio, output_format):
+                return None
+
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': AUDIO_CACHE_BUCKET, 'Key': object_key},
+        ExpiresIn=expires
+    )
+
+def get_cache_stats():
+    """Return hit/miss counters and memory tier usage"""
+    with _stats_lock:
+        stats = dict(cache_stats)
+    lookups = stats['pack_hits'] + stats['memory_hits'] + stats['memory_misses']
+    hits = stats['pack_hits'] + stats['memory_hits'] + stats['s3_hits']
+    stats.update({
+        'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+        'memory_entries': len(memory_cache),
+        'memory_bytes': memory_cache.current_bytes,
+        'memory_max_bytes': memory_cache.max_bytes
+    })
+    return stats
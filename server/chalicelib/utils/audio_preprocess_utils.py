@@ -0,0 +1,263 @@
+import logging
+import math
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from io import BytesIO
+from chalicelib.utils.tracing_utils import trace_stage
+
+logger = logging.getLogger(__name__)
+
+# Audio preprocessing configuration from Chalice config
+AUDIO_PREPROCESS_ENABLED = os.environ.get('AUDIO_PREPROCESS_ENABLED', 'true').lower() == 'true'
+# ffmpeg binary for compressed formats (webm, ogg, mp3, ...), e.g. /opt/bin/ffmpeg from a Lambda layer.
+# Without it only WAV and raw PCM are preprocessed; other formats are sent as recorded.
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg') or ('/opt/bin/ffmpeg' if os.path.exists('/opt/bin/ffmpeg') else None)
+FFMPEG_TIMEOUT = float(os.environ.get('FFMPEG_TIMEOUT', '10'))
+AUDIO_TARGET_RATE = int(os.environ.get('AUDIO_TARGET_RATE', '16000'))
+# 'opus' (Ogg/Opus), 'flac' or 'wav'; opus and flac need ffmpeg and fall back to PCM without it
+AUDIO_OUTPUT_FORMAT = os.environ.get('AUDIO_OUTPUT_FORMAT', 'opus')
+AUDIO_OPUS_BITRATE = os.environ.get('AUDIO_OPUS_BITRATE', '24k')
+AUDIO_VAD_FRAME_MS = int(os.environ.get('AUDIO_VAD_FRAME_MS', '30'))
+# A frame is speech when its energy is this far above the recording's noise floor...
+AUDIO_VAD_MARGIN_DB = float(os.environ.get('AUDIO_VAD_MARGIN_DB', '12'))
+# ...and above this absolute level (dBFS)
+AUDIO_VAD_MIN_DB = float(os.environ.get('AUDIO_VAD_MIN_DB', '-55'))
+# Audio kept around speech, so word onsets and endings are not clipped
+AUDIO_VAD_PADDING_MS = int(os.environ.get('AUDIO_VAD_PADDING_MS', '200'))
+# Pauses inside the utterance are shortened to this length (0 keeps them)
+AUDIO_VAD_MAX_PAUSE_MS = int(os.environ.get('AUDIO_VAD_MAX_PAUSE_MS', '600'))
+
+# Content types decoded without ffmpeg
+WAV_TYPES = ('audio/wav', 'audio/x-wav', 'audio/wave')
+# Raw 16-bit PCM and its sample byte order: audio/l16 is big-endian (RFC 2586), audio/pcm little-endian
+PCM_TYPES = {'audio/pcm': '<i2', 'audio/l16': '>i2'}
+
+_metrics_lock = threading.Lock()
+metrics = {
+    'processed': 0, 'passed_through': 0, 'errors': 0, 'no_speech': 0,
+    'bytes_in': 0, 'bytes_out': 0, 'seconds_in': 0.0, 'seconds_out': 0.0
+}
+
+def _count(**increments):
+    with _metrics_lock:
+        for name, value in increments.items():
+            metrics[name] += value
+
+def _content_params(content_type: str):
+    """Base type and parameters of a content type, e.g. ('audio/l16', {'rate': '8000'})"""
+    parts = [part.strip() for part in content_type.lower().split(';')]
+    params = dict(part.partition('=')[::2] for part in parts[1:] if '=' in part)
+    return parts[0], params
+
+def _run_ffmpeg(args, data: bytes) -> bytes:
+    completed = subprocess.run(
+        [FFMPEG_PATH, '-hide_banner', '-loglevel', 'error'] + args,
+        input=data,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=FFMPEG_TIMEOUT,
+        check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {completed.stderr.decode('utf-8', 'replace').strip()[:200]}")
+    return completed.stdout
+
+def _pcm16_to_float(raw: bytes, channels: int = 1, dtype: str = '<i2'):
+    import numpy as np
+
+    samples = np.frombuffer(raw[:len(raw) - len(raw) % (2 * channels)], dtype=dtype).astype(np.float32) / 32768.0
+    return samples.reshape(-1, channels)
+
+def decode_audio(audio_data: bytes, content_type: str):
+    """
+    Decode audio to float samples in [-1, 1]
+
+    WAV and raw PCM are decoded with NumPy at their own rate and channel count. Everything else
+    goes through ffmpeg, which is asked for mono PCM at AUDIO_TARGET_RATE directly.
+
+    Returns:
+        tuple: (samples of shape (frames, channels), sample rate), or None if the format cannot be decoded here
+    """
+    import numpy as np
+
+    base_type, params = _content_params(content_type)
+    if base_type in WAV_TYPES:
+        with wave.open(BytesIO(audio_data)) as reader:
+            channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+            raw = reader.readframes(reader.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+        elif width == 2:
+            samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+        elif width == 3:
+            # 24-bit: widen each little-endian triple to int32 through its top three bytes
+            triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+            widened = np.zeros((len(triples), 4), dtype=np.uint8)
+            widened[:, 1:] = triples
+            samples = widened.view('<i4').reshape(-1).astype(np.float32) / 2147483648.0
+        elif width == 4:
+            samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+        else:
+            return None
+        return samples.reshape(-1, channels), rate
+    if base_type in PCM_TYPES:
+        channels = int(params.get('channels', '1'))
+        return _pcm16_to_float(audio_data, channels, PCM_TYPES[base_type]), int(params.get('rate', str(AUDIO_TARGET_RATE)))
+    if not FFMPEG_PATH:
+        return None
+    raw = _run_ffmpeg(['-i', 'pipe:0', '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(AUDIO_TARGET_RATE), 'pipe:1'], audio_data)
+    return _pcm16_to_float(raw), AUDIO_TARGET_RATE
+
+def downmix(samples):
+    """Average the channels of a (frames, channels) array into mono"""
+    return samples[:, 0] if samples.shape[1] == 1 else samples.mean(axis=1)
+
+def resample(samples, source_rate: int, target_rate: int = AUDIO_TARGET_RATE):
+    """
+    Resample mono audio by interpolation, low-pass filtering first when downsampling
+
+    The filter is a Hamming-windowed sinc at 90% of the new Nyquist frequency, enough to keep
+    aliasing out of the speech band.
+    """
+    import numpy as np
+
+    if source_rate == target_rate or not len(samples):
+        return samples
+    ratio = target_rate / source_rate
+    if ratio < 1:
+        cutoff = 0.45 * ratio
+        half_width = int(math.ceil(4 / cutoff))
+        taps = np.arange(-half_width, half_width + 1)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        samples = np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode='same')
+    positions = np.arange(int(len(samples) * ratio), dtype=np.float64) / ratio
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def trim_silence(samples, rate: int = AUDIO_TARGET_RATE):
+    """
+    Drop leading and trailing silence and shorten long pauses, using per-frame energy
+
+    The noise floor is the 10th percentile of frame energies, so the threshold adapts to the
+    recording's background level.
+
+    Returns:
+        Speech samples, or None if no frame looks like speech
+    """
+    import numpy as np
+
+    frame = max(1, rate * AUDIO_VAD_FRAME_MS // 1000)
+    count = len(samples) // frame
+    if count == 0:
+        return None
+    frames = samples[:count * frame].reshape(count, frame)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    threshold = max(np.percentile(energy_db, 10) + AUDIO_VAD_MARGIN_DB, AUDIO_VAD_MIN_DB)
+    speech = energy_db > threshold
+    if not speech.any():
+        return None
+
+    # Widen every speech frame by the padding on both sides
+    padding = int(math.ceil(AUDIO_VAD_PADDING_MS / AUDIO_VAD_FRAME_MS))
+    keep = np.convolve(speech.astype(np.int32), np.ones(2 * padding + 1, dtype=np.int32), mode='same') > 0
+
+    # Gaps are [start, end) runs of dropped frames; the leading and trailing ones stay dropped
+    bounded = np.concatenate(([True], keep, [True]))
+    changes = np.flatnonzero(bounded[1:] != bounded[:-1])
+    max_pause = AUDIO_VAD_MAX_PAUSE_MS // AUDIO_VAD_FRAME_MS
+    for start, end in zip(changes[0::2], changes[1::2]):
+        if start == 0 or end == count:
+            continue
+        keep[start:end if not max_pause else min(end, start + max_pause)] = True
+    return frames[keep].reshape(-1)
+
+def encode_audio(samples, output_format: str, streaming: bool, rate: int = AUDIO_TARGET_RATE):
+    """
+    Encode mono float samples
+
+    Args:
+        output_format (str): 'opus', 'flac' or 'wav'
+        streaming (bool): The audio goes to the streaming API, which takes raw PCM but not WAV
+
+    Returns:
+        tuple: (audio bytes, content type)
+    """
+    import numpy as np
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+    if output_format in ('opus', 'flac') and FFMPEG_PATH:
+        source = ['-f', 's16le', '-ar', str(rate), '-ac', '1', '-i', 'pipe:0']
+        if output_format == 'opus':
+            return _run_ffmpeg(source + ['-c:a', 'libopus', '-b:a', AUDIO_OPUS_BITRATE, '-f', 'ogg', 'pipe:1'], pcm), f'audio/ogg;rate={rate}'
+        return _run_ffmpeg(source + ['-c:a', 'flac', '-f', 'flac', 'pipe:1'], pcm), f'audio/flac;rate={rate}'
+    if streaming:
+        return pcm, f'audio/pcm;rate={rate}'
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(pcm)
+    return buffer.getvalue(), 'audio/wav'
+
+def preprocess_audio(audio_data: bytes, content_type: str, streaming: bool = False):
+    """
+    Decode, downmix to mono, resample to AUDIO_TARGET_RATE, trim silence and re-encode
+
+    Each step is timed as an 'audio.*' stage of the request. Audio that cannot be decoded here
+    (or any failure) is returned unchanged, so preprocessing never costs a transcription.
+
+    Args:
+        audio_data (bytes): Recording as uploaded
+        content_type (str): Its content type
+        streaming (bool): The result goes to the streaming API rather than a batch job
+
+    Returns:
+        tuple: (audio bytes, content type) to transcribe
+    """
+    if not AUDIO_PREPROCESS_ENABLED or not audio_data:
+        return audio_data, content_type
+    try:
+        with trace_stage('audio.decode'):
+            decoded = decode_audio(audio_data, content_type)
+        if decoded is None:
+            _count(passed_through=1)
+            return audio_data, content_type
+        samples, rate = decoded
+        seconds_in = len(samples) / rate
+
+        with trace_stage('audio.resample'):
+            samples = resample(downmix(samples), rate)
+        with trace_stage('audio.vad'):
+            speech = trim_silence(samples)
+        if speech is None:
+            # Nothing above the noise floor: send the whole clip rather than risk dropping quiet speech
+            _count(no_speech=1)
+            speech = samples
+        with trace_stage('audio.encode'):
+            encoded, encoded_type = encode_audio(speech, AUDIO_OUTPUT_FORMAT, streaming)
+    except Exception as e:
+        logger.warning(f"Audio preprocessing failed, sending the recording as is: {str(e) or type(e).__name__}")
+        _count(errors=1)
+        return audio_data, content_type
+
+    seconds_out = len(speech) / AUDIO_TARGET_RATE
+    _count(processed=1, bytes_in=len(audio_data), bytes_out=len(encoded), seconds_in=seconds_in, seconds_out=seconds_out)
+    logger.info(f"Preprocessed audio: {len(audio_data)} -> {len(encoded)} bytes ({encoded_type}), "
+                f"{seconds_in:.2f}s -> {seconds_out:.2f}s")
+    return encoded, encoded_type
+
+def get_audio_preprocess_stats() -> dict:
+    """Return preprocessing counters and the byte and duration reduction so far"""
+    with _metrics_lock:
+        stats = dict(metrics)
+    stats['enabled'] = AUDIO_PREPROCESS_ENABLED
+    stats['ffmpeg'] = FFMPEG_PATH is not None
+    stats['output_format'] = AUDIO_OUTPUT_FORMAT
+    stats['bytes_ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 4) if stats['bytes_in'] else None
+    stats['duration_ratio'] = round(stats['seconds_out'] / stats['seconds_in'], 4) if stats['seconds_in'] else None
+    stats['seconds_in'] = round(stats['seconds_in'], 2)
+    stats['seconds_out'] = round(stats['seconds_out'], 2)
+    return stats
@@ -0,0 +1,148 @@
+import boto3
+import logging
+import os
+import threading
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+# One session per process; clients and resources are cached per (service, region)
+_session = None
+_clients = {}
+_resources = {}
+_lock = threading.RLock()
+# Replaces boto3 for every client and resource when set (local stand-ins for benchmarks)
+_client_factory = None
+
+def get_default_region():
+    """Resolve the region the same way the Lambda and local environments do"""
+    return os.environ.get('AWS_LAMBDA_FUNCTION_REGION',
+           os.environ.get('DEFAULT_REGION',
+           os.environ.get('AWS_REGION', 'ca-central-1')))
+
+# Per-service defaults that take precedence over the global AWS_* settings. recognize_text is not
+# idempotent: a retried or abandoned call still advances the Lex dialog, so Lex gets a single
+# attempt whose read timeout is the call's budget (see resilience_utils).
+SERVICE_DEFAULTS = {
+    'lexv2-runtime': {
+        'MAX_ATTEMPTS': '1',
+        'CONNECT_TIMEOUT': '1',
+        'READ_TIMEOUT': str(float(os.environ.get('LEX_CALL_TIMEOUT_MS', '3000')) / 1000)
+    }
+}
+
+def _env_setting(service: str, name: str, default: str) -> str:
+    """Read a per-service override (e.g. POLLY_READ_TIMEOUT) before the global AWS_* setting"""
+    service_prefix = service.upper().replace('-', '_')
+    service_default = SERVICE_DEFAULTS.get(service, {}).get(name)
+    if service_default is not None:
+        return os.environ.get(f"{service_prefix}_{name}", service_default)
+    return os.environ.get(f"{service_prefix}_{name}", os.environ.get(f"AWS_{name}", default))
+
+def build_config(service: str) -> Config:
+    """
+    Build the botocore config for a service from Chalice environment variables
+
+    Args:
+        service (str): AWS service name (e.g. 'polly', 'lexv2-runtime')
+
+    Returns:
+        Config: Pool size, keepalive, retry and timeout settings
+    """
+    return Config(
+        max_pool_connections=int(_env_setting(service, 'MAX_POOL_CONNECTIONS', '25')),
+        connect_timeout=float(_env_setting(service, 'CONNECT_TIMEOUT', '2')),
+        read_timeout=float(_env_setting(service, 'READ_TIMEOUT', '10')),
+        tcp_keepalive=_env_setting(service, 'TCP_KEEPALIVE', 'true').lower() == 'true',
+        retries={
+            'max_attempts': int(_env_setting(service, 'MAX_ATTEMPTS', '3')),
+            'mode': _env_setting(service, 'RETRY_MODE', 'standard')
+        }
+    )
+
+def get_session():
+    """Return the process-wide boto3 session"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+def get_client(service: str, region_name: str = None):
+    """
+    Return the shared client for a service, creating it once per process
+
+    Args:
+        service (str): AWS service name
+        region_name (str): Region, defaults to get_default_region()
+
+    Returns:
+        botocore client
+    """
+    region = region_name or get_default_region()
+    key = (service, region)
+    client = _clients.get(key)
+    if client is None:
+        # Session.client is not thread-safe, so construction is serialized
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                if _client_factory is not None:
+                    client = _client_factory.client(service, region_name=region)
+                else:
+                    client = get_session().client(service, region_name=region, config=build_config(service))
+                _clients[key] = client
+                logger.info(f"Created shared {service} client in region {region}")
+    return client
+
+def get_resource(service: str, region_name: str = None):
+    """
+    Return the shared resource for a service, creating it once per process
+
+    Resources are not thread-safe; background threads should use get_client instead.
+
+    Args:
+        service (str): AWS service name
+        region_name (str): Region, defaults to get_default_region()
+
+    Returns:
+        boto3 service resource
+    """
+    region = region_name or get_default_region()
+    key = (service, region)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                if _client_factory is not None:
+                    resource = _client_factory.resource(service, region_name=region)
+                else:
+                    resource = get_session().resource(service, region_name=region, config=build_config(service))
+                _resources[key] = resource
+                logger.info(f"Created shared {service} resource in region {region}")
+    return resource
+
+def reset_clients():
+    """Drop cached clients, resources and the session (e.g. after changing configuration)"""
+    global _session
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _session = None
+
+def set_client_factory(factory):
+    """
+    Create all clients and resources through a factory instead of boto3
+
+    Must be called before the utils initialize their clients (i.e. before app.py is imported).
+
+    Args:
+        factory: Object with client(service, region_name) and resource(service, region_name)
+            methods, or None to go back to boto3
+    """
+    global _client_factory
+    with _lock:
+        _client_factory = factory
+    reset_clients()
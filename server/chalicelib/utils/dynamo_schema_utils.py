@@ -0,0 +1,324 @@
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+
+logger = logging.getLogger(__name__)
+
+# Table schema configuration from Chalice config
+DYNAMO_CAPACITY_MODE = os.environ.get('DYNAMO_CAPACITY_MODE', 'on_demand')
+DYNAMO_MIN_CAPACITY = int(os.environ.get('DYNAMO_MIN_CAPACITY', '5'))
+DYNAMO_MAX_CAPACITY = int(os.environ.get('DYNAMO_MAX_CAPACITY', '100'))
+DYNAMO_TARGET_UTILIZATION = float(os.environ.get('DYNAMO_TARGET_UTILIZATION', '70'))
+DYNAMO_TTL_DAYS = int(os.environ.get('DYNAMO_TTL_DAYS', '90'))
+# Give items backfilled by a migration a TTL too, counted from the migration rather than the turn
+DYNAMO_BACKFILL_TTL = os.environ.get('DYNAMO_BACKFILL_TTL', 'false').lower() == 'true'
+DYNAMO_WRITE_SHARDS = int(os.environ.get('DYNAMO_WRITE_SHARDS', '8'))
+
+# Bumped whenever the table layout below changes; stored in the table's tags
+SCHEMA_VERSION = 2
+SCHEMA_VERSION_TAG = 'schema-version'
+TTL_ATTRIBUTE = 'expires_at'
+
+# Sharded GSIs: the partition key is '<value>#<shard>' so one busy intent or day is spread over
+# DYNAMO_WRITE_SHARDS partitions; readers query every shard and merge on timestamp
+INTENT_INDEX = 'intent-index'
+DATE_INDEX = 'date-index'
+INDEX_KEYS = {
+    INTENT_INDEX: 'intent_shard',
+    DATE_INDEX: 'date_bucket'
+}
+INDEX_PROJECTION = {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['message', 'response', 'intent']}
+
+def _region():
+    return os.environ.get('AWS_REGION', 'ca-central-1')
+
+def shard_for(session_id: str, shards: int = DYNAMO_WRITE_SHARDS) -> int:
+    """Stable shard of a session, so one session's turns stay together on each index"""
+    return zlib.crc32(session_id.encode('utf-8')) % shards
+
+def expiry_for(written_at: datetime) -> int:
+    """Epoch seconds at which an item written at `written_at` (naive UTC) expires"""
+    return int((written_at + timedelta(days=DYNAMO_TTL_DAYS) - datetime(1970, 1, 1)).total_seconds())
+
+def index_attributes(session_id: str, timestamp: str, intent: str, shards: int = DYNAMO_WRITE_SHARDS,
+                     ttl: bool = True) -> dict:
+    """
+    Attributes that place a conversation item in the sharded indexes and give it a TTL
+
+    Args:
+        session_id (str): Session ID
+        timestamp (str): ISO-8601 UTC timestamp of the turn
+        intent (str): Detected intent
+        ttl (bool): Include expires_at, counted from the turn's timestamp
+
+    Returns:
+        dict: intent_shard, date_bucket and (when TTL is enabled) expires_at
+    """
+    shard = shard_for(session_id, shards)
+    attributes = {
+        'intent_shard': f"{intent}#{shard}",
+        'date_bucket': f"{timestamp[:10]}#{shard}"
+    }
+    if ttl and DYNAMO_TTL_DAYS > 0:
+        attributes[TTL_ATTRIBUTE] = expiry_for(datetime.fromisoformat(timestamp))
+    return attributes
+
+def _index_definition(name: str, capacity: dict = None) -> dict:
+    definition = {
+        'IndexName': name,
+        'KeySchema': [
+            {'AttributeName': INDEX_KEYS[name], 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        'Projection': INDEX_PROJECTION
+    }
+    if capacity:
+        definition['ProvisionedThroughput'] = capacity
+    return definition
+
+def _capacity():
+    """Initial provisioned throughput in autoscaled mode, None for on-demand"""
+    if DYNAMO_CAPACITY_MODE == 'on_demand':
+        return None
+    return {'ReadCapacityUnits': DYNAMO_MIN_CAPACITY, 'WriteCapacityUnits': DYNAMO_MIN_CAPACITY}
+
+def _attribute_definitions():
+    return [
+        {'AttributeName': 'session_id', 'AttributeType': 'S'},
+        {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+    ] + [{'AttributeName': key, 'AttributeType': 'S'} for key in INDEX_KEYS.values()]
+
+def wait_until_active(client, table_name: str, timeout: float = 600):
+    """Wait for the table and all of its indexes to become ACTIVE"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        table = client.describe_table(TableName=table_name)['Table']
+        statuses = [table['TableStatus']] + [index['IndexStatus'] for index in table.get('GlobalSecondaryIndexes', [])]
+        if all(status == 'ACTIVE' for status in statuses):
+            return table
+        time.sleep(5)
+    raise TimeoutError(f"Table '{table_name}' did not become ACTIVE within {timeout}s")
+
+def get_schema_version(client, table_arn: str) -> int:
+    """Read the schema version tag; tables created before versioning count as version 1"""
+    tags = client.list_tags_of_resource(ResourceArn=table_arn).get('Tags', [])
+    for tag in tags:
+        if tag['Key'] == SCHEMA_VERSION_TAG:
+            return int(tag['Value'])
+    return 1
+
+def _set_schema_version(client, table_arn: str, version: int):
+    client.tag_resource(ResourceArn=table_arn, Tags=[{'Key': SCHEMA_VERSION_TAG, 'Value': str(version)}])
+
+def create_table(client, table_name: str) -> dict:
+    """Create the table at the current schema version"""
+    capacity = _capacity()
+    params = {
+        'TableName': table_name,
+        'KeySchema': [
+            {'AttributeName': 'session_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        'AttributeDefinitions': _attribute_definitions(),
+        'GlobalSecondaryIndexes': [_index_definition(name, capacity) for name in INDEX_KEYS],
+        'Tags': [{'Key': SCHEMA_VERSION_TAG, 'Value': str(SCHEMA_VERSION)}]
+    }
+    if capacity:
+        params['BillingMode'] = 'PROVISIONED'
+        params['ProvisionedThroughput'] = capacity
+    else:
+        params['BillingMode'] = 'PAY_PER_REQUEST'
+    client.create_table(**params)
+    table = wait_until_active(client, table_name)
+    configure_ttl(client, table_name)
+    configure_capacity(client, table)
+    return table
+
+def configure_ttl(client, table_name: str):
+    """Enable (or disable, when DYNAMO_TTL_DAYS is 0) expiry on the TTL attribute"""
+    status = client.describe_time_to_live(TableName=table_name).get('TimeToLiveDescription', {})
+    enabled = status.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING')
+    wanted = DYNAMO_TTL_DAYS > 0
+    if enabled == wanted:
+        return
+    client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': wanted, 'AttributeName': TTL_ATTRIBUTE}
+    )
+    logger.info(f"TTL on '{TTL_ATTRIBUTE}' {'enabled' if wanted else 'disabled'} for '{table_name}'")
+
+def configure_capacity(client, table: dict):
+    """
+    Switch the table between on-demand and autoscaled provisioned capacity
+
+    In autoscaled mode, target-tracking policies are registered for the table and each index.
+    """
+    table_name = table['TableName']
+    billing = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+    if DYNAMO_CAPACITY_MODE == 'on_demand':
+        if billing != 'PAY_PER_REQUEST':
+            client.update_table(TableName=table_name, BillingMode='PAY_PER_REQUEST')
+            wait_until_active(client, table_name)
+            logger.info(f"Switched '{table_name}' to on-demand capacity")
+        return
+
+    if billing == 'PAY_PER_REQUEST':
+        capacity = _capacity()
+        client.update_table(
+            TableName=table_name,
+            BillingMode='PROVISIONED',
+            ProvisionedThroughput=capacity,
+            GlobalSecondaryIndexUpdates=[
+                {'Update': {'IndexName': index['IndexName'], 'ProvisionedThroughput': capacity}}
+                for index in table.get('GlobalSecondaryIndexes', [])
+            ]
+        )
+        wait_until_active(client, table_name)
+
+    autoscaling = get_client('application-autoscaling', region_name=_region())
+    resources = [(f"table/{table_name}", 'table')] + [
+        (f"table/{table_name}/index/{index['IndexName']}", 'index')
+        for index in table.get('GlobalSecondaryIndexes', [])
+    ]
+    for resource_id, kind in resources:
+        for unit, metric in (('Read', 'DynamoDBReadCapacityUtilization'), ('Write', 'DynamoDBWriteCapacityUtilization')):
+            dimension = f"dynamodb:{kind}:{unit}CapacityUnits"
+            autoscaling.register_scalable_target(
+                ServiceNamespace='dynamodb',
+                ResourceId=resource_id,
+                ScalableDimension=dimension,
+                MinCapacity=DYNAMO_MIN_CAPACITY,
+                MaxCapacity=DYNAMO_MAX_CAPACITY
+            )
+            autoscaling.put_scaling_policy(
+                PolicyName=f"{resource_id.replace('/', '-')}-{unit.lower()}-target",
+                ServiceNamespace='dynamodb',
+                ResourceId=resource_id,
+                ScalableDimension=dimension,
+                PolicyType='TargetTrackingScaling',
+                TargetTrackingScalingPolicyConfiguration={
+                    'TargetValue': DYNAMO_TARGET_UTILIZATION,
+                    'PredefinedMetricSpecification': {'PredefinedMetricType': metric}
+                }
+            )
+    logger.info(f"Autoscaling {DYNAMO_MIN_CAPACITY}-{DYNAMO_MAX_CAPACITY} units at {DYNAMO_TARGET_UTILIZATION}% for '{table_name}'")
+
+def backfill_index_attributes(client, table_name: str) -> int:
+    """
+    Add index attributes to items written before schema version 2
+
+    Backfilled items get no TTL unless DYNAMO_BACKFILL_TTL is set, and then it is counted from
+    the migration: a TTL counted from each turn would delete all history older than
+    DYNAMO_TTL_DAYS as soon as TTL is enabled.
+
+    Returns:
+        int: Number of items updated
+    """
+    updated = 0
+    expires_at = expiry_for(datetime.utcnow()) if DYNAMO_BACKFILL_TTL and DYNAMO_TTL_DAYS > 0 else None
+    paginator = client.get_paginator('scan')
+    pages = paginator.paginate(
+        TableName=table_name,
+        ProjectionExpression='session_id, #ts, intent',
+        FilterExpression='attribute_not_exists(intent_shard)',
+        ExpressionAttributeNames={'#ts': 'timestamp'}
+    )
+    for page in pages:
+        for item in page.get('Items', []):
+            session_id = item['session_id']['S']
+            timestamp = item['timestamp']['S']
+            intent = item.get('intent', {}).get('S', 'unknown')
+            attributes = index_attributes(session_id, timestamp, intent, ttl=False)
+            if expires_at is not None:
+                attributes[TTL_ATTRIBUTE] = expires_at
+            names = {f"#a{index}": name for index, name in enumerate(attributes)}
+            values = {
+                f":v{index}": {'N': str(value)} if isinstance(value, int) else {'S': value}
+                for index, value in enumerate(attributes.values())
+            }
+            try:
+                client.update_item(
+                    TableName=table_name,
+                    Key={'session_id': {'S': session_id}, 'timestamp': {'S': timestamp}},
+                    UpdateExpression='SET ' + ', '.join(f"{name} = :v{index}" for index, name in enumerate(names)),
+                    ConditionExpression='attribute_not_exists(intent_shard)',
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+                updated += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+    logger.info(f"Backfilled index attributes on {updated} items in '{table_name}'")
+    return updated
+
+def _migrate_to_v2(client, table: dict, backfill: bool):
+    """Add the sharded GSIs, one per UpdateTable call as DynamoDB requires"""
+    table_name = table['TableName']
+    existing = {index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])}
+    provisioned = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED') == 'PROVISIONED'
+    for name in INDEX_KEYS:
+        if name in existing:
+            continue
+        logger.info(f"Creating index '{name}' on '{table_name}'")
+        client.update_table(
+            TableName=table_name,
+            AttributeDefinitions=_attribute_definitions(),
+            GlobalSecondaryIndexUpdates=[{'Create': _index_definition(
+                name,
+                {'ReadCapacityUnits': DYNAMO_MIN_CAPACITY, 'WriteCapacityUnits': DYNAMO_MIN_CAPACITY} if provisioned else None
+            )}]
+        )
+        wait_until_active(client, table_name)
+    if backfill:
+        backfill_index_attributes(client, table_name)
+
+# Migration steps by the version they upgrade from
+MIGRATIONS = {
+    1: _migrate_to_v2
+}
+
+def ensure_table_schema(table_name: str, backfill: bool = True) -> bool:
+    """
+    Create the table, or migrate an existing one step by step to SCHEMA_VERSION
+
+    Run at deploy time (see tools/provision.py), not in the request path.
+
+    Args:
+        table_name (str): DynamoDB table name
+        backfill (bool): Rewrite existing items so they appear in the new indexes
+
+    Returns:
+        bool: True if the table is at the current schema version
+    """
+    client = get_client('dynamodb', region_name=_region())
+    try:
+        try:
+            table = client.describe_table(TableName=table_name)['Table']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            logger.info(f"Creating DynamoDB table '{table_name}' at schema version {SCHEMA_VERSION}...")
+            create_table(client, table_name)
+            logger.info(f"DynamoDB table '{table_name}' created successfully")
+            return True
+
+        version = get_schema_version(client, table['TableArn'])
+        while version < SCHEMA_VERSION:
+            logger.info(f"Migrating '{table_name}' from schema version {version} to {version + 1}")
+            MIGRATIONS[version](client, wait_until_active(client, table_name), backfill)
+            version += 1
+            _set_schema_version(client, table['TableArn'], version)
+
+        # Capacity mode and TTL follow configuration even when the schema is current
+        configure_ttl(client, table_name)
+        configure_capacity(client, wait_until_active(client, table_name))
+        logger.info(f"DynamoDB table '{table_name}' is at schema version {version}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to provision DynamoDB table schema: {str(e)}")
+        return False
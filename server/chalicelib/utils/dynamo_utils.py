@@ -1,10 +1,18 @@
-import boto3
 import logging
 import os
 import json
-import uuid
-from botocore.exceptions import ClientError
+import base64
+import heapq
+from boto3.dynamodb.types import TypeDeserializer
+from concurrent.futures import ThreadPoolExecutor
+from chalicelib.utils.aws_utils import get_client, get_resource
+from chalicelib.utils.dynamo_schema_utils import (
+    DYNAMO_WRITE_SHARDS, INTENT_INDEX, DATE_INDEX, INDEX_KEYS, ensure_table_schema, index_attributes
+)
+from chalicelib.utils.dynamo_writer_utils import DYNAMO_WRITE_MODE, get_writer
+from chalicelib.utils.history_cache_utils import history_cache
 from datetime import datetime
+from chalicelib.utils.tracing_utils import traced
 
 logger = logging.getLogger(__name__)
 dynamodb = None
@@ -12,6 +20,9 @@ dynamodb = None
 # Get DynamoDB table name from Chalice config
 CHAT_HISTORY_TABLE = os.environ.get('DYNAMODB_TABLE', 'dental-chat-history')
 
+# Attributes a history read may project
+HISTORY_ATTRIBUTES = ('session_id', 'timestamp', 'message', 'response', 'intent')
+
 def init_dynamodb():
     """Initialize DynamoDB client"""
     global dynamodb
@@ -20,37 +31,7 @@ def init_dynamodb():
         region = os.environ.get('AWS_REGION', 'ca-central-1')
         
         # Create DynamoDB resource using explicit region
-        dynamodb = boto3.resource('dynamodb', region_name=region)
-        
-        # Check if table exists, create if it doesn't
-        try:
-            table = dynamodb.Table(CHAT_HISTORY_TABLE)
-            table.load()
-            logger.info(f"DynamoDB table '{CHAT_HISTORY_TABLE}' already exists")
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                # Table doesn't exist, create it
-                logger.info(f"Creating DynamoDB table '{CHAT_HISTORY_TABLE}'...")
-                
-                table = dynamodb.create_table(
-                    TableName=CHAT_HISTORY_TABLE,
-                    KeySchema=[
-                        {'AttributeName': 'session_id', 'KeyType': 'HASH'},
-                        {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
-                    ],
-                    AttributeDefinitions=[
-                        {'AttributeName': 'session_id', 'AttributeType': 'S'},
-                        {'AttributeName': 'timestamp', 'AttributeType': 'S'}
-                    ],
-                    ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-                )
-                
-                # Wait for table creation
-                table.meta.client.get_waiter('table_exists').wait(TableName=CHAT_HISTORY_TABLE)
-                logger.info(f"DynamoDB table '{CHAT_HISTORY_TABLE}' created successfully")
-            else:
-                logger.error(f"Error checking DynamoDB table: {str(e)}")
-                raise
+        dynamodb = get_resource('dynamodb', region_name=region)
         
         logger.info(f"DynamoDB initialized for table '{CHAT_HISTORY_TABLE}' in region {region}")
         return True
@@ -58,15 +39,44 @@ def init_dynamodb():
         logger.error(f"Failed to initialize DynamoDB: {str(e)}")
         return False
 
-def store_conversation(session_id: str, message: str, response: str, intent: str = None):
+def provision_table(backfill: bool = True):
     """
-    Store conversation in DynamoDB
+    Create the chat history table, or migrate it to the current schema version
+    
+    Run at deploy time (see tools/provision.py), not in the request path.
     
     Args:
-        session_id (str): Session ID
-        message (str): User message
-        response (str): Bot response
-        intent (str): Detected intent
+        backfill (bool): Add index and TTL attributes to existing items during a migration
+        
+    Returns:
+        bool: True if the table exists at the current schema version
+    """
+    return ensure_table_schema(CHAT_HISTORY_TABLE, backfill=backfill)
+
+def build_conversation_item(session_id: str, message: str, response: str, intent: str = None, intent_source: str = None):
+    """Build the DynamoDB item for one conversation turn, including its index and TTL attributes"""
+    item = {
+        'session_id': session_id,
+        'timestamp': datetime.utcnow().isoformat(),
+        'message': message,
+        'response': response,
+        'intent': intent if intent else 'unknown'
+    }
+    if intent_source:
+        # Intent not decided by Lex; such turns are left out of intent model training
+        item['intent_source'] = intent_source
+    item.update(index_attributes(session_id, item['timestamp'], item['intent']))
+    return item
+
+def put_conversation_item(item: dict):
+    """
+    Write one conversation item synchronously
+    
+    Args:
+        item (dict): Item from build_conversation_item
+        
+    Returns:
+        bool: Success status
     """
     if not dynamodb:
         if not init_dynamodb():
@@ -75,52 +85,245 @@ def store_conversation(session_id: str, message: str, response: str, intent: str
     
     try:
         table = dynamodb.Table(CHAT_HISTORY_TABLE)
-        timestamp = datetime.utcnow().isoformat()
-        
-        item = {
-            'session_id': session_id,
-            'timestamp': timestamp,
-            'message': message,
-            'response': response,
-            'intent': intent if intent else 'unknown'
-        }
-        
         table.put_item(Item=item)
-        logger.info(f"Stored conversation for session {session_id}")
+        logger.info(f"Stored conversation for session {item['session_id']}")
         return True
     except Exception as e:
         logger.error(f"Error storing conversation: {str(e)}")
         return False
 
-def get_conversation_history(session_id: str, limit: int = 10):
+@traced('dynamodb')
+def store_conversation(session_id: str, message: str, response: str, intent: str = None, intent_source: str = None):
     """
-    Get conversation history from DynamoDB
+    Store conversation in DynamoDB
+    
+    In 'async' DYNAMO_WRITE_MODE the turn is queued for a batched background write;
+    in 'sync' mode it is written before returning.
     
     Args:
         session_id (str): Session ID
-        limit (int): Maximum number of messages to return
+        message (str): User message
+        response (str): Bot response
+        intent (str): Detected intent
+        intent_source (str): 'preclassifier' or 'fallback' when the reply did not come from Lex
+    """
+    item = build_conversation_item(session_id, message, response, intent, intent_source)
+    history_cache.append(item)
+    
+    if DYNAMO_WRITE_MODE == 'async':
+        return get_writer(CHAT_HISTORY_TABLE, put_conversation_item).submit(item)
+    
+    return put_conversation_item(item)
+
+def encode_cursor(last_evaluated_key: dict):
+    """Encode a LastEvaluatedKey as an opaque URL-safe cursor"""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor: str, session_id: str):
+    """
+    Decode a cursor back into an ExclusiveStartKey
+    
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another session
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict) or key.get('session_id') != session_id or not isinstance(key.get('timestamp'), str):
+        raise ValueError("Invalid cursor")
+    return {'session_id': session_id, 'timestamp': key['timestamp']}
+
+def _projection(attributes):
+    """Build ProjectionExpression and ExpressionAttributeNames for the requested attributes"""
+    names = {f"#a{index}": name for index, name in enumerate(attributes)}
+    return ", ".join(names), names
+
+def _query_page(table, session_id, limit=None, start_key=None, latest=False, attributes=HISTORY_ATTRIBUTES):
+    projection, names = _projection(attributes)
+    params = {
+        'KeyConditionExpression': '#sid = :sid',
+        'ExpressionAttributeValues': {':sid': session_id},
+        'ExpressionAttributeNames': dict(names, **{'#sid': 'session_id'}),
+        'ProjectionExpression': projection,
+        'ScanIndexForward': not latest
+    }
+    if limit:
+        params['Limit'] = limit
+    if start_key:
+        params['ExclusiveStartKey'] = start_key
+    return table.query(**params)
+
+def _load_session(table, session_id):
+    """Read a complete session for the cache, or None if it is too long to cache"""
+    items = []
+    start_key = None
+    while True:
+        response = _query_page(table, session_id, start_key=start_key)
+        items.extend(response.get('Items', []))
+        if len(items) > history_cache.max_items:
+            return None
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            return items
+
+def _page_from_items(items, session_id, limit, start_key, latest, attributes):
+    """Serve a page from cached items with the same cursor semantics as DynamoDB"""
+    ordered = list(reversed(items)) if latest else items
+    if start_key:
+        after = start_key['timestamp']
+        ordered = [item for item in ordered if (item['timestamp'] < after if latest else item['timestamp'] > after)]
+    page = ordered[:limit]
+    next_cursor = None
+    if len(ordered) > limit and page:
+        next_cursor = encode_cursor({'session_id': session_id, 'timestamp': page[-1]['timestamp']})
+    return {
+        'items': [{name: item[name] for name in attributes if name in item} for item in page],
+        'next_cursor': next_cursor,
+        'cached': True
+    }
+
+@traced('dynamodb')
+def query_conversation_history(session_id: str, limit: int = 10, cursor: str = None, latest: bool = False,
+                               attributes=None):
+    """
+    Read one page of a session's conversation history
+    
+    Sessions short enough to cache are loaded once and then served from the per-session
+    write-through cache; longer sessions are queried directly, one page at a time.
+    
+    Args:
+        session_id (str): Session ID
+        limit (int): Maximum number of turns to return
+        cursor (str): Cursor from a previous page's next_cursor
+        latest (bool): Return the most recent turns first (descending order)
+        attributes (list): Attributes to return, defaults to all of HISTORY_ATTRIBUTES
         
     Returns:
-        list: List of conversation messages
+        dict: Page with 'items', 'next_cursor' (None on the last page) and 'cached'
+        
+    Raises:
+        ValueError: If the cursor or attributes are invalid
     """
+    attributes = tuple(attributes) if attributes else HISTORY_ATTRIBUTES
+    unknown = [name for name in attributes if name not in HISTORY_ATTRIBUTES]
+    if unknown:
+        raise ValueError(f"Unknown attributes: {', '.join(unknown)}")
+    start_key = decode_cursor(cursor, session_id) if cursor else None
+    
+    items = history_cache.get(session_id)
+    if items is not None:
+        return _page_from_items(items, session_id, limit, start_key, latest, attributes)
+    
     if not dynamodb:
         if not init_dynamodb():
             logger.error("Failed to initialize DynamoDB")
-            return []
+            return {'items': [], 'next_cursor': None, 'cached': False}
     
-    try:
-        table = dynamodb.Table(CHAT_HISTORY_TABLE)
-        
-        response = table.query(
-            KeyConditionExpression='session_id = :sid',
-            ExpressionAttributeValues={
-                ':sid': session_id
-            },
-            ScanIndexForward=True,  # ascending order by timestamp
-            Limit=limit
-        )
+    table = dynamodb.Table(CHAT_HISTORY_TABLE)
+    items = _load_session(table, session_id)
+    if items is not None:
+        history_cache.put(session_id, items)
+        return _page_from_items(items, session_id, limit, start_key, latest, attributes)
+    
+    # Too long to cache: read just the requested page and attributes
+    response = _query_page(table, session_id, limit=limit, start_key=start_key, latest=latest, attributes=attributes)
+    return {
+        'items': response.get('Items', []),
+        'next_cursor': encode_cursor(response.get('LastEvaluatedKey')),
+        'cached': False
+    }
+
+def get_conversation_history(session_id: str, limit: int = 10):
+    """
+    Get conversation history from DynamoDB
+    
+    Args:
+        session_id (str): Session ID
+        limit (int): Maximum number of messages to return
         
-        return response.get('Items', [])
+    Returns:
+        list: List of conversation messages
+    """
+    try:
+        return query_conversation_history(session_id, limit=limit)['items']
     except Exception as e:
         logger.error(f"Error getting conversation history: {str(e)}")
         return []
+
+_deserializer = TypeDeserializer()
+
+def _query_shard(index_name: str, key_value: str, since: str = None, until: str = None, limit: int = None, latest: bool = False):
+    """Read one shard of a sharded index, in timestamp order"""
+    client = get_client('dynamodb', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+    condition = '#pk = :pk'
+    values = {':pk': {'S': key_value}}
+    if since and until:
+        condition += ' AND #ts BETWEEN :since AND :until'
+        values.update({':since': {'S': since}, ':until': {'S': until}})
+    elif since:
+        condition += ' AND #ts >= :since'
+        values[':since'] = {'S': since}
+    elif until:
+        condition += ' AND #ts <= :until'
+        values[':until'] = {'S': until}
+    params = {
+        'TableName': CHAT_HISTORY_TABLE,
+        'IndexName': index_name,
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeNames': {'#pk': INDEX_KEYS[index_name], '#ts': 'timestamp'},
+        'ExpressionAttributeValues': values,
+        'ScanIndexForward': not latest
+    }
+    items = []
+    while True:
+        if limit:
+            params['Limit'] = limit - len(items)
+        response = client.query(**params)
+        items.extend(
+            {name: _deserializer.deserialize(value) for name, value in item.items() if name in HISTORY_ATTRIBUTES}
+            for item in response.get('Items', [])
+        )
+        if 'LastEvaluatedKey' not in response or (limit and len(items) >= limit):
+            return items
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _query_sharded(index_name: str, value: str, since: str = None, until: str = None, limit: int = 100, latest: bool = False):
+    """Query every shard of an index in parallel and merge the results on timestamp"""
+    with ThreadPoolExecutor(max_workers=min(DYNAMO_WRITE_SHARDS, 8), thread_name_prefix='dynamo-query') as executor:
+        shards = list(executor.map(
+            lambda shard: _query_shard(index_name, f"{value}#{shard}", since, until, limit, latest),
+            range(DYNAMO_WRITE_SHARDS)
+        ))
+    merged = heapq.merge(*shards, key=lambda item: item['timestamp'], reverse=latest)
+    return [item for _, item in zip(range(limit), merged)]
+
+@traced('dynamodb')
+def query_by_intent(intent: str, since: str = None, until: str = None, limit: int = 100, latest: bool = False):
+    """
+    Read turns with a given intent from the intent index, without a Scan
+    
+    Args:
+        intent (str): Intent name (e.g. 'BookAppointment')
+        since (str): Earliest ISO timestamp to include
+        until (str): Latest ISO timestamp to include
+        limit (int): Maximum number of turns to return
+        latest (bool): Most recent turns first
+        
+    Returns:
+        list: Turns in timestamp order
+    """
+    return _query_sharded(INTENT_INDEX, intent, since, until, limit, latest)
+
+@traced('dynamodb')
+def query_by_day(day: str, limit: int = 100, latest: bool = False):
+    """
+    Read the turns of one UTC day (YYYY-MM-DD) from the date index, without a Scan
+    
+    Returns:
+        list: Turns in timestamp order
+    """
+    return _query_sharded(DATE_INDEX, day, limit=limit, latest=latest)
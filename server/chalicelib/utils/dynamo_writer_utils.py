@@ -0,0 +1,307 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import signal
+import threading
+import time
+import urllib.request
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration from Chalice config
+DYNAMO_WRITE_MODE = os.environ.get('DYNAMO_WRITE_MODE', 'async')
+DYNAMO_QUEUE_SIZE = int(os.environ.get('DYNAMO_QUEUE_SIZE', '1000'))
+DYNAMO_BATCH_LINGER = float(os.environ.get('DYNAMO_BATCH_LINGER', '0.02'))
+DYNAMO_MAX_RETRIES = int(os.environ.get('DYNAMO_MAX_RETRIES', '5'))
+DYNAMO_FLUSH_ON_RESPONSE = os.environ.get('DYNAMO_FLUSH_ON_RESPONSE', 'true').lower() == 'true'
+DYNAMO_FLUSH_TIMEOUT = float(os.environ.get('DYNAMO_FLUSH_TIMEOUT', '1.0'))
+# Register an internal Lambda extension so the runtime receives SIGTERM before shutdown
+LAMBDA_SHUTDOWN_EXTENSION = os.environ.get('LAMBDA_SHUTDOWN_EXTENSION', 'true').lower() == 'true'
+
+# Hard limit of the BatchWriteItem API
+MAX_BATCH_SIZE = 25
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+# Queued by flush() to stop the writer lingering for more items
+_FLUSH = object()
+
+class ConversationWriter:
+    """Background writer that coalesces conversation items into BatchWriteItem calls"""
+
+    def __init__(self, table_name: str, put_item_fn, max_queue: int = DYNAMO_QUEUE_SIZE,
+                 linger: float = DYNAMO_BATCH_LINGER, max_retries: int = DYNAMO_MAX_RETRIES):
+        self.table_name = table_name
+        # Synchronous single-item write used when the queue is full, and for items a batch rejects
+        self.put_item_fn = put_item_fn
+        self.linger = linger
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'retries': 0,
+            'dropped': 0,
+            'overflow_sync': 0,
+            'flush_timeouts': 0,
+            'max_queue_depth': 0
+        }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._metrics_lock:
+            self.metrics[name] += amount
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='dynamo-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, item: dict) -> bool:
+        """
+        Queue an item for writing, falling back to a synchronous put if the queue is full
+
+        Args:
+            item (dict): DynamoDB item in Python types
+
+        Returns:
+            bool: True if the item was queued or written
+        """
+        self._ensure_thread()
+        with self._idle:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._done(1)
+            self._count('overflow_sync')
+            logger.warning("Conversation write queue full, writing synchronously")
+            return self.put_item_fn(item)
+
+        depth = self._queue.qsize()
+        with self._metrics_lock:
+            self.metrics['enqueued'] += 1
+            if depth > self.metrics['max_queue_depth']:
+                self.metrics['max_queue_depth'] = depth
+        return True
+
+    def _done(self, count: int):
+        with self._idle:
+            self._pending -= count
+            if self._pending <= 0:
+                self._idle.notify_all()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            batch = [] if first is _FLUSH else [first]
+            # Linger briefly so turns arriving together share one request, unless a flush is waiting
+            lingering = first is not _FLUSH
+            deadline = time.monotonic() + self.linger
+            while len(batch) < MAX_BATCH_SIZE:
+                remaining = deadline - time.monotonic() if lingering else 0
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    lingering = False
+                else:
+                    batch.append(item)
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self._count('dropped', len(batch))
+                logger.error(f"Error writing conversation batch: {str(e)}")
+            finally:
+                self._done(len(batch))
+
+    def _write_batch(self, items: list):
+        """
+        Write items with BatchWriteItem, retrying throttled items and failed calls with backoff
+
+        A batch the API rejects outright (ValidationException) is written item by item, so one
+        bad item does not take the others down with it.
+        """
+        requests = [
+            {'PutRequest': {'Item': {key: _serializer.serialize(value) for key, value in item.items()}}}
+            for item in items
+        ]
+        client = get_client('dynamodb', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+        attempt = 0
+
+        while requests:
+            try:
+                response = client.batch_write_item(RequestItems={self.table_name: requests})
+            except Exception as e:
+                if isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') == 'ValidationException':
+                    self._write_items(requests)
+                    return
+                # Throttling after botocore's own retries, timeouts, connection errors: retry the whole batch
+                logger.warning(f"Conversation batch write failed, retrying: {str(e)}")
+                unprocessed = requests
+            else:
+                self._count('batches')
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                self._count('written', len(requests) - len(unprocessed))
+            requests = unprocessed
+            if not requests:
+                return
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self._count('dropped', len(requests))
+                logger.error(f"Dropping {len(requests)} conversation items after {self.max_retries} retries")
+                return
+            self._count('retries')
+            # Exponential backoff with jitter for throttled items
+            delay = min(0.05 * (2 ** attempt), 2.0)
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def _write_items(self, requests: list):
+        """Write batch requests one at a time, counting only the items that fail"""
+        for request in requests:
+            item = {key: _deserializer.deserialize(value) for key, value in request['PutRequest']['Item'].items()}
+            self._count('written' if self.put_item_fn(item) else 'dropped')
+
+    def flush(self, timeout: float = DYNAMO_FLUSH_TIMEOUT) -> bool:
+        """
+        Write queued items now, without waiting out the batch linger
+
+        Args:
+            timeout (float): Seconds to wait
+
+        Returns:
+            bool: True if nothing is left pending
+        """
+        with self._idle:
+            if self._pending <= 0:
+                return True
+        try:
+            # Wakes a writer that is lingering for more items
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            # A full queue makes full batches, which do not linger anyway
+            pass
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def abandon(self) -> int:
+        """Count the items still pending as dropped, when the process is about to go away"""
+        with self._idle:
+            pending = max(0, self._pending)
+        if pending:
+            self._count('dropped', pending)
+            logger.error(f"Dropping {pending} conversation items still queued at shutdown")
+        return pending
+
+    def get_metrics(self) -> dict:
+        """Return write counters and the current queue depth"""
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['pending'] = self._pending
+        return metrics
+
+writer = None
+
+def get_writer(table_name: str, put_item_fn):
+    """Return the process-wide conversation writer, creating it on first use"""
+    global writer
+    if writer is None:
+        writer = ConversationWriter(table_name, put_item_fn)
+    return writer
+
+def flush_writes(timeout: float = DYNAMO_FLUSH_TIMEOUT) -> bool:
+    """Flush pending conversation writes, if a writer exists"""
+    if writer is None:
+        return True
+    if writer.flush(timeout):
+        return True
+    writer._count('flush_timeouts')
+    return False
+
+def get_write_metrics() -> dict:
+    """Return writer metrics for monitoring"""
+    metrics = writer.get_metrics() if writer else {'queue_depth': 0, 'pending': 0}
+    metrics['mode'] = DYNAMO_WRITE_MODE
+    return metrics
+
+def _flush_on_shutdown(*_):
+    if not flush_writes(DYNAMO_FLUSH_TIMEOUT):
+        writer.abandon()
+
+def _register_shutdown_extension():
+    """
+    Register an internal Lambda extension that subscribes to no events
+
+    Lambda only sends SIGTERM to the runtime before shutting a container down when an extension
+    is registered; without one, a reclaimed container is never told and its queue is lost.
+    """
+    runtime_api = os.environ.get('AWS_LAMBDA_RUNTIME_API')
+    if not runtime_api or not LAMBDA_SHUTDOWN_EXTENSION:
+        return
+    try:
+        request = urllib.request.Request(
+            f"http://{runtime_api}/2020-01-01/extension/register",
+            data=json.dumps({'events': []}).encode('utf-8'),
+            headers={'Lambda-Extension-Name': 'dental-chatbot-shutdown'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=2) as response:
+            extension_id = response.headers['Lambda-Extension-Identifier']
+    except Exception as e:
+        logger.warning(f"Could not register the shutdown extension, SIGTERM will not be delivered: {str(e)}")
+        return
+
+    def wait_for_events():
+        # The first call marks the extension's init as done; with no events it then never returns
+        urllib.request.urlopen(urllib.request.Request(
+            f"http://{runtime_api}/2020-01-01/extension/event/next",
+            headers={'Lambda-Extension-Identifier': extension_id}
+        )).read()
+
+    threading.Thread(target=wait_for_events, name='shutdown-extension', daemon=True).start()
+
+def _install_shutdown_hooks():
+    """Flush on interpreter exit and on SIGTERM, which Lambda sends before shutdown once the extension is registered"""
+    atexit.register(_flush_on_shutdown)
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        _flush_on_shutdown()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            raise SystemExit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        return
+    _register_shutdown_extension()
+
+_install_shutdown_hooks()
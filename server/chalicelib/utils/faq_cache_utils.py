@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.lex_utils import resolve_bot_config
+from chalicelib.utils.tracing_utils import traced
+
+logger = logging.getLogger(__name__)
+
+# FAQ cache configuration from Chalice config
+FAQ_CACHE_INTENTS = {name.strip() for name in os.environ.get('FAQ_CACHE_INTENTS', '').split(',') if name.strip()}
+FAQ_CACHE_TTL = float(os.environ.get('FAQ_CACHE_TTL', '3600'))
+FAQ_CACHE_MAX_ENTRIES = int(os.environ.get('FAQ_CACHE_MAX_ENTRIES', '1000'))
+FAQ_CACHE_ALIAS_CHECK_SECONDS = float(os.environ.get('FAQ_CACHE_ALIAS_CHECK_SECONDS', '300'))
+
+# Dialog actions after which the reply does not depend on the session's dialog state
+CACHEABLE_DIALOG_ACTIONS = ('Close', 'ElicitIntent')
+
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_utterance(utterance: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', utterance.lower())).strip()
+
+def _has_filled_slots(slots) -> bool:
+    return any(slot for slot in (slots or {}).values())
+
+def is_cacheable(lex_response: dict, intents=None) -> bool:
+    """
+    Decide whether a Lex reply is static and safe to replay for the same utterance
+
+    Args:
+        lex_response (dict): Response from send_message_to_lex
+        intents (set): Allowlisted intents, defaults to FAQ_CACHE_INTENTS
+
+    Returns:
+        bool: True for slot-free replies of allowlisted intents
+    """
+    allowlist = FAQ_CACHE_INTENTS if intents is None else intents
+    if "error" in lex_response or lex_response.get("intent") not in allowlist:
+        return False
+    if _has_filled_slots(lex_response.get("slots")):
+        return False
+    session_state = lex_response.get("session_state") or {}
+    dialog_action = (session_state.get('dialogAction') or {}).get('type')
+    return dialog_action in CACHEABLE_DIALOG_ACTIONS
+
+class FAQCache:
+    """Answers for static intents, keyed on normalized utterance and tied to one bot alias version"""
+
+    def __init__(self, intents=None, ttl: float = FAQ_CACHE_TTL, max_entries: int = FAQ_CACHE_MAX_ENTRIES):
+        self.intents = FAQ_CACHE_INTENTS if intents is None else intents
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_alias_check = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'learned': 0, 'invalidations': 0}
+
+    def set_generation(self, generation):
+        """Clear the cache if the bot/alias/version it was learned from has changed"""
+        with self._lock:
+            if generation != self.generation:
+                if self.generation is not None:
+                    logger.info(f"Bot alias changed ({self.generation} -> {generation}), clearing FAQ cache")
+                    self.stats['invalidations'] += 1
+                self._entries.clear()
+                self.generation = generation
+
+    def lookup(self, utterance: str):
+        """Return a cached answer dict with 'text' and 'intent', or None"""
+        key = normalize_utterance(utterance)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry['stored_at'] > self.ttl or entry['intent'] not in self.intents:
+                if entry is not None:
+                    del self._entries[key]
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return {'text': entry['text'], 'intent': entry['intent']}
+
+    def learn(self, utterance: str, lex_response: dict) -> bool:
+        """Remember a Lex reply if it is cacheable"""
+        if not is_cacheable(lex_response, self.intents):
+            return False
+        key = normalize_utterance(utterance)
+        with self._lock:
+            self._entries[key] = {
+                'text': lex_response['text'],
+                'intent': lex_response['intent'],
+                'stored_at': time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['learned'] += 1
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats['invalidations'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['generation'] = list(self.generation) if self.generation else None
+        return stats
+
+faq_cache = FAQCache()
+
+def _current_generation():
+    """
+    Identify the bot alias answers were learned from, including the version it points at
+
+    Returns None when the version cannot be read, so the cache keeps its previous generation
+    instead of being cleared for an unknown one.
+    """
+    config = resolve_bot_config()
+    if not config:
+        return None
+    version = None
+    if FAQ_CACHE_ALIAS_CHECK_SECONDS > 0:
+        try:
+            region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION',
+                      os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+            alias = get_client('lexv2-models', region_name=region).describe_bot_alias(
+                botId=config['bot_id'],
+                botAliasId=config['bot_alias_id']
+            )
+            version = alias.get('botVersion')
+        except Exception as e:
+            logger.warning(f"Could not check Lex bot alias version, keeping the current FAQ cache: {str(e)}")
+            return None
+    return (config['bot_id'], config['bot_alias_id'], config['locale_id'], version)
+
+_refresh_lock = threading.Lock()
+_refreshing = False
+
+def _refresh_generation():
+    global _refreshing
+    try:
+        generation = _current_generation()
+        if generation is not None:
+            faq_cache.set_generation(generation)
+    finally:
+        with _refresh_lock:
+            _refreshing = False
+
+def _check_generation():
+    """
+    Start a background refresh of the bot alias version when one is due
+
+    describe_bot_alias is never called on the request path (or the ASGI event loop): until the
+    first refresh finishes nothing is learned, and afterwards answers are served from the
+    current generation while the next one is checked.
+    """
+    global _refreshing
+    now = time.monotonic()
+    if faq_cache.generation is not None and (FAQ_CACHE_ALIAS_CHECK_SECONDS <= 0 or now - faq_cache._last_alias_check < FAQ_CACHE_ALIAS_CHECK_SECONDS):
+        return
+    with _refresh_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+        faq_cache._last_alias_check = now
+    threading.Thread(target=_refresh_generation, name='faq-alias-check', daemon=True).start()
+
+@traced('faq_cache')
+def lookup_faq_answer(message: str):
+    """
+    Answer a static question from the cache without calling Lex
+
+    Args:
+        message (str): User message
+
+    Returns:
+        dict: 'text' and 'intent' of the cached reply, or None
+    """
+    if not faq_cache.intents:
+        return None
+    _check_generation()
+    return faq_cache.lookup(message)
+
+def learn_faq_answer(message: str, lex_response: dict) -> bool:
+    """Cache a Lex reply for later identical questions if it is static"""
+    if not faq_cache.intents or faq_cache.generation is None:
+        return False
+    return faq_cache.learn(message, lex_response)
+
+def get_faq_cache_stats():
+    return faq_cache.get_stats()
@@ -0,0 +1,81 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Session history cache configuration from Chalice config
+HISTORY_CACHE_SESSIONS = int(os.environ.get('HISTORY_CACHE_SESSIONS', '500'))
+HISTORY_CACHE_MAX_ITEMS = int(os.environ.get('HISTORY_CACHE_MAX_ITEMS', '200'))
+HISTORY_CACHE_TTL = float(os.environ.get('HISTORY_CACHE_TTL', '30'))
+
+class SessionHistoryCache:
+    """
+    Per-session, write-through cache of complete conversation histories
+
+    A session is only cached once its full history has been loaded, so every read can be
+    answered from memory. store_conversation appends new turns to cached sessions; the TTL
+    bounds staleness from turns written by other containers.
+    """
+
+    def __init__(self, max_sessions: int = HISTORY_CACHE_SESSIONS, max_items: int = HISTORY_CACHE_MAX_ITEMS,
+                 ttl: float = HISTORY_CACHE_TTL):
+        self.max_sessions = max_sessions
+        self.max_items = max_items
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'appends': 0}
+
+    def get(self, session_id: str):
+        """Return the session's items in ascending timestamp order, or None on a miss"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or time.monotonic() - entry['loaded_at'] > self.ttl:
+                if entry is not None:
+                    del self._sessions[session_id]
+                self.stats['misses'] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.stats['hits'] += 1
+            return list(entry['items'])
+
+    def put(self, session_id: str, items: list):
+        """Cache a session's complete history (ignored if it exceeds max_items)"""
+        if len(items) > self.max_items:
+            return
+        with self._lock:
+            self._sessions[session_id] = {
+                'items': sorted(items, key=lambda item: item['timestamp']),
+                'loaded_at': time.monotonic()
+            }
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def append(self, item: dict):
+        """Write-through: add a new turn to its session if that session is cached"""
+        with self._lock:
+            entry = self._sessions.get(item['session_id'])
+            if entry is None:
+                return
+            if len(entry['items']) >= self.max_items:
+                del self._sessions[item['session_id']]
+                return
+            entry['items'].append(item)
+            self.stats['appends'] += 1
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['sessions'] = len(self._sessions)
+        return stats
+
+# Module-level so cached sessions survive across warm Lambda invocations
+history_cache = SessionHistoryCache()
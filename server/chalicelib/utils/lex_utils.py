@@ -1,11 +1,219 @@
-import boto3
 import logging
 import os
-import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.tracing_utils import traced
+from chalicelib.utils.resilience_utils import call_with_resilience, ServiceUnavailable
 
 logger = logging.getLogger(__name__)
 lex_client = None
+lex_gateway = None
+
+# Upstream concurrency limit and backend selection from Chalice config
+LEX_MAX_CONCURRENCY = int(os.environ.get('LEX_MAX_CONCURRENCY', '10'))
+LEX_BACKEND = os.environ.get('LEX_BACKEND', 'aws')
+# Sessions whose last dialog action is remembered, for deciding whether a turn may skip Lex
+LEX_TRACKED_SESSIONS = int(os.environ.get('LEX_TRACKED_SESSIONS', '10000'))
+# Reply served while Lex is failing or too slow for the request's deadline
+LEX_FALLBACK_MESSAGE = os.environ.get(
+    'LEX_FALLBACK_MESSAGE',
+    "Sorry, I'm having trouble right now. Please try again in a moment, or call the clinic to book or change an appointment."
+)
+
+bot_config = None
+# Session ID -> dialogAction type of the last Lex reply, oldest first
+dialog_actions = OrderedDict()
+_dialog_lock = threading.Lock()
+
+def resolve_bot_config():
+    """
+    Read the Lex bot configuration from the environment once per process
+    
+    Returns:
+        dict: bot_id, bot_alias_id and locale_id, or None if the bot is not configured
+    """
+    global bot_config
+    if bot_config is None:
+        bot_id = os.environ.get('LEX_BOT_ID')
+        bot_alias_id = os.environ.get('LEX_BOT_ALIAS_ID')
+        if not bot_id or not bot_alias_id:
+            return None
+        bot_config = {
+            'bot_id': bot_id,
+            'bot_alias_id': bot_alias_id,
+            'locale_id': os.environ.get('LEX_BOT_LOCALE_ID', 'en_CA')
+        }
+    return bot_config
+
+def remember_dialog_action(session_id: str, session_state: dict):
+    """Record the dialogAction type of a session's latest Lex reply"""
+    action = ((session_state or {}).get('dialogAction') or {}).get('type')
+    if not action:
+        return
+    with _dialog_lock:
+        dialog_actions[session_id] = action
+        dialog_actions.move_to_end(session_id)
+        while len(dialog_actions) > LEX_TRACKED_SESSIONS:
+            dialog_actions.popitem(last=False)
+
+def forget_dialog_action(session_id: str):
+    """Drop a session's remembered dialog action once it can no longer be trusted"""
+    with _dialog_lock:
+        dialog_actions.pop(session_id, None)
+
+def last_dialog_action(session_id: str):
+    """
+    Return the dialogAction type of the session's last Lex reply
+
+    Returns:
+        str: e.g. 'ElicitSlot', 'Close' or 'ElicitIntent', or None if this process has not seen one
+    """
+    with _dialog_lock:
+        return dialog_actions.get(session_id)
+
+class SessionSequencer:
+    """Ticket lock that admits callers for the same session strictly in arrival order"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sessions = {}
+
+    def acquire(self, session_id: str):
+        with self._condition:
+            state = self._sessions.setdefault(session_id, {'next': 0, 'serving': 0})
+            ticket = state['next']
+            state['next'] += 1
+            while state['serving'] != ticket:
+                self._condition.wait()
+
+    def release(self, session_id: str):
+        with self._condition:
+            state = self._sessions[session_id]
+            state['serving'] += 1
+            if state['serving'] == state['next']:
+                del self._sessions[session_id]
+            self._condition.notify_all()
+
+class LexGateway:
+    """
+    Front door for recognize_text calls
+    
+    Identical (session, text) requests that arrive while one is in flight share its
+    upstream call, calls for one session reach Lex in arrival order, and the number
+    of concurrent upstream calls is bounded.
+    """
+
+    def __init__(self, backend, config: dict, max_concurrency: int = LEX_MAX_CONCURRENCY):
+        self.backend = backend
+        self.config = config
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._sequencer = SessionSequencer()
+        self._upstream = threading.BoundedSemaphore(max_concurrency)
+        self.stats = {'requests': 0, 'upstream_calls': 0, 'coalesced': 0}
+
+    def recognize_text(self, session_id: str, text: str):
+        """
+        Send text to Lex, sharing the upstream call with identical in-flight requests
+        
+        Args:
+            session_id (str): Lex session ID
+            text (str): User message
+            
+        Returns:
+            dict: Raw recognize_text response
+        """
+        key = (session_id, text.strip())
+        with self._lock:
+            self.stats['requests'] += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.stats['coalesced'] += 1
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            self._sequencer.acquire(session_id)
+            try:
+                with self._upstream:
+                    with self._lock:
+                        self.stats['upstream_calls'] += 1
+                    response = self.backend.recognize_text(
+                        botId=self.config['bot_id'],
+                        botAliasId=self.config['bot_alias_id'],
+                        localeId=self.config['locale_id'],
+                        sessionId=session_id,
+                        text=text
+                    )
+            finally:
+                self._sequencer.release(session_id)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+class FakeLexBackend:
+    """Local stand-in for lexv2-runtime with configurable latency, for load tests"""
+
+    def __init__(self, latency: float = 0.15, jitter: float = 0.05, intent: str = 'FallbackIntent'):
+        self.latency = latency
+        self.jitter = jitter
+        self.intent = intent
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def recognize_text(self, botId, botAliasId, localeId, sessionId, text, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            return {
+                'messages': [{'contentType': 'PlainText', 'content': f"You said: {text}"}],
+                'sessionState': {
+                    'dialogAction': {'type': 'ElicitIntent'},
+                    'intent': {'name': self.intent, 'slots': {}, 'state': 'InProgress'}
+                },
+                'interpretations': [{'intent': {'name': self.intent, 'slots': {}}}],
+                'sessionId': sessionId
+            }
+        finally:
+            with self._lock:
+                self.active -= 1
+
+def get_lex_gateway():
+    """Return the process-wide Lex gateway, or None if Lex is not configured"""
+    global lex_gateway
+    if lex_gateway is None:
+        config = resolve_bot_config()
+        if not config:
+            return None
+        backend = FakeLexBackend() if LEX_BACKEND == 'fake' else lex_client
+        if backend is None:
+            return None
+        lex_gateway = LexGateway(backend, config)
+    return lex_gateway
 
 def init_lex_client():
     """Initialize Amazon Lex client using Chalice environment variables"""
@@ -17,23 +225,22 @@ def init_lex_client():
                   os.environ.get('DEFAULT_REGION', 'ca-central-1'))
         
         # Get Lex configuration from environment (Chalice config)
-        bot_id = os.environ.get('LEX_BOT_ID')
-        bot_alias_id = os.environ.get('LEX_BOT_ALIAS_ID')
-        locale_id = os.environ.get('LEX_BOT_LOCALE_ID', 'en_US')
+        config = resolve_bot_config()
         
-        if not bot_id or not bot_alias_id:
+        if not config:
             logger.error("Missing LEX_BOT_ID or LEX_BOT_ALIAS_ID in environment variables")
             return False
             
         # Create Lex client using explicit region
-        lex_client = boto3.client('lexv2-runtime', region_name=region)
+        lex_client = get_client('lexv2-runtime', region_name=region)
         
-        logger.info(f"Lex client initialized for bot: {bot_id} in region {region}")
+        logger.info(f"Lex client initialized for bot: {config['bot_id']} in region {region}")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize Lex client: {str(e)}")
         return False
 
+@traced('lex')
 def send_message_to_lex(session_id: str, message: str):
     """
     Send a message to Amazon Lex and get the response
@@ -54,11 +261,9 @@ def send_message_to_lex(session_id: str, message: str):
             }
     
     try:
-        bot_id = os.environ.get('LEX_BOT_ID')
-        bot_alias_id = os.environ.get('LEX_BOT_ALIAS_ID')
-        locale_id = os.environ.get('LEX_BOT_LOCALE_ID', 'en_CA')
+        gateway = get_lex_gateway()
         
-        if not bot_id or not bot_alias_id:
+        if not gateway:
             logger.error("Missing LEX_BOT_ID or LEX_BOT_ALIAS_ID in environment variables")
             return {
                 "text": "Sorry, the chatbot service is not properly configured.",
@@ -66,13 +271,9 @@ def send_message_to_lex(session_id: str, message: str):
                 "error": "Missing Lex bot configuration"
             }
         
-        response = lex_client.recognize_text(
-            botId=bot_id,
-            botAliasId=bot_alias_id,
-            localeId=locale_id,
-            sessionId=session_id,
-            text=message
-        )
+        # Not hedged or abandoned: a second or orphaned recognize_text would advance the dialog (see SERVICE_SETTINGS)
+        response = call_with_resilience('lex', gateway.recognize_text, session_id, message, hedge=False)
+        remember_dialog_action(session_id, response.get('sessionState'))
         
         # Process the response
         messages = response.get('messages', [])
@@ -80,10 +281,24 @@ def send_message_to_lex(session_id: str, message: str):
         
         return {
             "text": combined_message,
+            "messages": [msg.get('content', '') for msg in messages if msg.get('content')],
             "session_state": response.get('sessionState'),
             "intent": response.get('interpretations', [{}])[0].get('intent', {}).get('name') if response.get('interpretations') else None,
             "slots": response.get('interpretations', [{}])[0].get('intent', {}).get('slots') if response.get('interpretations') else None
         }
+    except ServiceUnavailable as e:
+        logger.warning(f"Serving fallback reply, Lex unavailable: {str(e)}")
+        # A timed-out call may still have advanced the dialog, so where the session stands is unknown
+        forget_dialog_action(session_id)
+        return {
+            "text": LEX_FALLBACK_MESSAGE,
+            "messages": [LEX_FALLBACK_MESSAGE],
+            "session_state": None,
+            "intent": None,
+            "slots": None,
+            "intent_source": 'fallback',
+            "degraded": True
+        }
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', '')
         error_message = e.response.get('Error', {}).get('Message', str(e))
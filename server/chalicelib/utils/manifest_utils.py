@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from botocore.exceptions import ClientError
+from chalicelib.utils.archive_utils import read_record
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.s3_utils import CONVERSATION_BUCKET, store_conversation_in_s3
+from chalicelib.utils.tracing_utils import traced
+
+logger = logging.getLogger(__name__)
+
+# Save manifest configuration from Chalice config
+MANIFEST_PREFIX = os.environ.get('MANIFEST_PREFIX', 'manifests/')
+MANIFEST_CACHE_SESSIONS = int(os.environ.get('MANIFEST_CACHE_SESSIONS', '500'))
+IDEMPOTENCY_KEYS_KEPT = int(os.environ.get('IDEMPOTENCY_KEYS_KEPT', '20'))
+
+# Client-side fields that change without the message itself changing
+VOLATILE_FIELDS = ('status', 'audio')
+
+def message_hash(previous_hash: str, message: dict) -> str:
+    """
+    Chain a message onto the hash of everything before it
+
+    Args:
+        previous_hash (str): Hash of the preceding message ('' for the first)
+        message (dict): Message as sent by the client
+
+    Returns:
+        str: Hex digest identifying this message at this position
+    """
+    stable = {key: value for key, value in message.items() if key not in VOLATILE_FIELDS}
+    canonical = json.dumps(stable, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{previous_hash}\n{canonical}".encode('utf-8')).hexdigest()
+
+def hash_chain(messages: list) -> list:
+    """Return the chained hash of every message, in order"""
+    hashes = []
+    previous = ''
+    for message in messages:
+        previous = message_hash(previous, message)
+        hashes.append(previous)
+    return hashes
+
+def plan_delta(head: str, count: int, hashes: list) -> int:
+    """
+    Find where the client's conversation departs from what is stored
+
+    The hashes are chained, so the client's message at the stored count matching the stored
+    head means every message before it matches too.
+
+    Args:
+        head (str): Hash of the last stored message (None before the first save)
+        count (int): Number of messages stored
+        hashes (list): Chain of the messages being saved
+
+    Returns:
+        int: Sequence number of the first message that is not stored yet; 0 if the client's
+        conversation no longer extends what is stored
+    """
+    if count and count <= len(hashes) and hashes[count - 1] == head:
+        return count
+    return 0
+
+class ManifestStore:
+    """Per-session manifests in S3, with a small in-process cache revalidated by ETag"""
+
+    def __init__(self, bucket: str = CONVERSATION_BUCKET, prefix: str = MANIFEST_PREFIX,
+                 max_sessions: int = MANIFEST_CACHE_SESSIONS):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_sessions = max_sessions
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}.json"
+
+    def _client(self):
+        return get_client('s3', region_name=os.environ.get('AWS_REGION', 'ca-central-1'))
+
+    @traced('s3.manifest')
+    def load(self, session_id: str) -> dict:
+        """Return the session's manifest, or an empty one if nothing has been saved yet"""
+        with self._lock:
+            cached = self._cache.get(session_id)
+        params = {'Bucket': self.bucket, 'Key': self.key_for(session_id)}
+        if cached and cached.get('etag'):
+            params['IfNoneMatch'] = cached['etag']
+        try:
+            response = self._client().get_object(**params)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code in ('304', 'NotModified'):
+                return cached['manifest']
+            if error_code in ('404', 'NoSuchKey'):
+                return {'session_id': session_id, 'head': None, 'count': 0, 'records': [], 'idempotency': {}}
+            raise
+        manifest = json.loads(response['Body'].read())
+        self._remember(session_id, manifest, response.get('ETag'))
+        return manifest
+
+    @traced('s3.manifest')
+    def save(self, session_id: str, manifest: dict):
+        """Write the manifest and keep it cached"""
+        response = self._client().put_object(
+            Body=json.dumps(manifest, separators=(',', ':')),
+            Bucket=self.bucket,
+            Key=self.key_for(session_id),
+            ContentType='application/json'
+        )
+        self._remember(session_id, manifest, response.get('ETag'))
+
+    def _remember(self, session_id: str, manifest: dict, etag: str):
+        with self._lock:
+            self._cache[session_id] = {'manifest': manifest, 'etag': etag}
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+
+manifest_store = ManifestStore()
+# Saves for one session are applied one at a time within a container. The locks are shared by
+# hash rather than kept per session, so none is ever dropped while held; they are reentrant
+# because in single archive mode a save's write callback runs while the save holds the lock.
+SESSION_LOCK_STRIPES = 64
+_session_locks = [threading.RLock() for _ in range(SESSION_LOCK_STRIPES)]
+# Session ID -> saves buffered in the archive that its manifest does not reflect yet
+_pending = {}
+
+def _session_lock(session_id: str):
+    return _session_locks[zlib.crc32(session_id.encode('utf-8')) % SESSION_LOCK_STRIPES]
+
+def _remember_keys(manifest: dict, results: dict):
+    idempotency = manifest.setdefault('idempotency', {})
+    idempotency.update(results)
+    while len(idempotency) > IDEMPOTENCY_KEYS_KEPT:
+        idempotency.pop(next(iter(idempotency)))
+
+def _record_written(session_id: str, pending: dict, record: dict, location: dict):
+    """
+    Bring the manifest up to date once the archive has written (or failed to write) a saved record
+
+    A session's records written while later ones are still buffered wait for them, so the
+    manifest is written once for all of them. Records are applied in order, and only if they
+    continue what the manifest holds, so it never claims messages that are not in S3. Every
+    written record's location is kept, for find_session_records.
+    """
+    with _session_lock(session_id):
+        pending['outstanding'] -= 1
+        if location is None:
+            # Nothing buffered is recorded: the next save plans from the manifest and sends them again
+            pending['failed'] = True
+            logger.error(f"Saved messages for session {session_id} were not archived")
+        else:
+            pending['written'].append(dict(record, location=location))
+        current = _pending.get(session_id) is pending
+        if current and location is not None and pending['outstanding'] > 0:
+            return
+        if current:
+            del _pending[session_id]
+        written, pending['written'] = pending['written'], []
+        keys = pending['idempotency'] if not pending['outstanding'] and not pending.get('failed') else {}
+        if not written and not keys:
+            return
+        try:
+            manifest = manifest_store.load(session_id)
+            for record in written:
+                if record['seq_start'] == 0:
+                    # A record from seq 0 supersedes everything stored before it
+                    manifest['records'] = []
+                if record['seq_start'] <= manifest.get('count', 0):
+                    manifest['head'], manifest['count'] = record['head'], record['count']
+                # Where each record is, so a session is read back without listing the archive
+                manifest.setdefault('records', []).append(
+                    dict(record['location'], seq_start=record['seq_start'], count=record['count'])
+                )
+            _remember_keys(manifest, keys)
+            manifest['updated_at'] = datetime.utcnow().isoformat()
+            manifest_store.save(session_id, manifest)
+        except Exception as e:
+            # The messages are stored; the next save re-sends them and readers dedupe on seq/hash
+            logger.error(f"Error writing save manifest for session {session_id}: {str(e)}")
+
+def save_conversation_delta(session_id: str, messages: list, idempotency_key: str = None):
+    """
+    Store only the messages of a conversation that have not been stored before
+
+    New messages are buffered in the archive, and the manifest records them once the object
+    holding them is written (see _record_written), so a save costs the manifest GET and no
+    writes of its own. Saves buffered in this container count as stored when planning the next.
+
+    Args:
+        session_id (str): Session ID
+        messages (list): The client's full message list
+        idempotency_key (str): Client-supplied key; a repeated key returns the first result
+
+    Returns:
+        dict: 'stored' (new messages accepted), 'total', 'head' hash, 'duplicate' and 'pending'
+        (not yet in S3), or 'error'
+    """
+    with _session_lock(session_id):
+        try:
+            manifest = manifest_store.load(session_id)
+        except Exception as e:
+            logger.error(f"Error loading save manifest for session {session_id}: {str(e)}")
+            return {"error": f"Failed to load save manifest: {str(e)}"}
+
+        pending = _pending.get(session_id)
+        if idempotency_key:
+            buffered = pending is not None and idempotency_key in pending['idempotency']
+            previous = pending['idempotency'][idempotency_key] if buffered else manifest.get('idempotency', {}).get(idempotency_key)
+            if previous:
+                logger.info(f"Repeated save for session {session_id} (Idempotency-Key {idempotency_key})")
+                return dict(previous, duplicate=True, pending=buffered)
+
+        head, count = (pending['head'], pending['count']) if pending else (manifest.get('head'), manifest.get('count', 0))
+        hashes = hash_chain(messages)
+        start = plan_delta(head, count, hashes)
+        result = {'stored': len(messages) - start, 'total': len(messages), 'head': hashes[-1] if hashes else None}
+
+        if start == len(messages):
+            # Everything is already stored or buffered; only a new key needs recording
+            if pending and idempotency_key:
+                pending['idempotency'][idempotency_key] = result
+            elif idempotency_key:
+                _remember_keys(manifest, {idempotency_key: result})
+                manifest['updated_at'] = datetime.utcnow().isoformat()
+                try:
+                    manifest_store.save(session_id, manifest)
+                except Exception as e:
+                    logger.error(f"Error writing save manifest for session {session_id}: {str(e)}")
+            return dict(result, duplicate=False, pending=pending is not None)
+
+        if start < count:
+            # The client's history differs from what was stored: the new records supersede from this seq
+            logger.warning(f"Conversation for session {session_id} no longer extends the stored one, storing it from the start")
+        conversation_data = {
+            'session_id': session_id,
+            'timestamp': datetime.utcnow().isoformat(),
+            'seq_start': start,
+            'messages': [
+                dict(message, seq=start + offset, hash=hashes[start + offset])
+                for offset, message in enumerate(messages[start:])
+            ]
+        }
+        if pending is None:
+            pending = _pending[session_id] = {'outstanding': 0, 'written': [], 'idempotency': {}}
+        pending.update(head=hashes[-1], count=len(messages))
+        pending['outstanding'] += 1
+        if idempotency_key:
+            pending['idempotency'][idempotency_key] = result
+        record = {'seq_start': start, 'count': len(messages), 'head': hashes[-1]}
+
+        def on_written(location):
+            _record_written(session_id, pending, record, location)
+
+        # Deterministic key for single-object mode, so a retried save overwrites instead of duplicating
+        key_suffix = f"{start:05d}-{len(messages) - 1:05d}-{hashes[-1][:12]}"
+        if not store_conversation_in_s3(session_id, conversation_data, key_suffix=key_suffix, on_written=on_written):
+            pending['outstanding'] -= 1
+            if _pending.get(session_id) is pending:
+                del _pending[session_id]
+            return {"error": "Failed to store conversation"}
+        return dict(result, duplicate=False, pending=_pending.get(session_id) is pending)
+
+def find_session_records(session_id: str, partition: str = None):
+    """
+    Read a session's saved conversations using the record locations in its manifest
+
+    The lookup is a single manifest GET, followed by one ranged GET per record; the archive
+    is never listed and no index sidecars are read.
+
+    Args:
+        session_id (str): Session ID
+        partition (str): Only records archived in this partition, such as 'dt=2024-05-01/hr=13',
+            or 'dt=2024-05-01' for a whole day; every record when None
+
+    Returns:
+        list: Conversation dicts in the order they were saved
+    """
+    manifest = manifest_store.load(session_id)
+    return [
+        read_record(location) for location in manifest.get('records', [])
+        if partition is None or location.get('partition', '').startswith(partition)
+    ]
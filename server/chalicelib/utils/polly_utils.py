@@ -1,12 +1,30 @@
-import boto3
 import logging
 import os
+import re
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.audio_cache_utils import make_cache_key, get_cached_audio, put_cached_audio, get_cached_audio_url
+from chalicelib.utils.tracing_utils import trace_stage, submit_with_context
+from chalicelib.utils.resilience_utils import call_with_resilience
 
 logger = logging.getLogger(__name__)
 polly_client = None
 
+# Polly engine from Chalice config ('standard' or 'neural')
+POLLY_ENGINE = os.environ.get('POLLY_ENGINE', 'standard')
+AUDIO_CACHE_ENABLED = os.environ.get('AUDIO_CACHE_ENABLED', 'true').lower() == 'true'
+AUDIO_CHUNK_BYTES = int(os.environ.get('AUDIO_CHUNK_BYTES', '16384'))
+SYNTHESIS_WORKERS = int(os.environ.get('SYNTHESIS_WORKERS', '4'))
+
+# Sentence boundary: terminal punctuation followed by whitespace
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+synthesis_executor = None
+_executor_lock = threading.Lock()
+
 def init_polly_client():
     """Initialize Amazon Polly client"""
     global polly_client
@@ -16,7 +34,7 @@ def init_polly_client():
                   os.environ.get('DEFAULT_REGION', 'ca-central-1'))
         
         # Create Polly client using explicit region
-        polly_client = boto3.client('polly', region_name=region)
+        polly_client = get_client('polly', region_name=region)
         
         logger.info(f"Polly client initialized in region {region}")
         return True
@@ -24,6 +42,303 @@ def init_polly_client():
         logger.error(f"Failed to initialize Polly client: {str(e)}")
         return False
 
+def _synthesize_bytes(text: str, voice_id: str, output_format: str, engine: str):
+    """One synthesize_speech call, read to the end so a hedged duplicate races the whole clip"""
+    response = polly_client.synthesize_speech(
+        Text=text,
+        OutputFormat=output_format,
+        VoiceId=voice_id,
+        Engine=engine
+    )
+    if "AudioStream" not in response:
+        return None
+    return response["AudioStream"].read()
+
+def synthesize_audio(text: str, voice_id: str = 'Joanna', output_format: str = 'mp3', engine: str = None):
+    """
+    Synthesize text to raw audio bytes, serving repeated prompts from the audio cache
+
+    Args:
+        text (str): Text to convert to speech
+        voice_id (str): Voice ID to use
+        output_format (str): Polly output format
+        engine (str): Polly engine, defaults to POLLY_ENGINE
+
+    Returns:
+        tuple: (audio bytes, cache hit flag)
+    """
+    engine = engine or POLLY_ENGINE
+    cache_key = None
+
+    if AUDIO_CACHE_ENABLED:
+        cache_key = make_cache_key(text, voice_id, output_format, engine)
+        audio_data = get_cached_audio(cache_key, output_format)
+        if audio_data is not None:
+            return audio_data, True
+
+    with trace_stage('polly'):
+        audio_data = call_with_resilience('polly', _synthesize_bytes, text, voice_id, output_format, engine)
+    if audio_data is None:
+        return None, False
+    if cache_key:
+        put_cached_audio(cache_key, audio_data, output_format)
+    return audio_data, False
+
+def warm_audio_cache(text: str, voice_id: str = 'Joanna', output_format: str = 'mp3', engine: str = None,
+                     reserve=None):
+    """
+    Synthesize a clip into the audio cache ahead of a request for it
+
+    The call is not hedged: nobody is waiting on it, and a hedge would pay for the clip twice.
+
+    Args:
+        text (str): Text to convert to speech
+        voice_id (str): Voice ID to use
+        output_format (str): Polly output format
+        engine (str): Polly engine, defaults to POLLY_ENGINE
+        reserve (callable): Called with the character count before synthesizing; returning False skips it
+
+    Returns:
+        str: 'cached', 'synthesized' or 'skipped'
+    """
+    if not polly_client:
+        if not init_polly_client():
+            return 'skipped'
+    engine = engine or POLLY_ENGINE
+    cache_key = make_cache_key(text, voice_id, output_format, engine)
+    if get_cached_audio(cache_key, output_format) is not None:
+        return 'cached'
+    if reserve is not None and not reserve(len(text)):
+        return 'skipped'
+    audio_data = call_with_resilience('polly', _synthesize_bytes, text, voice_id, output_format, engine, hedge=False)
+    if audio_data is None:
+        return 'skipped'
+    put_cached_audio(cache_key, audio_data, output_format)
+    return 'synthesized'
+
+def stream_speech(text: str, voice_id: str = 'Joanna', output_format: str = 'mp3', engine: str = None,
+                  chunk_size: int = AUDIO_CHUNK_BYTES):
+    """
+    Yield synthesized audio chunk by chunk as Polly produces it
+    
+    For hosts that can stream a response body; cached clips are yielded as zero-copy slices.
+    
+    Args:
+        text (str): Text to convert to speech
+        voice_id (str): Voice ID to use
+        output_format (str): Polly output format
+        engine (str): Polly engine, defaults to POLLY_ENGINE
+        chunk_size (int): Bytes per chunk
+        
+    Yields:
+        bytes: Audio chunks
+    """
+    if not polly_client:
+        if not init_polly_client():
+            raise RuntimeError("Failed to initialize Polly client")
+    engine = engine or POLLY_ENGINE
+    cache_key = make_cache_key(text, voice_id, output_format, engine) if AUDIO_CACHE_ENABLED else None
+    
+    if cache_key:
+        audio_data = get_cached_audio(cache_key, output_format)
+        if audio_data is not None:
+            view = memoryview(audio_data)
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+            return
+    
+    with trace_stage('polly'):
+        # Only the request is guarded here; chunks are read as the caller consumes them
+        response = call_with_resilience(
+            'polly',
+            polly_client.synthesize_speech,
+            hedge=False,
+            Text=text,
+            OutputFormat=output_format,
+            VoiceId=voice_id,
+            Engine=engine
+        )
+    
+    # Keep a copy only when the finished clip will be cached
+    buffer = bytearray() if cache_key else None
+    for chunk in response["AudioStream"].iter_chunks(chunk_size):
+        if buffer is not None:
+            buffer.extend(chunk)
+        yield chunk
+    
+    if buffer is not None:
+        put_cached_audio(cache_key, bytes(buffer), output_format)
+
+def speech_to_audio(text: str, voice_id: str = 'Joanna'):
+    """
+    Convert text to speech as raw MP3 bytes, for binary responses
+    
+    Args:
+        text (str): Text to convert to speech
+        voice_id (str): Voice ID to use
+        
+    Returns:
+        dict: Response containing raw audio bytes (no base64)
+    """
+    if not polly_client:
+        if not init_polly_client():
+            return {
+                "error": "Failed to initialize Polly client",
+                "audio": None
+            }
+    
+    try:
+        audio_data, cached = synthesize_audio(text, voice_id)
+        if audio_data is None:
+            logger.error("No AudioStream in Polly response")
+            return {
+                "error": "No audio stream returned",
+                "audio": None
+            }
+        return {
+            "audio": audio_data,
+            "format": "mp3",
+            "voice": voice_id,
+            "cached": cached
+        }
+    except Exception as e:
+        logger.error(f"Error converting text to speech: {str(e)}")
+        return {
+            "error": str(e),
+            "audio": None
+        }
+
+def speech_to_url(text: str, voice_id: str = 'Joanna'):
+    """
+    Synthesize (or reuse) a clip in the S3 audio cache and return a presigned URL to it
+    
+    Args:
+        text (str): Text to convert to speech
+        voice_id (str): Voice ID to use
+        
+    Returns:
+        dict: Response containing the presigned URL
+    """
+    speech_response = speech_to_audio(text, voice_id)
+    if "error" in speech_response:
+        return {
+            "error": speech_response["error"],
+            "url": None
+        }
+    
+    cache_key = make_cache_key(text, voice_id, 'mp3', POLLY_ENGINE)
+    url = get_cached_audio_url(cache_key, speech_response["audio"])
+    if not url:
+        return {
+            "error": "Audio cache storage is unavailable",
+            "url": None
+        }
+    return {
+        "url": url,
+        "format": "mp3",
+        "voice": voice_id,
+        "cached": speech_response["cached"]
+    }
+
+def split_into_segments(text: str, messages=None):
+    """
+    Split a bot reply into sentence segments for pipelined synthesis
+    
+    Args:
+        text (str): Full reply text
+        messages (list): Individual Lex message contents, used as segment boundaries when given
+        
+    Returns:
+        list: Non-empty segments in reply order
+    """
+    segments = []
+    for message in (messages or [text]):
+        segments.extend(part.strip() for part in _SENTENCE_END.split(message) if part.strip())
+    return segments
+
+def get_synthesis_executor():
+    """Return the bounded thread pool used for concurrent segment synthesis"""
+    global synthesis_executor
+    if synthesis_executor is None:
+        with _executor_lock:
+            if synthesis_executor is None:
+                synthesis_executor = ThreadPoolExecutor(max_workers=SYNTHESIS_WORKERS, thread_name_prefix='polly')
+    return synthesis_executor
+
+def iter_segment_audio(segments, voice_id: str = 'Joanna'):
+    """
+    Synthesize segments concurrently and yield them in order as soon as each is ready
+    
+    Every segment goes through the audio cache on its own, so sentences shared between
+    replies are synthesized once.
+    
+    Args:
+        segments (list): Segment texts
+        voice_id (str): Voice ID to use
+        
+    Yields:
+        dict: index, text, audio bytes and cache flag for each segment, in order
+    """
+    executor = get_synthesis_executor()
+    futures = [submit_with_context(executor, synthesize_audio, segment, voice_id) for segment in segments]
+    for index, (segment, future) in enumerate(zip(segments, futures)):
+        audio_data, cached = future.result()
+        yield {
+            "index": index,
+            "text": segment,
+            "audio": audio_data,
+            "cached": cached
+        }
+
+def synthesize_segments(text: str, voice_id: str = 'Joanna', messages=None):
+    """
+    Convert a reply to an ordered list of separately synthesized segments
+    
+    Args:
+        text (str): Full reply text
+        voice_id (str): Voice ID to use
+        messages (list): Individual Lex message contents, if known
+        
+    Returns:
+        dict: Response containing base64 audio per segment
+    """
+    if not polly_client:
+        if not init_polly_client():
+            return {
+                "error": "Failed to initialize Polly client",
+                "segments": None
+            }
+    
+    try:
+        segments = []
+        for segment in iter_segment_audio(split_into_segments(text, messages), voice_id):
+            if segment["audio"] is None:
+                return {
+                    "error": f"No audio stream returned for segment {segment['index']}",
+                    "segments": None
+                }
+            segment["audio"] = base64.b64encode(segment["audio"]).decode('utf-8')
+            segments.append(segment)
+        
+        return {
+            "segments": segments,
+            "format": "mp3",
+            "voice": voice_id
+        }
+    except ClientError as e:
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"AWS Error during segmented synthesis: {error_message}")
+        return {
+            "error": error_message,
+            "segments": None
+        }
+    except Exception as e:
+        logger.error(f"Error during segmented synthesis: {str(e)}")
+        return {
+            "error": str(e),
+            "segments": None
+        }
+
 def text_to_speech(text: str, voice_id: str = 'Joanna'):
     """
     Convert text to speech using Amazon Polly
@@ -43,22 +358,18 @@ def text_to_speech(text: str, voice_id: str = 'Joanna'):
             }
     
     try:
-        response = polly_client.synthesize_speech(
-            Text=text,
-            OutputFormat='mp3',
-            VoiceId=voice_id
-        )
+        audio_data, cached = synthesize_audio(text, voice_id)
         
         # Get audio data
-        if "AudioStream" in response:
-            # Read audio data and encode as base64
-            audio_data = response["AudioStream"].read()
+        if audio_data is not None:
+            # Encode as base64
             audio_base64 = base64.b64encode(audio_data).decode('utf-8')
             
             return {
                 "audio": audio_base64,
                 "format": "mp3",
-                "voice": voice_id
+                "voice": voice_id,
+                "cached": cached
             }
         else:
             logger.error("No AudioStream in Polly response")
@@ -82,4 +393,4 @@ def text_to_speech(text: str, voice_id: str = 'Joanna'):
         return {
             "error": str(e),
             "audio": None
-        }
+        }
\ No newline at end of file
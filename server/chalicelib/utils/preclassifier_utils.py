@@ -0,0 +1,271 @@
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.faq_cache_utils import normalize_utterance
+from chalicelib.utils.tracing_utils import trace_stage
+
+logger = logging.getLogger(__name__)
+
+# Intent pre-classifier configuration from Chalice config
+# 'off', 'shadow' (classify and compare with Lex, never answer) or 'on'
+PRECLASSIFIER_MODE = os.environ.get('PRECLASSIFIER_MODE', 'off')
+# Local path or s3://bucket/key of the model written by tools/train_intents.py
+PRECLASSIFIER_MODEL = os.environ.get(
+    'PRECLASSIFIER_MODEL',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'intent_model.npz')
+)
+# Intents that may be answered without Lex; everything else always goes to Lex
+PRECLASSIFIER_INTENTS = {name.strip() for name in os.environ.get('PRECLASSIFIER_INTENTS', 'Greeting,Thanks,Goodbye').split(',') if name.strip()}
+PRECLASSIFIER_THRESHOLD = float(os.environ.get('PRECLASSIFIER_THRESHOLD', '0.9'))
+# 'intent=threshold' overrides, e.g. 'Goodbye=0.95'
+PRECLASSIFIER_INTENT_THRESHOLDS = {
+    intent.strip(): float(threshold)
+    for intent, _, threshold in (
+        part.partition('=') for part in os.environ.get('PRECLASSIFIER_INTENT_THRESHOLDS', '').split(',') if part.strip()
+    )
+}
+
+# Dialog actions after which Lex is waiting for a new intent, so small talk can be answered without it
+IDLE_DIALOG_ACTIONS = ('Close', 'ElicitIntent')
+
+# Hashed feature space; the training tool and the runtime must agree on it
+DEFAULT_DIMENSIONS = 2 ** 15
+CHAR_NGRAM = 3
+
+def extract_features(text: str):
+    """
+    Word unigrams and bigrams plus character trigrams of each word, from the normalized text
+
+    Character n-grams keep misspellings ('thanx', 'helo') close to the words they stand for.
+    """
+    words = normalize_utterance(text).split()
+    features = [f"w:{word}" for word in words]
+    features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    for word in words:
+        padded = f"<{word}>"
+        features.extend(f"c:{padded[i:i + CHAR_NGRAM]}" for i in range(max(1, len(padded) - CHAR_NGRAM + 1)))
+    return features
+
+def hash_features(text: str, dimensions: int = DEFAULT_DIMENSIONS):
+    """
+    Map an utterance to a sparse, L2-normalized hashed feature vector
+
+    crc32 is used rather than hash(), which is salted per process. The top hash bit gives each
+    feature a sign, so collisions tend to cancel rather than add up.
+
+    Returns:
+        tuple: (indices, values) lists, empty for an utterance without words
+    """
+    counts = {}
+    for feature in extract_features(text):
+        digest = zlib.crc32(feature.encode('utf-8'))
+        index = digest % dimensions
+        counts[index] = counts.get(index, 0.0) + (1.0 if digest & 0x80000000 else -1.0)
+    counts = {index: value for index, value in counts.items() if value}
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return list(counts), [value / norm for value in counts.values()]
+
+class IntentModel:
+    """Linear softmax classifier over hashed n-grams"""
+
+    def __init__(self, weights, bias, classes, replies: dict, metadata: dict):
+        self.weights = weights
+        self.bias = bias
+        self.classes = list(classes)
+        self.replies = replies
+        self.metadata = metadata
+        self.dimensions = weights.shape[0]
+
+    @classmethod
+    def load(cls, source):
+        """Load a model from a path, an s3:// URI or a file object"""
+        import numpy as np
+
+        if isinstance(source, str) and source.startswith('s3://'):
+            bucket, _, key = source[len('s3://'):].partition('/')
+            body = get_client('s3', region_name=os.environ.get('AWS_REGION', 'ca-central-1')).get_object(Bucket=bucket, Key=key)['Body']
+            source = io.BytesIO(body.read())
+        with np.load(source, allow_pickle=False) as data:
+            metadata = json.loads(str(data['metadata']))
+            return cls(
+                weights=data['weights'].astype(np.float32),
+                bias=data['bias'].astype(np.float32),
+                classes=[str(name) for name in data['classes']],
+                replies=metadata.pop('replies', {}),
+                metadata=metadata
+            )
+
+    def save(self, path: str):
+        import numpy as np
+
+        metadata = dict(self.metadata, replies=self.replies)
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                weights=self.weights.astype(np.float32),
+                bias=self.bias.astype(np.float32),
+                classes=np.array(self.classes),
+                metadata=np.array(json.dumps(metadata))
+            )
+
+    def predict(self, text: str):
+        """
+        Classify one utterance
+
+        Returns:
+            tuple: (intent, probability), or (None, 0.0) for an utterance without words
+        """
+        import numpy as np
+
+        indices, values = hash_features(text, self.dimensions)
+        if not indices:
+            return None, 0.0
+        scores = np.asarray(values, dtype=np.float32) @ self.weights[indices] + self.bias
+        scores = np.exp(scores - scores.max())
+        best = int(scores.argmax())
+        return self.classes[best], float(scores[best] / scores.sum())
+
+model = None
+_model_lock = threading.Lock()
+_model_failed = False
+_stats_lock = threading.Lock()
+stats = {
+    'classified': 0, 'answered': 0, 'mid_dialog': 0, 'classify_us': 0.0,
+    'shadow': {'compared': 0, 'agreed': 0, 'confident': 0, 'confident_correct': 0, 'intents': {}}
+}
+
+def get_model():
+    """Return the loaded model, loading it on first use; None if it cannot be loaded"""
+    global model, _model_failed
+    if model is None and not _model_failed:
+        with _model_lock:
+            if model is None and not _model_failed:
+                try:
+                    started = time.perf_counter()
+                    model = IntentModel.load(PRECLASSIFIER_MODEL)
+                    logger.info(f"Loaded intent model with {len(model.classes)} intents from {PRECLASSIFIER_MODEL} "
+                                f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+                except Exception as e:
+                    # A missing or unreadable model turns the pre-classifier off rather than failing /chat
+                    logger.error(f"Failed to load intent model from {PRECLASSIFIER_MODEL}: {str(e)}")
+                    _model_failed = True
+    return model
+
+def threshold_for(intent: str) -> float:
+    return PRECLASSIFIER_INTENT_THRESHOLDS.get(intent, PRECLASSIFIER_THRESHOLD)
+
+def is_confident(intent: str, probability: float, intent_model: IntentModel) -> bool:
+    """Whether a prediction is allowed to replace Lex: an allowlisted intent with a reply, above its threshold"""
+    return (intent in PRECLASSIFIER_INTENTS and intent in intent_model.replies
+            and probability >= threshold_for(intent))
+
+def classify(message: str):
+    """
+    Classify a message when the pre-classifier is enabled
+
+    Returns:
+        tuple: (intent, probability), or None when the mode is 'off' or no model is available
+    """
+    if PRECLASSIFIER_MODE not in ('shadow', 'on'):
+        return None
+    with trace_stage('preclassifier'):
+        intent_model = get_model()
+        if intent_model is None:
+            return None
+        started = time.perf_counter()
+        prediction = intent_model.predict(message)
+    with _stats_lock:
+        stats['classified'] += 1
+        stats['classify_us'] += (time.perf_counter() - started) * 1e6
+    return prediction
+
+def local_answer(prediction, dialog_action: str = None, new_session: bool = False):
+    """
+    Build a reply for a confident prediction, in the shape send_message_to_lex returns
+
+    Only between intents: while Lex is eliciting a slot or confirming, the message is the
+    patient's answer to it (a "thanks" can mean yes) and must reach Lex. A session whose last
+    dialog action this process has not seen goes to Lex too, unless it is new.
+
+    Args:
+        prediction (tuple): (intent, probability) from classify
+        dialog_action (str): dialogAction type of the session's last Lex reply, if known
+        new_session (bool): Whether the request starts a new session
+
+    Returns:
+        dict: Reply to serve instead of calling Lex, or None (always None in shadow mode)
+    """
+    if PRECLASSIFIER_MODE != 'on' or prediction is None:
+        return None
+    intent, probability = prediction
+    intent_model = get_model()
+    if not is_confident(intent, probability, intent_model):
+        return None
+    if not new_session and dialog_action not in IDLE_DIALOG_ACTIONS:
+        with _stats_lock:
+            stats['mid_dialog'] += 1
+        return None
+    with _stats_lock:
+        stats['answered'] += 1
+    text = intent_model.replies[intent]
+    return {
+        "text": text,
+        "messages": [text],
+        "session_state": None,
+        "intent": intent,
+        "slots": None,
+        "intent_source": 'preclassifier'
+    }
+
+def record_shadow(prediction, lex_intent: str):
+    """
+    Compare a prediction with the intent Lex returned for the same message
+
+    'confident' counts the messages that would have been answered locally in 'on' mode, and
+    'confident_correct' those among them where Lex agreed: their ratio is the precision to
+    check before switching the mode on.
+    """
+    if prediction is None or not lex_intent:
+        return
+    intent, probability = prediction
+    confident = is_confident(intent, probability, get_model())
+    correct = intent == lex_intent
+    with _stats_lock:
+        shadow = stats['shadow']
+        shadow['compared'] += 1
+        shadow['agreed'] += correct
+        if confident:
+            shadow['confident'] += 1
+            shadow['confident_correct'] += correct
+            per_intent = shadow['intents'].setdefault(intent, {'confident': 0, 'correct': 0})
+            per_intent['confident'] += 1
+            per_intent['correct'] += correct
+
+def get_preclassifier_stats() -> dict:
+    """Return mode, thresholds, local answer counts and shadow-mode accuracy"""
+    intent_model = model
+    with _stats_lock:
+        shadow = dict(stats['shadow'], intents={intent: dict(counts) for intent, counts in stats['shadow']['intents'].items()})
+        classified = stats['classified']
+        result = {
+            'mode': PRECLASSIFIER_MODE,
+            'model': dict(intent_model.metadata, intents=intent_model.classes) if intent_model else None,
+            'intents': sorted(PRECLASSIFIER_INTENTS),
+            'threshold': PRECLASSIFIER_THRESHOLD,
+            'intent_thresholds': PRECLASSIFIER_INTENT_THRESHOLDS,
+            'classified': classified,
+            'answered': stats['answered'],
+            'mid_dialog': stats['mid_dialog'],
+            'mean_classify_us': round(stats['classify_us'] / classified, 1) if classified else None
+        }
+    shadow['accuracy'] = round(shadow['agreed'] / shadow['compared'], 4) if shadow['compared'] else None
+    shadow['precision'] = round(shadow['confident_correct'] / shadow['confident'], 4) if shadow['confident'] else None
+    shadow['coverage'] = round(shadow['confident'] / shadow['compared'], 4) if shadow['compared'] else None
+    result['shadow'] = shadow
+    return result
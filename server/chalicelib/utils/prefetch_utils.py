@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from chalicelib.utils.admission_utils import MemoryBuckets
+from chalicelib.utils.audio_cache_utils import normalize_text
+from chalicelib.utils.polly_utils import AUDIO_CACHE_ENABLED, warm_audio_cache
+from chalicelib.utils.prompt_pack_utils import get_slot_prompts
+
+logger = logging.getLogger(__name__)
+
+# Prompt prefetch configuration from Chalice config
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'true').lower() == 'true'
+# Most prompts synthesized ahead per turn
+PREFETCH_MAX_PROMPTS = int(os.environ.get('PREFETCH_MAX_PROMPTS', '3'))
+# Polly characters per minute the prefetcher may spend, per container
+PREFETCH_CHAR_BUDGET = int(os.environ.get('PREFETCH_CHAR_BUDGET', '3000'))
+# A learned next reply is prefetched once it follows a dialog state at least this often
+PREFETCH_MIN_SHARE = float(os.environ.get('PREFETCH_MIN_SHARE', '0.2'))
+PREFETCH_MIN_COUNT = int(os.environ.get('PREFETCH_MIN_COUNT', '2'))
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', '2'))
+PREFETCH_MAX_SESSIONS = int(os.environ.get('PREFETCH_MAX_SESSIONS', '10000'))
+# Lambda freezes the container once the response is returned, and background prefetches with it,
+# so under Lambda the invocation waits for its prefetches before returning, for at most
+# PREFETCH_FLUSH_TIMEOUT seconds of the time it has left. Without it turns are only learned from.
+PREFETCH_ON_LAMBDA = os.environ.get('PREFETCH_ON_LAMBDA', 'true').lower() == 'true'
+PREFETCH_FLUSH_TIMEOUT = float(os.environ.get('PREFETCH_FLUSH_TIMEOUT', '0.5'))
+ON_LAMBDA = 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+PREFETCH_FLUSH_ON_RESPONSE = ON_LAMBDA and PREFETCH_ON_LAMBDA
+
+# Distinct replies remembered per dialog state; replies carrying slot values rarely repeat
+MAX_REPLIES_PER_STATE = 50
+
+prefetch_executor = None
+_executor_lock = threading.Lock()
+_budget = MemoryBuckets(max_keys=1)
+_lock = threading.Lock()
+# Dialog state -> Counter of the bot reply that followed it
+transitions = {}
+# Session ID -> (dialog state of the last reply, {predicted text: synthesized by the prefetcher})
+sessions = OrderedDict()
+# Prefetches submitted and not yet finished
+inflight = set()
+stats = {
+    'turns': 0, 'predicted_turns': 0, 'hits': 0, 'synthesized_hits': 0,
+    'scheduled': 0, 'synthesized': 0, 'already_cached': 0, 'over_budget': 0, 'errors': 0, 'characters': 0,
+    'stateless_turns': 0, 'flush_timeouts': 0
+}
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        stats[name] += amount
+
+def get_prefetch_executor():
+    """Return the thread pool prefetches run on, apart from the pools requests wait on"""
+    global prefetch_executor
+    if prefetch_executor is None:
+        with _executor_lock:
+            if prefetch_executor is None:
+                prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+    return prefetch_executor
+
+def dialog_state(session_state: dict) -> str:
+    """
+    Key a Lex session state by what the bot is waiting for
+
+    Args:
+        session_state (dict): sessionState from recognize_text
+
+    Returns:
+        str: 'dialog action type:intent:slot to elicit', e.g. 'ElicitSlot:BookAppointment:Date'
+    """
+    dialog_action = session_state.get('dialogAction') or {}
+    intent = session_state.get('intent') or {}
+    return f"{dialog_action.get('type', '')}:{intent.get('name', '')}:{dialog_action.get('slotToElicit', '')}"
+
+def predict_next_prompts(session_state: dict, limit: int = PREFETCH_MAX_PROMPTS):
+    """
+    Predict the bot's next reply from the dialog state of its current one
+
+    Replies learned to follow this state come first, most frequent first. While a slot is
+    being elicited, the elicitation prompts of the intent's other empty slots (from the prompt
+    pack's bot definition) follow, since one of them is asked for once the patient answers.
+
+    Args:
+        session_state (dict): sessionState from recognize_text
+        limit (int): Most prompts to return
+
+    Returns:
+        list: Predicted reply texts, most likely first
+    """
+    predictions = []
+    state = dialog_state(session_state)
+    with _lock:
+        followers = transitions.get(state)
+        if followers:
+            total = sum(followers.values())
+            predictions.extend(
+                text for text, count in followers.most_common(limit)
+                if count >= PREFETCH_MIN_COUNT and count >= PREFETCH_MIN_SHARE * total
+            )
+
+    dialog_action = session_state.get('dialogAction') or {}
+    intent = session_state.get('intent') or {}
+    if dialog_action.get('type') == 'ElicitSlot':
+        slots = intent.get('slots') or {}
+        for slot, prompts in get_slot_prompts().get(intent.get('name'), {}).items():
+            if slot != dialog_action.get('slotToElicit') and not slots.get(slot):
+                predictions.extend(normalize_text(prompt) for prompt in prompts if '{' not in prompt)
+
+    return list(dict.fromkeys(predictions))[:limit]
+
+def _reserve(characters: int) -> bool:
+    rate = PREFETCH_CHAR_BUDGET / 60.0
+    admitted, _ = _budget.take('prefetch', rate, PREFETCH_CHAR_BUDGET, cost=characters)
+    if not admitted:
+        _count('over_budget')
+    return admitted
+
+def _prefetch(session_id: str, text: str, voice_id: str):
+    try:
+        outcome = warm_audio_cache(text, voice_id, reserve=_reserve)
+    except Exception as e:
+        logger.warning(f"Prompt prefetch failed: {str(e)}")
+        _count('errors')
+        return
+    if outcome == 'cached':
+        _count('already_cached')
+    elif outcome == 'synthesized':
+        with _lock:
+            stats['synthesized'] += 1
+            stats['characters'] += len(text)
+            session = sessions.get(session_id)
+            if session is not None and text in session[1]:
+                session[1][text] = True
+
+def observe_turn(session_id: str, lex_response: dict, voice_id: str = 'Joanna', prefetch: bool = True):
+    """
+    Learn from a Lex reply and prefetch the audio of the prompts likely to follow it
+
+    The reply is first scored against the prompts predicted after the session's previous
+    reply (the prefetch hit rate), then recorded as a transition from that reply's dialog
+    state. Predictions for the new state are synthesized in the background, within the
+    character budget, so the clips are cached while the patient is still answering. Under
+    Lambda the container, and the prefetches with it, is frozen as soon as the response is
+    returned, so they run alongside the rest of the turn and flush_prefetches waits for them
+    before it ends; with PREFETCH_ON_LAMBDA off nothing is synthesized there.
+
+    A reply without a Lex session state (FAQ cache, pre-classifier, fallback) clears the
+    session's predictions, since they were made for the reply before it.
+
+    Args:
+        session_id (str): Lex session ID
+        lex_response (dict): Reply from send_message_to_lex
+        voice_id (str): Voice the session's replies are spoken in
+        prefetch (bool): Whether the replies are spoken; otherwise only learn from the turn
+
+    Returns:
+        list: Prompts scheduled for prefetching
+    """
+    session_state = lex_response.get("session_state")
+    if not PREFETCH_ENABLED:
+        return []
+    if not session_state:
+        with _lock:
+            if sessions.pop(session_id, None) is not None:
+                stats['stateless_turns'] += 1
+        return []
+    text = normalize_text(lex_response.get("text") or '')
+    state = dialog_state(session_state)
+
+    with _lock:
+        stats['turns'] += 1
+        previous = sessions.pop(session_id, None)
+        if previous is not None:
+            previous_state, predicted = previous
+            if predicted:
+                stats['predicted_turns'] += 1
+                if text in predicted:
+                    stats['hits'] += 1
+                    stats['synthesized_hits'] += predicted[text]
+            followers = transitions.setdefault(previous_state, Counter())
+            if text and (text in followers or len(followers) < MAX_REPLIES_PER_STATE):
+                followers[text] += 1
+
+    synthesize = prefetch and AUDIO_CACHE_ENABLED and (PREFETCH_ON_LAMBDA or not ON_LAMBDA)
+    predictions = predict_next_prompts(session_state) if synthesize else []
+    with _lock:
+        sessions[session_id] = (state, dict.fromkeys(predictions, False))
+        while len(sessions) > PREFETCH_MAX_SESSIONS:
+            sessions.popitem(last=False)
+        stats['scheduled'] += len(predictions)
+
+    executor = get_prefetch_executor()
+    for prediction in predictions:
+        # Not submitted with the request's context: prefetches outlive it and have no deadline
+        future = executor.submit(_prefetch, session_id, prediction, voice_id)
+        with _lock:
+            inflight.add(future)
+        future.add_done_callback(_settle)
+    return predictions
+
+def _settle(future):
+    with _lock:
+        inflight.discard(future)
+
+def flush_prefetches(timeout: float = PREFETCH_FLUSH_TIMEOUT) -> bool:
+    """
+    Wait for the prefetches in flight, so they finish before Lambda freezes the container
+
+    Args:
+        timeout (float): Longest to wait, in seconds
+
+    Returns:
+        bool: True if none are left running
+    """
+    with _lock:
+        pending = list(inflight)
+    if not pending:
+        return True
+    _, not_done = wait(pending, timeout=max(0.0, timeout))
+    if not_done:
+        _count('flush_timeouts')
+    return not not_done
+
+def get_prefetch_stats() -> dict:
+    """Return the prefetch hit rate, spend and learned transition counts"""
+    with _lock:
+        result = dict(stats)
+        result['states'] = len(transitions)
+        result['sessions'] = len(sessions)
+        result['inflight'] = len(inflight)
+    result.update({
+        'enabled': PREFETCH_ENABLED,
+        'synthesizing': PREFETCH_ON_LAMBDA or not ON_LAMBDA,
+        'char_budget_per_minute': PREFETCH_CHAR_BUDGET,
+        'hit_rate': round(result['hits'] / result['predicted_turns'], 4) if result['predicted_turns'] else None,
+        'synthesized_hit_rate': round(result['synthesized_hits'] / result['synthesized'], 4) if result['synthesized'] else None
+    })
+    return result
@@ -0,0 +1,169 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Prompt pack configuration from Chalice config
+PROMPT_PACK_ENABLED = os.environ.get('PROMPT_PACK_ENABLED', 'true').lower() == 'true'
+# Written by tools/build_prompt_pack.py and deployed with the code
+PROMPT_PACK_PATH = os.environ.get(
+    'PROMPT_PACK_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prompts', 'prompt_pack.bin')
+)
+
+# File layout, little-endian:
+#   header  magic, version, entry count, index offset, metadata offset, metadata length
+#   clips   audio clips back to back
+#   index   one entry per clip, sorted by key: SHA-256 cache key, clip offset, clip length
+#   metadata UTF-8 JSON (voices, engine, format, slot prompts, ...)
+MAGIC = b'DCPROMPT'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ')
+ENTRY = struct.Struct('<32sQI4x')
+KEY_BYTES = 32
+
+def write_prompt_pack(path: str, clips: dict, metadata: dict):
+    """
+    Write a prompt pack
+
+    Args:
+        path (str): Output file; written to a temporary file first and renamed into place
+        clips (dict): Hex cache key (audio_cache_utils.make_cache_key) to audio bytes
+        metadata (dict): JSON-serializable description of the pack
+
+    Returns:
+        int: Size of the pack in bytes
+    """
+    keys = sorted(clips)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        entries = []
+        for key in keys:
+            entries.append((bytes.fromhex(key), f.tell(), len(clips[key])))
+            f.write(clips[key])
+        index_offset = f.tell()
+        for digest, offset, length in entries:
+            f.write(ENTRY.pack(digest, offset, length))
+        metadata_bytes = json.dumps(metadata, sort_keys=True).encode('utf-8')
+        metadata_offset = f.tell()
+        f.write(metadata_bytes)
+        size = f.tell()
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), index_offset, metadata_offset, len(metadata_bytes)))
+    os.replace(temporary, path)
+    return size
+
+class PromptPack:
+    """
+    Read-only, memory-mapped prompt pack
+
+    Only the pages that are touched are read from disk, and clips are returned as memoryview
+    slices of the mapping, so a hit copies nothing.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, self.count, self._index_offset, self._metadata_offset, self._metadata_length = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} prompt pack")
+        self._metadata = None
+
+    def _key_at(self, position: int) -> bytes:
+        start = self._index_offset + position * ENTRY.size
+        return self._mmap[start:start + KEY_BYTES]
+
+    def get(self, cache_key: str):
+        """
+        Look up a clip by binary search over the index
+
+        Args:
+            cache_key (str): Hex key from audio_cache_utils.make_cache_key
+
+        Returns:
+            memoryview: The clip, or None if it is not in the pack
+        """
+        digest = bytes.fromhex(cache_key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < digest:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._key_at(low) != digest:
+            return None
+        _, offset, length = ENTRY.unpack_from(self._mmap, self._index_offset + low * ENTRY.size)
+        return self._view[offset:offset + length]
+
+    def __contains__(self, cache_key: str):
+        return self.get(cache_key) is not None
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        """(hex key, clip) pairs in key order"""
+        for position in range(self.count):
+            digest, offset, length = ENTRY.unpack_from(self._mmap, self._index_offset + position * ENTRY.size)
+            yield digest.hex(), self._view[offset:offset + length]
+
+    @property
+    def metadata(self) -> dict:
+        if self._metadata is None:
+            start = self._metadata_offset
+            self._metadata = json.loads(self._mmap[start:start + self._metadata_length].decode('utf-8'))
+        return self._metadata
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+
+prompt_pack = None
+_pack_lock = threading.Lock()
+_pack_checked = False
+
+def get_prompt_pack():
+    """Return the deployed prompt pack, mapping it on first use; None if disabled or missing"""
+    global prompt_pack, _pack_checked
+    if not _pack_checked:
+        with _pack_lock:
+            if not _pack_checked:
+                if PROMPT_PACK_ENABLED and os.path.exists(PROMPT_PACK_PATH):
+                    try:
+                        prompt_pack = PromptPack(PROMPT_PACK_PATH)
+                        logger.info(f"Mapped prompt pack {PROMPT_PACK_PATH} ({len(prompt_pack)} clips)")
+                    except Exception as e:
+                        logger.error(f"Failed to open prompt pack {PROMPT_PACK_PATH}: {str(e)}")
+                _pack_checked = True
+    return prompt_pack
+
+def get_slot_prompts() -> dict:
+    """Prompts per intent and slot from the Lex bot definition the pack was built from"""
+    pack = get_prompt_pack()
+    return pack.metadata.get('slot_prompts', {}) if pack else {}
+
+def get_prompt_pack_stats() -> dict:
+    pack = get_prompt_pack()
+    if pack is None:
+        return {'enabled': PROMPT_PACK_ENABLED, 'loaded': False}
+    metadata = pack.metadata
+    return {
+        'enabled': PROMPT_PACK_ENABLED,
+        'loaded': True,
+        'clips': len(pack),
+        'bytes': len(pack._mmap),
+        'built_at': metadata.get('built_at'),
+        'voices': metadata.get('voices'),
+        'engine': metadata.get('engine'),
+        'format': metadata.get('format')
+    }
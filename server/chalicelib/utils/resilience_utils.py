@@ -0,0 +1,349 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ConnectTimeoutError, ReadTimeoutError
+from chalicelib.utils.tracing_utils import submit_with_context
+
+logger = logging.getLogger(__name__)
+
+# Resilience configuration from Chalice config
+RESILIENCE_ENABLED = os.environ.get('RESILIENCE_ENABLED', 'true').lower() == 'true'
+# Time kept free at the end of an invocation to build and return the response
+DEADLINE_MARGIN_MS = float(os.environ.get('DEADLINE_MARGIN_MS', '500'))
+# Request budget when there is no Lambda context to read the remaining time from (local, ASGI)
+DEADLINE_DEFAULT_MS = float(os.environ.get('DEADLINE_DEFAULT_MS', '10000'))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', '10'))
+BREAKER_WINDOW_SECONDS = float(os.environ.get('BREAKER_WINDOW_SECONDS', '30'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '15'))
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY_MS = float(os.environ.get('HEDGE_MIN_DELAY_MS', '50'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+# Hedges allowed per call, so a slow upstream is not sent twice the load
+HEDGE_MAX_RATIO = float(os.environ.get('HEDGE_MAX_RATIO', '0.1'))
+RESILIENCE_WORKERS = int(os.environ.get('RESILIENCE_WORKERS', '32'))
+
+# Per service: longest single call, whether a second request may be raced against a slow one, and
+# whether a call may be abandoned at the deadline. recognize_text is not idempotent: a duplicate or
+# an abandoned call still advances the dialog (and holds the session's place in LexGateway), so Lex
+# is never hedged and runs on the caller's thread, bounded by its client's read timeout instead.
+SERVICE_SETTINGS = {
+    'lex': {
+        'timeout_ms': float(os.environ.get('LEX_CALL_TIMEOUT_MS', '3000')),
+        'hedge': False,
+        'idempotent': False
+    },
+    'polly': {
+        'timeout_ms': float(os.environ.get('POLLY_CALL_TIMEOUT_MS', '4000')),
+        'hedge': os.environ.get('POLLY_HEDGE', 'true').lower() == 'true',
+        'idempotent': True
+    }
+}
+
+# Error codes that mean the upstream is struggling, as opposed to a bad request
+_UPSTREAM_ERROR_CODES = {
+    'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'ServiceUnavailableException',
+    'ServiceUnavailable', 'InternalFailure', 'InternalServerException', 'ServiceFailureException',
+    'DependencyFailedException', 'RequestTimeout', 'RequestTimeoutException'
+}
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+class ServiceUnavailable(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+class DeadlineExceeded(ServiceUnavailable):
+    """Raised when a call did not finish within its share of the request's remaining time"""
+
+def start_deadline(lambda_context=None):
+    """
+    Start the current request's time budget
+
+    Args:
+        lambda_context: Lambda context object; its remaining time, less DEADLINE_MARGIN_MS, is the
+            budget. Without one, DEADLINE_DEFAULT_MS is used
+
+    Returns:
+        Token for end_deadline
+    """
+    if lambda_context is not None:
+        budget_ms = lambda_context.get_remaining_time_in_millis() - DEADLINE_MARGIN_MS
+    else:
+        budget_ms = DEADLINE_DEFAULT_MS
+    return _deadline.set(time.monotonic() + max(0.0, budget_ms) / 1000)
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+def remaining_ms():
+    """Milliseconds left in the current request's budget, or None outside a request"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, (deadline - time.monotonic()) * 1000)
+
+def time_left(limit: float) -> float:
+    """Seconds to allow for end-of-request work: `limit`, capped by what is left of the request's budget"""
+    left_ms = remaining_ms()
+    return limit if left_ms is None else min(limit, left_ms / 1000)
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Whether an error says the service is unhealthy (and counts against its breaker)"""
+    if isinstance(error, (DeadlineExceeded, ReadTimeoutError, BotocoreConnectionError)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in _UPSTREAM_ERROR_CODES or status >= 500
+    return False
+
+class CircuitBreaker:
+    """
+    Failure-rate breaker over a sliding time window
+
+    Closed: calls pass and their outcomes are counted. Once at least `min_calls` outcomes in the
+    window fail at `failure_rate` or more, the breaker opens and calls fail fast for
+    `open_seconds`. Then one probe call is let through (half-open); it closes the breaker if it
+    succeeds and reopens it if it fails.
+    """
+
+    def __init__(self, name: str, failure_rate: float = BREAKER_FAILURE_RATE, min_calls: int = BREAKER_MIN_CALLS,
+                 window_seconds: float = BREAKER_WINDOW_SECONDS, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._probing = False
+        # (monotonic time, failed) per outcome in the window
+        self._outcomes = deque()
+        self._failures = 0
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record(self, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                    self._failures = 0
+                return
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            self._prune(now)
+            if (self.state == 'closed' and len(self._outcomes) >= self.min_calls
+                    and self._failures >= self.failure_rate * len(self._outcomes)):
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = 'open'
+        self._opened_at = now
+        self.stats['opened'] += 1
+        logger.warning(f"Circuit breaker for {self.name} opened for {self.open_seconds:g}s")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            return dict(
+                self.stats,
+                state=self.state,
+                window_calls=len(self._outcomes),
+                window_failures=self._failures
+            )
+
+class ResilientService:
+    """Breaker, per-call deadline and optional hedging for one upstream service"""
+
+    def __init__(self, name: str, timeout_ms: float, hedge: bool, idempotent: bool = True):
+        self.name = name
+        self.timeout_ms = timeout_ms
+        self.hedge = hedge and idempotent
+        self.idempotent = idempotent
+        self.breaker = CircuitBreaker(name)
+        self._latencies = deque(maxlen=200)
+        self._observed = 0
+        self._hedge_delay_ms = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0, 'failures': 0, 'deadline_exceeded': 0,
+            'hedges': 0, 'hedge_wins': 0, 'primary_wins': 0
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _observe(self, elapsed_ms: float):
+        with self._lock:
+            self._latencies.append(elapsed_ms)
+            self._observed += 1
+            # The delay is re-derived every few samples rather than sorting on every call
+            if len(self._latencies) >= HEDGE_MIN_SAMPLES and self._observed % 10 == 0:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, math.ceil(len(ordered) * HEDGE_PERCENTILE / 100) - 1)
+                self._hedge_delay_ms = max(HEDGE_MIN_DELAY_MS, ordered[index])
+
+    def hedge_delay_ms(self):
+        """Milliseconds to wait before hedging, or None if hedging is off, unlearned or over budget"""
+        with self._lock:
+            if not self.hedge or self._hedge_delay_ms is None:
+                return None
+            if self.stats['hedges'] >= HEDGE_MAX_RATIO * self.stats['calls']:
+                return None
+            return self._hedge_delay_ms
+
+    def call(self, fn, *args, hedge: bool = True, **kwargs):
+        """
+        Call `fn` within the request's remaining time, failing fast while the breaker is open
+
+        Args:
+            fn (callable): Blocking upstream call; must be safe to run twice when hedged
+            hedge (bool): Allow a hedged second request for this call
+
+        Returns:
+            The function's return value
+
+        Raises:
+            ServiceUnavailable: The breaker is open
+            DeadlineExceeded: No answer within the call's timeout or the request's remaining time.
+                Calls to a service that is not idempotent are never abandoned: they run on the
+                caller's thread and time out through the client's connect and read timeouts.
+        """
+        budget_ms = self.timeout_ms
+        left_ms = remaining_ms()
+        if left_ms is not None:
+            budget_ms = min(budget_ms, left_ms)
+        if budget_ms <= 0:
+            # Out of time before the call: the service is not to blame, so the breaker is left alone
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"No time left for {self.name}")
+        if not self.breaker.allow():
+            raise ServiceUnavailable(f"{self.name} is unavailable (circuit open)")
+
+        self._count('calls')
+        started = time.perf_counter()
+        try:
+            if self.idempotent:
+                result = self._race(fn, args, kwargs, budget_ms, self.hedge_delay_ms() if hedge else None)
+            else:
+                result = self._call_inline(fn, args, kwargs)
+        except Exception as e:
+            failed = is_upstream_failure(e)
+            self.breaker.record(failed)
+            if failed:
+                self._count('failures')
+            if isinstance(e, DeadlineExceeded):
+                self._count('deadline_exceeded')
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.breaker.record(False)
+        self._observe(elapsed_ms)
+        return result
+
+    def _call_inline(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except (ReadTimeoutError, ConnectTimeoutError) as e:
+            raise DeadlineExceeded(f"{self.name} did not answer within its client timeout: {str(e)}") from e
+
+    def _race(self, fn, args, kwargs, budget_ms: float, hedge_delay_ms):
+        executor = get_resilience_executor()
+        started = time.monotonic()
+        deadline = started + budget_ms / 1000
+        primary = submit_with_context(executor, fn, *args, **kwargs)
+        hedged = None
+        pending = {primary}
+        if hedge_delay_ms is not None and hedge_delay_ms < budget_ms:
+            done, _ = wait(pending, timeout=hedge_delay_ms / 1000)
+            if not done:
+                hedged = submit_with_context(executor, fn, *args, **kwargs)
+                pending.add(hedged)
+                self._count('hedges')
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                # Abandoned calls finish on the pool, bounded by the client's read timeout
+                raise DeadlineExceeded(f"{self.name} did not answer within {budget_ms:.0f} ms")
+            for future in done:
+                if future.exception() is None:
+                    if hedged is not None:
+                        self._count('hedge_wins' if future is hedged else 'primary_wins')
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats, timeout_ms=self.timeout_ms, hedge=self.hedge, idempotent=self.idempotent,
+                         hedge_delay_ms=round(self._hedge_delay_ms, 2) if self._hedge_delay_ms is not None else None)
+        stats['breaker'] = self.breaker.get_stats()
+        return stats
+
+resilience_executor = None
+_executor_lock = threading.Lock()
+services = {name: ResilientService(name, **settings) for name, settings in SERVICE_SETTINGS.items()}
+
+def get_resilience_executor():
+    """Return the thread pool that guarded calls run on, so the caller can stop waiting at the deadline"""
+    global resilience_executor
+    if resilience_executor is None:
+        with _executor_lock:
+            if resilience_executor is None:
+                resilience_executor = ThreadPoolExecutor(max_workers=RESILIENCE_WORKERS, thread_name_prefix='upstream')
+    return resilience_executor
+
+def call_with_resilience(service: str, fn, *args, hedge: bool = True, **kwargs):
+    """
+    Call an upstream through its breaker, deadline and hedging policy
+
+    Args:
+        service (str): Key of SERVICE_SETTINGS ('lex' or 'polly')
+        fn (callable): Blocking upstream call
+        hedge (bool): Allow a hedged second request for this call
+
+    Returns:
+        The function's return value; calls run directly when RESILIENCE_ENABLED is false
+    """
+    if not RESILIENCE_ENABLED:
+        return fn(*args, **kwargs)
+    return services[service].call(fn, *args, hedge=hedge, **kwargs)
+
+def get_resilience_stats() -> dict:
+    """Return breaker state, deadline and hedge counters per service"""
+    return {
+        'enabled': RESILIENCE_ENABLED,
+        'services': {name: service.get_stats() for name, service in services.items()}
+    }
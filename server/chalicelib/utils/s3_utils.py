@@ -1,9 +1,11 @@
-import boto3
 import logging
 import os
 import json
 from datetime import datetime
 from botocore.exceptions import ClientError
+from chalicelib.utils.aws_utils import get_client
+from chalicelib.utils.archive_utils import CONVERSATION_ARCHIVE_MODE, archive_conversation
+from chalicelib.utils.tracing_utils import traced
 
 logger = logging.getLogger(__name__)
 s3_client = None
@@ -19,40 +21,66 @@ def init_s3_client():
         region = os.environ.get('AWS_REGION', 'ca-central-1')
         
         # Create S3 client using explicit region
-        s3_client = boto3.client('s3', region_name=region)
+        s3_client = get_client('s3', region_name=region)
         
-        # Ensure the bucket exists
-        try:
-            s3_client.head_bucket(Bucket=CONVERSATION_BUCKET)
-            logger.info(f"S3 bucket '{CONVERSATION_BUCKET}' exists")
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                # Bucket doesn't exist, create it
-                logger.info(f"Creating S3 bucket '{CONVERSATION_BUCKET}'...")
-                s3_client.create_bucket(
-                    Bucket=CONVERSATION_BUCKET,
-                    CreateBucketConfiguration={
-                        'LocationConstraint': region
-                    }
-                )
-                logger.info(f"S3 bucket '{CONVERSATION_BUCKET}' created")
-            else:
-                logger.error(f"Error checking S3 bucket: {str(e)}")
-                raise
-                
         logger.info(f"S3 client initialized for bucket '{CONVERSATION_BUCKET}' in region {region}")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize S3 client: {str(e)}")
         return False
 
-def store_conversation_in_s3(session_id, conversation_data):
+def provision_bucket():
+    """
+    Create the conversation bucket if it does not exist
+    
+    Run at deploy time (see tools/provision.py), not in the request path.
+    
+    Returns:
+        bool: True if the bucket exists or was created
+    """
+    if not s3_client:
+        if not init_s3_client():
+            return False
+    
+    region = os.environ.get('AWS_REGION', 'ca-central-1')
+    try:
+        s3_client.head_bucket(Bucket=CONVERSATION_BUCKET)
+        logger.info(f"S3 bucket '{CONVERSATION_BUCKET}' exists")
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != '404':
+            logger.error(f"Error checking S3 bucket: {str(e)}")
+            return False
+    
+    # Bucket doesn't exist, create it
+    logger.info(f"Creating S3 bucket '{CONVERSATION_BUCKET}'...")
+    try:
+        s3_client.create_bucket(
+            Bucket=CONVERSATION_BUCKET,
+            CreateBucketConfiguration={
+                'LocationConstraint': region
+            }
+        )
+        logger.info(f"S3 bucket '{CONVERSATION_BUCKET}' created")
+        return True
+    except Exception as e:
+        logger.error(f"Error creating S3 bucket: {str(e)}")
+        return False
+
+@traced('s3')
+def store_conversation_in_s3(session_id, conversation_data, key_suffix=None, on_written=None):
     """
     Store conversation in S3
     
+    In 'batched' archive mode the conversation is buffered and rolled into a compressed
+    JSON Lines object (see archive_utils); in 'single' mode it is written as its own object.
+    
     Args:
         session_id (str): Session ID
         conversation_data (dict): Conversation data to store
+        key_suffix (str): Stable object name suffix in single mode, instead of the current time
+        on_written (callable): Called with the record's location once it is in S3: when its
+            archive object rolls in batched mode (None if that write fails), right away in single mode
         
     Returns:
         bool: Success status
@@ -62,6 +90,9 @@ def store_conversation_in_s3(session_id, conversation_data):
             logger.error("Failed to initialize S3 client")
             return False
     
+    if CONVERSATION_ARCHIVE_MODE == 'batched':
+        return archive_conversation(session_id, conversation_data, on_written)
+    
     try:
         # Generate folder structure by date: year/month/day
         now = datetime.utcnow()
@@ -69,7 +100,7 @@ def store_conversation_in_s3(session_id, conversation_data):
         
         # Create a unique key for this conversation
         timestamp = now.strftime("%Y%m%d-%H%M%S")
-        file_key = f"{date_folder}/{session_id}-{timestamp}.json"
+        file_key = f"{date_folder}/{session_id}-{key_suffix or timestamp}.json"
         
         # Upload conversation data
         s3_client.put_object(
@@ -80,6 +111,8 @@ def store_conversation_in_s3(session_id, conversation_data):
         )
         
         logger.info(f"Stored conversation for session {session_id} at {file_key}")
+        if on_written:
+            on_written({'bucket': CONVERSATION_BUCKET, 'object': file_key, 'compression': None})
         return True
     except Exception as e:
         logger.error(f"Error storing conversation in S3: {str(e)}")
@@ -0,0 +1,89 @@
+import logging
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Module import is the closest point we have to container start
+PROCESS_STARTED = time.perf_counter()
+
+# Services warmed on cold start, from Chalice config (comma separated, empty disables)
+WARMUP_SERVICES = [name.strip() for name in os.environ.get('WARMUP_SERVICES', 'lex,dynamodb').split(',') if name.strip()]
+WARMUP_TIMEOUT = float(os.environ.get('WARMUP_TIMEOUT', '2'))
+
+_lock = threading.Lock()
+startup_timings = {}
+first_request_at = None
+
+def timed_init(name: str, init_fn):
+    """
+    Run an initializer and record how long it took
+
+    Args:
+        name (str): Service name used in the startup report
+        init_fn (callable): Initializer returning True on success
+
+    Returns:
+        bool: Result of the initializer
+    """
+    started = time.perf_counter()
+    try:
+        result = init_fn()
+    except Exception as e:
+        logger.error(f"Initializer for {name} raised: {str(e)}")
+        result = False
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    with _lock:
+        startup_timings[name] = {
+            'ms': round(elapsed_ms, 2),
+            'ok': bool(result),
+            'at_ms': round((started - PROCESS_STARTED) * 1000, 2)
+        }
+    return result
+
+def warm_up(initializers: dict, services=None, timeout: float = WARMUP_TIMEOUT):
+    """
+    Run the selected initializers concurrently on a thread pool
+
+    Args:
+        initializers (dict): Service name to initializer
+        services (list): Names to warm, defaults to WARMUP_SERVICES
+        timeout (float): Seconds to wait before leaving the rest to lazy init
+
+    Returns:
+        dict: Service name to initializer result for those that finished
+    """
+    selected = [name for name in (services if services is not None else WARMUP_SERVICES) if name in initializers]
+    if not selected:
+        return {}
+
+    executor = ThreadPoolExecutor(max_workers=len(selected), thread_name_prefix='warmup')
+    futures = {executor.submit(timed_init, name, initializers[name]): name for name in selected}
+    done, not_done = wait(futures, timeout=timeout)
+    # Stragglers keep running; endpoints fall back to lazy init if they need them first
+    executor.shutdown(wait=False)
+
+    if not_done:
+        logger.warning(f"Warm-up still running after {timeout}s: {sorted(futures[f] for f in not_done)}")
+    return {futures[future]: future.result() for future in done}
+
+def mark_first_request():
+    """Record when the first request reached this container"""
+    global first_request_at
+    if first_request_at is None:
+        first_request_at = time.perf_counter()
+        logger.info(f"Startup report: {get_startup_report()}")
+
+def get_startup_report():
+    """Return per-service init timings and time from import to first request"""
+    with _lock:
+        timings = dict(startup_timings)
+    report = {
+        'services': timings,
+        'warmup_services': WARMUP_SERVICES
+    }
+    if first_request_at is not None:
+        report['first_request_ms'] = round((first_request_at - PROCESS_STARTED) * 1000, 2)
+    return report
@@ -0,0 +1,269 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Tracing configuration from Chalice config
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+TRACING_LOG_REQUESTS = os.environ.get('TRACING_LOG_REQUESTS', 'true').lower() == 'true'
+TRACING_FLUSH_SECONDS = float(os.environ.get('TRACING_FLUSH_SECONDS', '60'))
+TRACING_NAMESPACE = os.environ.get('TRACING_NAMESPACE', 'DentalChatbot')
+
+# Log-spaced histogram buckets: ~5% relative error from 0.1 ms up
+BUCKET_BASE_MS = 0.1
+BUCKET_GROWTH = 1.1
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class RequestTrace:
+    """Stage timings collected while one request is handled"""
+
+    def __init__(self, request_id: str, route: str):
+        self.request_id = request_id
+        self.route = route
+        self.started = time.perf_counter()
+        # (stage, milliseconds); list.append is atomic, so pool threads can record into it
+        self.stages = []
+
+    def record(self, stage: str, elapsed_ms: float):
+        self.stages.append((stage, elapsed_ms))
+
+    def stage_totals(self):
+        """Total milliseconds and call count per stage, in first-seen order"""
+        totals = {}
+        for stage, elapsed_ms in self.stages:
+            total, count = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + elapsed_ms, count + 1)
+        return totals
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+class _NullStage:
+    """Shared no-op used when tracing is off or no request is being traced"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        self.trace.record(self.name, elapsed_ms)
+        histograms.observe('Stage', self.name, elapsed_ms)
+        return False
+
+def trace_stage(name: str):
+    """
+    Time a block as one stage of the current request
+
+    Args:
+        name (str): Stage name reported in Server-Timing and metrics (e.g. 'lex')
+
+    Returns:
+        Context manager; a shared no-op when tracing is disabled or outside a request
+    """
+    if not TRACING_ENABLED:
+        return _NULL_STAGE
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_STAGE
+    return _Stage(trace, name)
+
+def traced(name: str):
+    """Decorator form of trace_stage; returns the function unchanged when tracing is disabled"""
+    def decorator(fn):
+        if not TRACING_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """Submit to a thread pool so the task records its stages into the submitting request's trace"""
+    if not TRACING_ENABLED:
+        return executor.submit(fn, *args, **kwargs)
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+class HistogramSet:
+    """In-process latency histograms keyed by (dimension, name), flushed as EMF log lines"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def bucket_for(value_ms: float) -> int:
+        if value_ms <= BUCKET_BASE_MS:
+            return 0
+        return int(math.log(value_ms / BUCKET_BASE_MS, BUCKET_GROWTH)) + 1
+
+    @staticmethod
+    def bucket_value(bucket: int) -> float:
+        """Representative value (geometric midpoint) of a bucket"""
+        if bucket == 0:
+            return BUCKET_BASE_MS
+        return BUCKET_BASE_MS * BUCKET_GROWTH ** (bucket - 0.5)
+
+    def observe(self, dimension: str, name: str, value_ms: float):
+        bucket = self.bucket_for(value_ms)
+        with self._lock:
+            histogram = self._histograms.get((dimension, name))
+            if histogram is None:
+                histogram = self._histograms[(dimension, name)] = {'counts': {}, 'sum': 0.0, 'min': value_ms, 'max': value_ms}
+            histogram['counts'][bucket] = histogram['counts'].get(bucket, 0) + 1
+            histogram['sum'] += value_ms
+            histogram['min'] = min(histogram['min'], value_ms)
+            histogram['max'] = max(histogram['max'], value_ms)
+
+    @classmethod
+    def percentile(cls, counts: dict, q: float) -> float:
+        total = sum(counts.values())
+        threshold = total * q / 100.0
+        running = 0
+        for bucket in sorted(counts):
+            running += counts[bucket]
+            if running >= threshold:
+                return round(cls.bucket_value(bucket), 2)
+        return None
+
+    def get_stats(self) -> dict:
+        """Count, mean and p50/p95/p99 per stage and route since the last flush"""
+        with self._lock:
+            snapshot = {key: dict(value, counts=dict(value['counts'])) for key, value in self._histograms.items()}
+        stats = {}
+        for (dimension, name), histogram in snapshot.items():
+            count = sum(histogram['counts'].values())
+            stats.setdefault(dimension.lower(), {})[name] = {
+                'count': count,
+                'mean_ms': round(histogram['sum'] / count, 2),
+                'p50_ms': self.percentile(histogram['counts'], 50),
+                'p95_ms': self.percentile(histogram['counts'], 95),
+                'p99_ms': self.percentile(histogram['counts'], 99),
+                'max_ms': round(histogram['max'], 2)
+            }
+        return stats
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Write each histogram as an EMF log line (Values/Counts) and start new ones
+
+        Args:
+            force (bool): Flush even if TRACING_FLUSH_SECONDS has not passed
+
+        Returns:
+            int: Number of metric lines written
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._histograms or (not force and now - self._last_flush < TRACING_FLUSH_SECONDS):
+                return 0
+            histograms, self._histograms = self._histograms, {}
+            self._last_flush = now
+
+        timestamp = int(time.time() * 1000)
+        for (dimension, name), histogram in histograms.items():
+            buckets = sorted(histogram['counts'])
+            print(json.dumps({
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': TRACING_NAMESPACE,
+                        'Dimensions': [[dimension]],
+                        'Metrics': [{'Name': 'Latency', 'Unit': 'Milliseconds'}]
+                    }]
+                },
+                dimension: name,
+                'Latency': {
+                    'Values': [round(self.bucket_value(bucket), 3) for bucket in buckets],
+                    'Counts': [histogram['counts'][bucket] for bucket in buckets],
+                    'Min': round(histogram['min'], 3),
+                    'Max': round(histogram['max'], 3),
+                    'Sum': round(histogram['sum'], 3),
+                    'Count': sum(histogram['counts'].values())
+                }
+            }, separators=(',', ':')), flush=True)
+        return len(histograms)
+
+histograms = HistogramSet()
+
+def start_trace(request_id: str = None, route: str = None):
+    """
+    Begin tracing a request in the current context
+
+    Returns:
+        tuple: (RequestTrace, token for end_trace), or (None, None) when tracing is disabled
+    """
+    if not TRACING_ENABLED:
+        return None, None
+    trace = RequestTrace(request_id or uuid.uuid4().hex, route or '')
+    return trace, _current_trace.set(trace)
+
+def end_trace(trace: RequestTrace, token, status_code: int = None) -> dict:
+    """
+    Finish a request trace: record the route total, log the request record and flush metrics if due
+
+    Returns:
+        dict: Response headers carrying the request ID and Server-Timing
+    """
+    _current_trace.reset(token)
+    total_ms = trace.elapsed_ms()
+    histograms.observe('Route', trace.route, total_ms)
+    totals = trace.stage_totals()
+
+    if TRACING_LOG_REQUESTS:
+        logger.info(json.dumps({
+            'type': 'request',
+            'request_id': trace.request_id,
+            'route': trace.route,
+            'status': status_code,
+            'duration_ms': round(total_ms, 2),
+            'stages': {stage: round(total, 2) for stage, (total, _) in totals.items()}
+        }, separators=(',', ':')))
+    histograms.flush()
+
+    timings = [
+        f'{stage};dur={total:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+        for stage, (total, count) in totals.items()
+    ]
+    timings.append(f"total;dur={total_ms:.1f}")
+    return {
+        'X-Request-ID': trace.request_id,
+        'Server-Timing': ', '.join(timings)
+    }
+
+def get_tracing_stats() -> dict:
+    """Return in-process latency percentiles for monitoring"""
+    stats = histograms.get_stats()
+    stats['enabled'] = TRACING_ENABLED
+    return stats
+
+atexit.register(histograms.flush, True)
@@ -1,16 +1,64 @@
-import boto3
 import logging
 import os
 import base64
 import uuid
 import time
+import random
+import re
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from chalicelib.utils.aws_utils import get_client
 from io import BytesIO
+from chalicelib.utils.tracing_utils import traced
+from chalicelib.utils.audio_preprocess_utils import preprocess_audio
 
 logger = logging.getLogger(__name__)
 transcribe_client = None
 recordings_bucket = "dental-chat-recordings"
 
+# Transcription mode from Chalice config: 'streaming' or 'batch'
+TRANSCRIBE_MODE = os.environ.get('TRANSCRIBE_MODE', 'streaming')
+TRANSCRIBE_STREAMING_ENGINE = os.environ.get('TRANSCRIBE_STREAMING_ENGINE', 'aws')
+TRANSCRIBE_CHUNK_BYTES = int(os.environ.get('TRANSCRIBE_CHUNK_BYTES', '8192'))
+TRANSCRIBE_LANGUAGE_CODE = os.environ.get('TRANSCRIBE_LANGUAGE_CODE', 'en-US')
+TRANSCRIBE_POLL_TIMEOUT = float(os.environ.get('TRANSCRIBE_POLL_TIMEOUT', '60'))
+TRANSCRIBE_UPLOAD_URL_EXPIRES = int(os.environ.get('TRANSCRIBE_UPLOAD_URL_EXPIRES', '300'))
+TRANSCRIBE_MULTIPART_BYTES = int(os.environ.get('TRANSCRIBE_MULTIPART_BYTES', str(8 * 1024 * 1024)))
+# Seconds a polled transcript stays retrievable after the job completes, for retried polls
+TRANSCRIBE_RESULT_TTL = int(os.environ.get('TRANSCRIBE_RESULT_TTL', '600'))
+
+# Tokens handed to clients for async jobs are bare UUID hex strings
+TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+RECORDING_PREFIX = 'temp-recordings/'
+
+# Content types the streaming API accepts, mapped to (media encoding, default sample rate).
+# Browser webm/opus is not accepted by Transcribe streaming and falls back to the batch path.
+STREAMING_ENCODINGS = {
+    'audio/ogg': ('ogg-opus', 48000),
+    'audio/opus': ('ogg-opus', 48000),
+    'audio/flac': ('flac', 16000),
+    'audio/x-flac': ('flac', 16000),
+    'audio/pcm': ('pcm', 16000),
+    'audio/l16': ('pcm', 16000)
+}
+
+# Content types accepted by batch jobs, mapped to the MediaFormat parameter
+BATCH_MEDIA_FORMATS = {
+    'audio/webm': 'webm',
+    'audio/ogg': 'ogg',
+    'audio/opus': 'ogg',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+    'audio/wav': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/mpeg': 'mp3',
+    'audio/mp4': 'mp4'
+}
+
 def init_transcribe_client():
     """Initialize Amazon Transcribe client"""
     global transcribe_client
@@ -20,35 +68,7 @@ def init_transcribe_client():
                   os.environ.get('DEFAULT_REGION', 'ca-central-1'))
         
         # Create Transcribe client using explicit region
-        transcribe_client = boto3.client('transcribe', region_name=region)
-        
-        # Initialize S3 bucket for recordings
-        s3_client = boto3.client('s3', region_name=region)
-        try:
-            # Check if bucket exists
-            s3_client.head_bucket(Bucket=recordings_bucket)
-            logger.info(f"S3 bucket '{recordings_bucket}' exists")
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code')
-            if error_code == '404' or error_code == 'NoSuchBucket':
-                # Bucket doesn't exist, create it
-                logger.info(f"Creating S3 bucket '{recordings_bucket}'...")
-                try:
-                    # Handle different region configurations
-                    if region == 'us-east-1':
-                        s3_client.create_bucket(Bucket=recordings_bucket)
-                    else:
-                        s3_client.create_bucket(
-                            Bucket=recordings_bucket,
-                            CreateBucketConfiguration={'LocationConstraint': region}
-                        )
-                    logger.info(f"S3 bucket '{recordings_bucket}' created")
-                except Exception as create_error:
-                    logger.error(f"Error creating S3 bucket: {str(create_error)}")
-                    return False
-            else:
-                logger.error(f"Error checking S3 bucket: {str(e)}")
-                return False
+        transcribe_client = get_client('transcribe', region_name=region)
         
         logger.info(f"Transcribe client initialized in region {region}")
         return True
@@ -56,41 +76,310 @@ def init_transcribe_client():
         logger.error(f"Failed to initialize Transcribe client: {str(e)}")
         return False
 
-def wait_for_job_completion(job_name, max_tries=30, delay=2):
+def provision_recordings_bucket():
+    """
+    Create the recordings bucket used by batch transcription if it does not exist
+    
+    Run at deploy time (see tools/provision.py), not in the request path.
+    
+    Returns:
+        bool: True if the bucket exists or was created
+    """
+    region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+              os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+    s3_client = get_client('s3', region_name=region)
+    try:
+        # Check if bucket exists
+        s3_client.head_bucket(Bucket=recordings_bucket)
+        logger.info(f"S3 bucket '{recordings_bucket}' exists")
+        return configure_upload_cors(s3_client)
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code')
+        if error_code != '404' and error_code != 'NoSuchBucket':
+            logger.error(f"Error checking S3 bucket: {str(e)}")
+            return False
+    
+    # Bucket doesn't exist, create it
+    logger.info(f"Creating S3 bucket '{recordings_bucket}'...")
+    try:
+        # Handle different region configurations
+        if region == 'us-east-1':
+            s3_client.create_bucket(Bucket=recordings_bucket)
+        else:
+            s3_client.create_bucket(
+                Bucket=recordings_bucket,
+                CreateBucketConfiguration={'LocationConstraint': region}
+            )
+        logger.info(f"S3 bucket '{recordings_bucket}' created")
+    except Exception as create_error:
+        logger.error(f"Error creating S3 bucket: {str(create_error)}")
+        return False
+    return configure_upload_cors(s3_client)
+
+def configure_upload_cors(s3_client):
+    """Allow browsers to PUT recordings with presigned URLs from create_upload_url"""
+    try:
+        s3_client.put_bucket_cors(
+            Bucket=recordings_bucket,
+            CORSConfiguration={
+                'CORSRules': [{
+                    'AllowedMethods': ['PUT'],
+                    'AllowedOrigins': [os.environ.get('UPLOAD_ALLOWED_ORIGIN', '*')],
+                    'AllowedHeaders': ['Content-Type'],
+                    'MaxAgeSeconds': 600
+                }]
+            }
+        )
+        logger.info(f"Upload CORS rule set on S3 bucket '{recordings_bucket}'")
+        return True
+    except Exception as e:
+        logger.error(f"Error setting CORS on S3 bucket: {str(e)}")
+        return False
+
+def poll_delays(initial_delay=0.25, fast_polls=3, backoff=1.6, max_delay=4.0):
+    """
+    Generate an adaptive polling schedule: a few fast polls, then exponential backoff with jitter
+    
+    Args:
+        initial_delay (float): Seconds between the early fast polls
+        fast_polls (int): Number of polls at the initial delay
+        backoff (float): Multiplier applied after the fast polls
+        max_delay (float): Upper bound on any single delay
+        
+    Yields:
+        float: Seconds to wait before the next poll
+    """
+    for _ in range(fast_polls):
+        yield initial_delay
+    delay = initial_delay
+    while True:
+        delay = min(delay * backoff, max_delay)
+        # Equal jitter keeps concurrent pollers from synchronizing
+        yield delay / 2 + random.uniform(0, delay / 2)
+
+def get_job_status(job_name):
+    """
+    Fetch a transcription job once, without waiting
+    
+    Args:
+        job_name (str): Name of the transcription job
+        
+    Returns:
+        dict: get_transcription_job response
+    """
+    return transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
+
+@traced('transcribe.job')
+def wait_for_job_completion(job_name, timeout=TRANSCRIBE_POLL_TIMEOUT, initial_delay=0.25, max_delay=4.0):
     """
-    Poll for transcription job completion with timeout
+    Poll for transcription job completion on an adaptive schedule until a deadline
     
     Args:
         job_name (str): Name of the transcription job
-        max_tries (int): Maximum number of polling attempts
-        delay (int): Seconds to wait between polls
+        timeout (float): Seconds before giving up
+        initial_delay (float): Seconds between the early fast polls
+        max_delay (float): Upper bound on the delay between polls
         
     Returns:
         dict: Job response or None if timeout or error
     """
-    global transcribe_client
-    tries = 0
+    deadline = time.monotonic() + timeout
+    delays = poll_delays(initial_delay=initial_delay, max_delay=max_delay)
+    polls = 0
     
-    while tries < max_tries:
+    while True:
         try:
-            response = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
+            response = get_job_status(job_name)
+            polls += 1
             status = response['TranscriptionJob']['TranscriptionJobStatus']
             
             if status == 'COMPLETED':
+                logger.info(f"Transcription job completed after {polls} polls")
                 return response
             elif status == 'FAILED':
                 logger.error(f"Transcription job failed: {response['TranscriptionJob'].get('FailureReason', 'Unknown reason')}")
                 return None
-            
-            tries += 1
-            time.sleep(delay)
         except Exception as e:
             logger.error(f"Error checking job status: {str(e)}")
             return None
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(next(delays), remaining))
             
-    logger.error(f"Transcription job timed out after {max_tries * delay} seconds")
+    logger.error(f"Transcription job timed out after {timeout} seconds ({polls} polls)")
     return None
 
+class AWSStreamingRecognizer:
+    """Recognizer backed by the Amazon Transcribe streaming API"""
+
+    def __init__(self, region: str, language_code: str = TRANSCRIBE_LANGUAGE_CODE):
+        # Imported lazily so the batch path works without the streaming SDK installed
+        from amazon_transcribe.client import TranscribeStreamingClient
+        self.client = TranscribeStreamingClient(region=region)
+        self.language_code = language_code
+
+    async def _transcribe(self, chunks, media_encoding, sample_rate):
+        stream = await self.client.start_stream_transcription(
+            language_code=self.language_code,
+            media_sample_rate_hz=sample_rate,
+            media_encoding=media_encoding
+        )
+
+        async def write_chunks():
+            for chunk in chunks:
+                await stream.input_stream.send_audio_event(audio_chunk=bytes(chunk))
+            await stream.input_stream.end_stream()
+
+        results = []
+
+        async def read_results():
+            async for event in stream.output_stream:
+                for result in event.transcript.results:
+                    if result.alternatives:
+                        results.append({
+                            'text': result.alternatives[0].transcript,
+                            'is_partial': result.is_partial
+                        })
+
+        await asyncio.gather(write_chunks(), read_results())
+        return results
+
+    def transcribe(self, chunks, media_encoding: str, sample_rate: int):
+        """Send audio chunks to the streaming API and return partial and final results"""
+        return asyncio.run(self._transcribe(chunks, media_encoding, sample_rate))
+
+class LocalRecognizer:
+    """Stand-in recognizer that reveals a fixed transcript as chunks arrive, for tests and local runs"""
+
+    def __init__(self, transcript: str = None):
+        self.transcript = transcript if transcript is not None else os.environ.get('LOCAL_TRANSCRIPT', 'local transcript')
+
+    def transcribe(self, chunks, media_encoding: str, sample_rate: int):
+        chunks = list(chunks)
+        words = self.transcript.split()
+        results = []
+        for index in range(1, len(chunks)):
+            revealed = words[:len(words) * index // len(chunks)]
+            if revealed:
+                results.append({'text': ' '.join(revealed), 'is_partial': True})
+        results.append({'text': self.transcript, 'is_partial': False})
+        return results
+
+# Registered recognizer factories, keyed by TRANSCRIBE_STREAMING_ENGINE value
+recognizer_factories = {
+    'aws': lambda: AWSStreamingRecognizer(
+        os.environ.get('AWS_LAMBDA_FUNCTION_REGION', os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+    ),
+    'local': LocalRecognizer
+}
+streaming_recognizer = None
+
+def register_recognizer(name: str, factory):
+    """Register a recognizer factory selectable via TRANSCRIBE_STREAMING_ENGINE"""
+    recognizer_factories[name] = factory
+
+def set_recognizer(recognizer):
+    """Replace the active streaming recognizer (e.g. with a LocalRecognizer in tests)"""
+    global streaming_recognizer
+    streaming_recognizer = recognizer
+
+def get_recognizer():
+    """Return the active streaming recognizer, creating it on first use"""
+    global streaming_recognizer
+    if streaming_recognizer is None:
+        factory = recognizer_factories.get(TRANSCRIBE_STREAMING_ENGINE)
+        if factory is None:
+            raise ValueError(f"Unknown streaming engine '{TRANSCRIBE_STREAMING_ENGINE}'")
+        streaming_recognizer = factory()
+    return streaming_recognizer
+
+def get_streaming_encoding(content_type: str):
+    """
+    Map a content type to a streaming media encoding
+
+    Args:
+        content_type (str): Content type, optionally with parameters (e.g. 'audio/l16;rate=16000')
+
+    Returns:
+        tuple: (media encoding, sample rate) or None if streaming does not support it
+    """
+    parts = [part.strip() for part in content_type.lower().split(';')]
+    encoding = STREAMING_ENCODINGS.get(parts[0])
+    if not encoding:
+        return None
+    media_encoding, sample_rate = encoding
+    for param in parts[1:]:
+        if param.startswith('rate='):
+            sample_rate = int(param[5:])
+    return media_encoding, sample_rate
+
+def iter_audio_chunks(audio_data: bytes, chunk_size: int = TRANSCRIBE_CHUNK_BYTES):
+    """Yield zero-copy slices of the audio buffer"""
+    view = memoryview(audio_data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+def stream_speech_to_text(audio_data: bytes, content_type: str = 'audio/ogg'):
+    """
+    Transcribe audio with the streaming recognizer, without an S3 upload or job polling
+
+    Args:
+        audio_data (bytes): Raw audio data
+        content_type (str): Content type of the audio data
+
+    Returns:
+        dict: Response containing the final text and partial transcripts
+    """
+    return _recognize_chunks(iter_audio_chunks(audio_data), content_type)
+
+@traced('transcribe.stream')
+def _recognize_chunks(chunks, content_type: str):
+    """Run the streaming recognizer over an iterable of audio chunks"""
+    encoding = get_streaming_encoding(content_type)
+    if not encoding:
+        return {
+            "error": f"Streaming transcription does not support {content_type}",
+            "text": None
+        }
+    media_encoding, sample_rate = encoding
+
+    try:
+        results = get_recognizer().transcribe(chunks, media_encoding, sample_rate)
+    except Exception as e:
+        logger.error(f"Streaming transcription error: {str(e)}", exc_info=True)
+        return {
+            "error": f"Streaming transcription failed: {str(e)}",
+            "text": None
+        }
+
+    final_text = " ".join(result['text'] for result in results if not result['is_partial']).strip()
+    logger.info(f"Streaming transcription result: '{final_text}'")
+    return {
+        "text": final_text,
+        "partials": [result['text'] for result in results if result['is_partial']]
+    }
+
+def decode_audio(audio_data_base64):
+    """
+    Decode base64 audio sent by the client
+    
+    Args:
+        audio_data_base64 (str): Base64 encoded audio data
+        
+    Returns:
+        tuple: (audio bytes, error message or None)
+    """
+    logger.info("Decoding audio data")
+    try:
+        audio_data = base64.b64decode(audio_data_base64)
+        logger.info(f"Audio data decoded, size: {len(audio_data)} bytes")
+        return audio_data, None
+    except Exception as e:
+        logger.error(f"Failed to decode base64 audio: {str(e)}")
+        return None, f"Invalid audio data: {str(e)}"
+
 def speech_to_text(audio_data_base64, content_type='audio/webm'):
     """
     Convert speech to text using Amazon Transcribe
@@ -102,43 +391,159 @@ def speech_to_text(audio_data_base64, content_type='audio/webm'):
     Returns:
         dict: Response containing transcribed text
     """
+    audio_data, error = decode_audio(audio_data_base64)
+    if error:
+        return {
+            "error": error,
+            "text": None
+        }
+    return transcribe_audio_bytes(audio_data, content_type)
+
+def transcribe_audio_bytes(audio_data: bytes, content_type='audio/webm'):
+    """
+    Convert raw audio (e.g. a binary request body) to text with the configured mode
+    
+    Args:
+        audio_data (bytes): Raw audio data
+        content_type (str): Content type of the audio data
+        
+    Returns:
+        dict: Response containing transcribed text
+    """
+    # Preprocessing can turn a format streaming does not accept (webm) into one it does
+    audio_data, content_type = preprocess_audio(audio_data, content_type, streaming=TRANSCRIBE_MODE == 'streaming')
+    if TRANSCRIBE_MODE == 'streaming' and get_streaming_encoding(content_type):
+        return stream_speech_to_text(audio_data, content_type)
+
+    return batch_speech_to_text(audio_data, content_type)
+
+def get_batch_media_format(content_type: str):
+    """Map a content type (parameters ignored) to a batch MediaFormat, or None if unsupported"""
+    return BATCH_MEDIA_FORMATS.get(content_type.lower().split(';')[0].strip())
+
+def _recording_key(token):
+    """S3 key of the uploaded recording for a transcription token"""
+    return f"{RECORDING_PREFIX}{token}"
+
+def _token_for_key(key):
+    """Token of a recording key handed out by create_upload_url, or None if the key is not one of ours"""
+    if not key or not key.startswith(RECORDING_PREFIX):
+        return None
+    token = key[len(RECORDING_PREFIX):]
+    return token if TOKEN_PATTERN.match(token) else None
+
+def _job_name(token):
+    """Transcription job name for a transcription token"""
+    return f"transcribe-{token}"
+
+@traced('s3.upload')
+def _upload_recording(audio_data: bytes, file_key: str, content_type: str):
+    """Upload a recording, switching to a multipart upload in TRANSCRIBE_MULTIPART_BYTES parts for long clips"""
+    region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+              os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+    s3_client = get_client('s3', region_name=region)
+    if len(audio_data) < TRANSCRIBE_MULTIPART_BYTES:
+        s3_client.put_object(
+            Body=audio_data,
+            Bucket=recordings_bucket,
+            Key=file_key,
+            ContentType=content_type
+        )
+        return
+    # BytesIO shares the buffer of an immutable bytes object until written to, so no copy is made
+    s3_client.upload_fileobj(
+        BytesIO(audio_data),
+        recordings_bucket,
+        file_key,
+        ExtraArgs={'ContentType': content_type},
+        Config=TransferConfig(
+            multipart_threshold=TRANSCRIBE_MULTIPART_BYTES,
+            multipart_chunksize=TRANSCRIBE_MULTIPART_BYTES,
+            use_threads=False
+        )
+    )
+
+def create_upload_url(content_type='audio/webm'):
+    """
+    Presign a PUT so the browser can upload a recording straight to the recordings bucket
+    
+    Args:
+        content_type (str): Content type the browser will upload with
+        
+    Returns:
+        dict: Response containing the recording key, upload URL and expiry
+    """
+    if not get_batch_media_format(content_type) and not get_streaming_encoding(content_type):
+        return {
+            "error": f"Unsupported audio content type: {content_type}",
+            "url": None
+        }
+    
+    file_key = _recording_key(uuid.uuid4().hex)
+    region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+              os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+    try:
+        url = get_client('s3', region_name=region).generate_presigned_url(
+            'put_object',
+            Params={'Bucket': recordings_bucket, 'Key': file_key, 'ContentType': content_type},
+            ExpiresIn=TRANSCRIBE_UPLOAD_URL_EXPIRES
+        )
+    except ClientError as e:
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"Error presigning recording upload: {error_message}")
+        return {
+            "error": f"Failed to create upload URL: {error_message}",
+            "url": None
+        }
+    
+    return {
+        "key": file_key,
+        "url": url,
+        "content_type": content_type,
+        "expires_in": TRANSCRIBE_UPLOAD_URL_EXPIRES
+    }
+
+def start_transcription(audio_data: bytes, content_type='audio/webm', token: str = None, preprocess: bool = True):
+    """
+    Upload audio and start a batch transcription job without waiting for it
+    
+    Args:
+        audio_data (bytes): Raw audio data, or None if the recording for token is already in S3
+        content_type (str): Content type of the audio data
+        token (str): Token of an uploaded recording, a new one is generated if not given
+        preprocess (bool): Trim and re-encode audio_data first (False if the caller already did)
+        
+    Returns:
+        dict: Response containing the job token used to poll for the result
+    """
     if not transcribe_client:
         if not init_transcribe_client():
             logger.error("Failed to initialize Transcribe client")
             return {
                 "error": "Failed to initialize Transcribe client",
-                "text": None
+                "token": None
             }
     
-    try:
-        # Decode base64 audio data
-        logger.info("Decoding audio data")
-        try:
-            audio_data = base64.b64decode(audio_data_base64)
-            logger.info(f"Audio data decoded, size: {len(audio_data)} bytes")
-        except Exception as e:
-            logger.error(f"Failed to decode base64 audio: {str(e)}")
-            return {
-                "error": f"Invalid audio data: {str(e)}",
-                "text": None
-            }
-        
-        # Get region for S3 client
-        region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
-                  os.environ.get('DEFAULT_REGION', 'ca-central-1'))
-        
-        # Upload to S3
-        s3_client = boto3.client('s3', region_name=region)
-        file_key = f"temp-recordings/{uuid.uuid4()}.webm"
-        
+    if audio_data is not None and preprocess:
+        audio_data, content_type = preprocess_audio(audio_data, content_type)
+    
+    # Derived after preprocessing, which may have changed the format
+    media_format = get_batch_media_format(content_type)
+    if not media_format:
+        return {
+            "error": f"Batch transcription does not support {content_type}",
+            "token": None
+        }
+    
+    token = token or uuid.uuid4().hex
+    file_key = _recording_key(token)
+    job_name = _job_name(token)
+    
+    # Upload to S3 unless the browser already did
+    if audio_data is not None:
         logger.info(f"Uploading audio to S3 bucket '{recordings_bucket}', key: {file_key}")
         try:
-            s3_client.put_object(
-                Body=audio_data,
-                Bucket=recordings_bucket,
-                Key=file_key,
-                ContentType=content_type
-            )
+            _upload_recording(audio_data, file_key, content_type)
             logger.info("Audio uploaded to S3 successfully")
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code')
@@ -146,77 +551,235 @@ def speech_to_text(audio_data_base64, content_type='audio/webm'):
             logger.error(f"S3 upload error ({error_code}): {error_message}")
             return {
                 "error": f"Failed to upload audio to S3: {error_message}",
+                "token": None
+            }
+    
+    # Start transcription job
+    try:
+        logger.info(f"Starting transcription job: {job_name}")
+        transcribe_client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            Media={'MediaFileUri': f"s3://{recordings_bucket}/{file_key}"},
+            MediaFormat=media_format,
+            LanguageCode=TRANSCRIBE_LANGUAGE_CODE
+        )
+        logger.info("Transcription job started successfully")
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code')
+        error_message = e.response.get('Error', {}).get('Message')
+        logger.error(f"Transcribe start job error ({error_code}): {error_message}")
+        return {
+            "error": f"Failed to start transcription: {error_message}",
+            "token": None
+        }
+    
+    return {
+        "token": token
+    }
+
+def _read_transcript(job_response):
+    """Fetch the transcript text for a completed job response"""
+    transcript_uri = job_response['TranscriptionJob']['Transcript']['TranscriptFileUri']
+    logger.info(f"Transcription completed, retrieving results from: {transcript_uri}")
+    
+    # Get the transcript content
+    import requests
+    transcript_response = requests.get(transcript_uri)
+    transcript_data = transcript_response.json()
+    
+    if 'results' not in transcript_data or 'transcripts' not in transcript_data['results'] or len(transcript_data['results']['transcripts']) == 0:
+        raise ValueError("Invalid transcript format received")
+        
+    return transcript_data['results']['transcripts'][0]['transcript']
+
+def _cleanup_job(token):
+    """Delete the transcription job and uploaded recording for a token"""
+    try:
+        job_name = _job_name(token)
+        logger.info(f"Cleaning up: deleting transcription job {job_name}")
+        transcribe_client.delete_transcription_job(TranscriptionJobName=job_name)
+        
+        file_key = _recording_key(token)
+        logger.info(f"Cleaning up: deleting S3 object {file_key}")
+        region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+                  os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+        get_client('s3', region_name=region).delete_object(Bucket=recordings_bucket, Key=file_key)
+    except Exception as e:
+        logger.warning(f"Cleanup error (non-critical): {str(e)}")
+
+def _completed_result(token, job_response, cleanup: bool = True):
+    """Build the result for a finished job and, unless cleanup is False, delete the job and recording"""
+    try:
+        transcribed_text = _read_transcript(job_response)
+        logger.info(f"Transcription result: '{transcribed_text}'")
+    except Exception as e:
+        logger.error(f"Error retrieving transcript: {str(e)}")
+        return {
+            "status": "FAILED",
+            "error": f"Error retrieving transcript: {str(e)}",
+            "text": None
+        }
+    
+    if cleanup:
+        _cleanup_job(token)
+    return {
+        "status": "COMPLETED",
+        "text": transcribed_text
+    }
+
+# Token -> (completed result, monotonic expiry), so repeated polls skip Transcribe and S3
+_polled_results = OrderedDict()
+_polled_lock = threading.Lock()
+MAX_POLLED_RESULTS = 1000
+
+def _remember_result(token, result, ttl: float):
+    with _polled_lock:
+        _polled_results[token] = (result, time.monotonic() + ttl)
+        while len(_polled_results) > MAX_POLLED_RESULTS:
+            _polled_results.popitem(last=False)
+
+def _recalled_result(token):
+    with _polled_lock:
+        entry = _polled_results.get(token)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del _polled_results[token]
+            return None
+        return dict(entry[0])
+
+def submit_speech_to_text(audio_data_base64, content_type='audio/webm'):
+    """
+    Start an asynchronous transcription and return a token to poll with
+    
+    Args:
+        audio_data_base64 (str): Base64 encoded audio data
+        content_type (str): Content type of the audio data
+        
+    Returns:
+        dict: Response containing the job token
+    """
+    audio_data, error = decode_audio(audio_data_base64)
+    if error:
+        return {
+            "error": error,
+            "token": None
+        }
+    return start_transcription(audio_data, content_type)
+
+def get_transcription_result(token):
+    """
+    Check a transcription job once and return its result if it has finished
+    
+    Args:
+        token (str): Token returned by start_transcription
+        
+    Returns:
+        dict: Response with status IN_PROGRESS, COMPLETED (with text) or FAILED (with error);
+        a completed transcript can be polled again for TRANSCRIBE_RESULT_TTL seconds
+    """
+    if not TOKEN_PATTERN.match(token or ''):
+        return {
+            "status": "FAILED",
+            "error": "Invalid transcription token",
+            "text": None
+        }
+    
+    result = _recalled_result(token)
+    if result is not None:
+        return result
+    
+    if not transcribe_client:
+        if not init_transcribe_client():
+            logger.error("Failed to initialize Transcribe client")
+            return {
+                "status": "FAILED",
+                "error": "Failed to initialize Transcribe client",
+                "text": None
+            }
+    
+    try:
+        response = get_job_status(_job_name(token))
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', '')
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"AWS Error ({error_code}): {error_message}")
+        return {
+            "status": "FAILED",
+            "error": error_message,
+            "text": None
+        }
+    
+    job = response['TranscriptionJob']
+    status = job['TranscriptionJobStatus']
+    if status == 'COMPLETED':
+        # The job is kept for TRANSCRIBE_RESULT_TTL so a retried poll (possibly on another
+        # container) still gets the transcript; only the recording is deleted right away
+        completed_at = job.get('CompletionTime')
+        age = (datetime.now(timezone.utc) - completed_at).total_seconds() if completed_at else 0.0
+        if age > TRANSCRIBE_RESULT_TTL:
+            _cleanup_job(token)
+            return {
+                "status": "FAILED",
+                "error": "Transcription result expired",
                 "text": None
             }
+        result = _completed_result(token, response, cleanup=False)
+        if result["status"] == 'COMPLETED':
+            _delete_recording(_recording_key(token))
+            _remember_result(token, result, TRANSCRIBE_RESULT_TTL - age)
+        return result
+    if status == 'FAILED':
+        _cleanup_job(token)
+        return {
+            "status": "FAILED",
+            "error": job.get('FailureReason', 'Unknown reason'),
+            "text": None
+        }
+    return {
+        "status": "IN_PROGRESS"
+    }
+
+def batch_speech_to_text(audio_data: bytes, content_type='audio/webm'):
+    """
+    Convert speech to text with a batch Transcribe job (S3 upload, job, polling)
+    
+    Args:
+        audio_data (bytes): Raw audio data
+        content_type (str): Content type of the audio data
         
-        # Start transcription job
-        job_name = f"transcribe-{uuid.uuid4()}"
-        try:
-            logger.info(f"Starting transcription job: {job_name}")
-            transcribe_client.start_transcription_job(
-                TranscriptionJobName=job_name,
-                Media={'MediaFileUri': f"s3://{recordings_bucket}/{file_key}"},
-                MediaFormat='webm',
-                LanguageCode='en-US'
-            )
-            logger.info("Transcription job started successfully")
-        except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code')
-            error_message = e.response.get('Error', {}).get('Message')
-            logger.error(f"Transcribe start job error ({error_code}): {error_message}")
+    Returns:
+        dict: Response containing transcribed text
+    """
+    try:
+        started = start_transcription(audio_data, content_type, preprocess=False)
+        if "error" in started:
             return {
-                "error": f"Failed to start transcription: {error_message}",
+                "error": started["error"],
                 "text": None
             }
+        token = started["token"]
         
-        # Wait for completion using our custom polling function
+        # Wait for completion using the adaptive poller
         logger.info("Waiting for transcription job to complete...")
-        response = wait_for_job_completion(job_name)
+        response = wait_for_job_completion(_job_name(token))
         if not response:
             logger.error("Transcription job failed or timed out")
+            _cleanup_job(token)
             return {
                 "error": "Transcription job failed or timed out",
                 "text": None
             }
         
-        # Get the transcription result
-        try:
-            transcript_uri = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
-            logger.info(f"Transcription completed, retrieving results from: {transcript_uri}")
-            
-            # Get the transcript content
-            import requests
-            transcript_response = requests.get(transcript_uri)
-            transcript_data = transcript_response.json()
-            
-            if 'results' not in transcript_data or 'transcripts' not in transcript_data['results'] or len(transcript_data['results']['transcripts']) == 0:
-                logger.error("Invalid transcript format received")
-                return {
-                    "error": "Invalid transcript format received",
-                    "text": None
-                }
-                
-            transcribed_text = transcript_data['results']['transcripts'][0]['transcript']
-            logger.info(f"Transcription result: '{transcribed_text}'")
-        except Exception as e:
-            logger.error(f"Error retrieving transcript: {str(e)}")
+        result = _completed_result(token, response)
+        if result["status"] != "COMPLETED":
             return {
-                "error": f"Error retrieving transcript: {str(e)}",
+                "error": result["error"],
                 "text": None
             }
         
-        # Clean up
-        try:
-            logger.info(f"Cleaning up: deleting transcription job {job_name}")
-            transcribe_client.delete_transcription_job(TranscriptionJobName=job_name)
-            
-            logger.info(f"Cleaning up: deleting S3 object {file_key}")
-            s3_client.delete_object(Bucket=recordings_bucket, Key=file_key)
-        except Exception as e:
-            logger.warning(f"Cleanup error (non-critical): {str(e)}")
-        
         return {
-            "text": transcribed_text
+            "text": result["text"]
         }
             
     except ClientError as e:
@@ -235,3 +798,79 @@ def speech_to_text(audio_data_base64, content_type='audio/webm'):
             "error": str(e),
             "text": None
         }
+
+def _iter_uploaded_chunks(file_key: str, chunk_size: int = TRANSCRIBE_CHUNK_BYTES):
+    """Stream an uploaded recording from S3 in chunks without holding the whole clip in memory"""
+    region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+              os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+    body = get_client('s3', region_name=region).get_object(Bucket=recordings_bucket, Key=file_key)['Body']
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+def _delete_recording(file_key: str):
+    try:
+        region = os.environ.get('AWS_LAMBDA_FUNCTION_REGION', 
+                  os.environ.get('DEFAULT_REGION', 'ca-central-1'))
+        get_client('s3', region_name=region).delete_object(Bucket=recordings_bucket, Key=file_key)
+    except Exception as e:
+        logger.warning(f"Cleanup error (non-critical): {str(e)}")
+
+def transcribe_uploaded_audio(key: str, content_type='audio/webm', wait: bool = True):
+    """
+    Transcribe a recording the browser uploaded with a URL from create_upload_url
+    
+    Args:
+        key (str): Recording key returned by create_upload_url
+        content_type (str): Content type the recording was uploaded with
+        wait (bool): If False, start a batch job and return its token instead of the text
+        
+    Returns:
+        dict: Response containing transcribed text (or the job token when not waiting)
+    """
+    token = _token_for_key(key)
+    if not token:
+        return {
+            "error": "Invalid recording key",
+            "text": None
+        }
+    
+    if wait and TRANSCRIBE_MODE == 'streaming' and get_streaming_encoding(content_type):
+        try:
+            return _recognize_chunks(_iter_uploaded_chunks(key), content_type)
+        finally:
+            _delete_recording(key)
+    
+    # The job reads the recording straight from S3, so the audio never passes through Lambda
+    started = start_transcription(None, content_type, token=token)
+    if not wait or "error" in started:
+        return started
+    
+    try:
+        response = wait_for_job_completion(_job_name(token))
+    except ClientError as e:
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"AWS Error: {error_message}")
+        _cleanup_job(token)
+        return {
+            "error": error_message,
+            "text": None
+        }
+    if not response:
+        logger.error("Transcription job failed or timed out")
+        _cleanup_job(token)
+        return {
+            "error": "Transcription job failed or timed out",
+            "text": None
+        }
+    
+    result = _completed_result(token, response)
+    if result["status"] != "COMPLETED":
+        return {
+            "error": result["error"],
+            "text": None
+        }
+    return {
+        "text": result["text"]
+    }
@@ -8,6 +8,8 @@ setup(
     install_requires=[
         "boto3>=1.28.0",
         "chalice>=1.29.0",
-        "requests>=2.28.0"
+        "requests>=2.28.0",
+        "numpy>=1.24.0",
+        "amazon-transcribe>=0.6.0"
     ],
 )
@@ -0,0 +1 @@
+# Offline and deploy-time tools (not packaged with the Lambda)
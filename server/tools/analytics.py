@@ -0,0 +1,334 @@
+"""
+Conversation analytics over the transcripts archived by /save-conversation.
+
+Reads both the batched archive (archive/dt=YYYY-MM-DD/hr=HH/*.jsonl.gz) and single-object
+saves (YYYY/MM/DD/*.json), from S3 or from a local directory with the same layout:
+
+    python -m tools.analytics --bucket dental-chat-conversations --since 2024-05-01
+    python -m tools.analytics --local ./conversations-backup --format table
+
+Per-day results are cached in --cache-dir, keyed on the listing of each date partition,
+so re-running a report only downloads and parses partitions that are new or changed.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = 'archive/'
+FALLBACK_INTENTS = ('FallbackIntent', 'unknown')
+# Turns-per-session histogram buckets kept per day; the last bucket collects longer sessions
+MAX_TURNS_BUCKET = 200
+
+class LocalSource:
+    """A directory laid out like the conversation bucket"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def list_prefixes(self, prefix: str):
+        """Immediate 'sub-directories' of a prefix, with trailing slash"""
+        path = os.path.join(self.root, prefix)
+        if not os.path.isdir(path):
+            return []
+        return sorted(f"{prefix}{name}/" for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+
+    def list_objects(self, prefix: str):
+        """(key, size) of every object under a prefix"""
+        base = os.path.join(self.root, prefix)
+        objects = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(directory, name)
+                objects.append((os.path.relpath(path, self.root).replace(os.sep, '/'), os.path.getsize(path)))
+        return sorted(objects)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), 'rb') as file:
+            return file.read()
+
+class S3Source:
+    """The conversation bucket itself"""
+
+    def __init__(self, bucket: str, region: str = None):
+        # Imported here so --local runs need no AWS configuration
+        from chalicelib.utils.aws_utils import get_client
+        self.bucket = bucket
+        self.client = get_client('s3', region_name=region)
+
+    def list_prefixes(self, prefix: str):
+        prefixes = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            prefixes.extend(entry['Prefix'] for entry in page.get('CommonPrefixes', []))
+        return sorted(prefixes)
+
+    def list_objects(self, prefix: str):
+        objects = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend((entry['Key'], entry['Size']) for entry in page.get('Contents', []))
+        return sorted(objects)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+def list_days(source):
+    """Dates (YYYY-MM-DD) that have archived or single-object conversations"""
+    days = {prefix[len(ARCHIVE_PREFIX) + 3:-1] for prefix in source.list_prefixes(ARCHIVE_PREFIX) if prefix.startswith(f"{ARCHIVE_PREFIX}dt=")}
+    for year in source.list_prefixes(''):
+        if not year[:-1].isdigit():
+            continue
+        for month in source.list_prefixes(year):
+            for day in source.list_prefixes(month):
+                days.add(day[:-1].replace('/', '-'))
+    return sorted(days)
+
+def list_day_objects(source, day: str):
+    """Data objects for a day in both layouts (index sidecars and manifests are skipped)"""
+    prefixes = [f"{ARCHIVE_PREFIX}dt={day}/", f"{day.replace('-', '/')}/"]
+    return [
+        (key, size)
+        for prefix in prefixes
+        for key, size in source.list_objects(prefix)
+        if not key.endswith('.index.json')
+    ]
+
+def fetch_objects(source, keys, concurrency: int = 16):
+    """
+    Download objects with at most `concurrency` GETs in flight
+
+    Yields (key, body) in request order, so parsing overlaps with downloading while the
+    number of bodies held in memory stays bounded.
+    """
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='analytics-get') as executor:
+        in_flight = deque()
+        for key in keys:
+            in_flight.append((key, executor.submit(source.get, key)))
+            if len(in_flight) >= concurrency:
+                break
+        while in_flight:
+            key, future = in_flight.popleft()
+            body = future.result()
+            next_key = next(keys, None)
+            if next_key is not None:
+                in_flight.append((next_key, executor.submit(source.get, next_key)))
+            yield key, body
+
+def iter_records(key: str, body: bytes):
+    """Yield conversation records from one object, line by line for JSON Lines archives"""
+    if key.endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=BytesIO(body))
+    elif key.endswith('.zst'):
+        import zstandard
+        stream = zstandard.ZstdDecompressor().stream_reader(BytesIO(body), read_across_frames=True)
+    else:
+        yield json.loads(body)
+        return
+    buffered = b''
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        lines = (buffered + chunk).split(b'\n')
+        buffered = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffered.strip():
+        yield json.loads(buffered)
+
+def iter_turns(records):
+    """
+    Yield (session_id, is_bot, intent) for every distinct message
+
+    Whole-conversation saves repeat earlier messages and delta saves can overlap after a
+    retry, so messages are keyed on their seq/hash (or id, or position) within the session.
+    """
+    seen = set()
+    for record in records:
+        session_id = record.get('session_id')
+        start = record.get('seq_start', 0)
+        for offset, message in enumerate(record.get('messages') or []):
+            identity = (session_id, message.get('hash') or message.get('id') or (start + offset, message.get('text')))
+            if identity in seen:
+                continue
+            seen.add(identity)
+            is_bot = message.get('sender') == 'bot'
+            yield session_id, is_bot, (message.get('intent') or 'unknown') if is_bot else None
+
+def aggregate_day(turns) -> dict:
+    """
+    Aggregate one day of turns with columnar NumPy arrays
+
+    Sessions and intents are dictionary-encoded to integer codes so counts are bincounts.
+    """
+    session_codes, intent_codes, bot_flags = [], [], []
+    sessions, intents = {}, {}
+    for session_id, is_bot, intent in turns:
+        session_codes.append(sessions.setdefault(session_id, len(sessions)))
+        bot_flags.append(is_bot)
+        intent_codes.append(intents.setdefault(intent, len(intents)) if is_bot else -1)
+
+    if not session_codes:
+        return {'sessions': 0, 'user_turns': 0, 'bot_turns': 0, 'fallback_turns': 0, 'intents': {}, 'turns_histogram': []}
+
+    session_codes = np.asarray(session_codes, dtype=np.int64)
+    intent_codes = np.asarray(intent_codes, dtype=np.int64)
+    bot_flags = np.asarray(bot_flags, dtype=bool)
+
+    intent_names = np.array(list(intents), dtype=object)
+    intent_counts = np.bincount(intent_codes[bot_flags], minlength=len(intents))
+    fallback_mask = np.isin(intent_names, FALLBACK_INTENTS) if len(intents) else np.zeros(0, dtype=bool)
+
+    turns_per_session = np.bincount(session_codes[~bot_flags], minlength=len(sessions))
+    histogram = np.bincount(np.minimum(turns_per_session, MAX_TURNS_BUCKET))
+
+    return {
+        'sessions': len(sessions),
+        'user_turns': int((~bot_flags).sum()),
+        'bot_turns': int(bot_flags.sum()),
+        'fallback_turns': int(intent_counts[fallback_mask].sum()),
+        'intents': {str(name): int(count) for name, count in zip(intent_names, intent_counts) if count},
+        'turns_histogram': histogram.tolist()
+    }
+
+class PartitionCache:
+    """Per-day results on disk, valid while the day's object listing is unchanged"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(objects) -> str:
+        return hashlib.sha256(json.dumps(objects, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def _path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.json")
+
+    def get(self, day: str, fingerprint: str):
+        if not self.directory or not os.path.exists(self._path(day)):
+            return None
+        with open(self._path(day)) as file:
+            entry = json.load(file)
+        return entry['result'] if entry.get('fingerprint') == fingerprint else None
+
+    def put(self, day: str, fingerprint: str, result: dict):
+        if not self.directory:
+            return
+        with open(self._path(day), 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'result': result}, file)
+
+def _percentile_from_histogram(histogram: np.ndarray, q: float):
+    total = histogram.sum()
+    if total == 0:
+        return None
+    return int(np.searchsorted(np.cumsum(histogram), total * q / 100.0))
+
+def build_report(days: dict) -> dict:
+    """Combine per-day results into totals, per-intent counts and fallback rates"""
+    intents = {}
+    histogram = np.zeros(MAX_TURNS_BUCKET + 1, dtype=np.int64)
+    per_day = {}
+    for day, result in sorted(days.items()):
+        for intent, count in result['intents'].items():
+            intents[intent] = intents.get(intent, 0) + count
+        day_histogram = np.asarray(result['turns_histogram'], dtype=np.int64)
+        histogram[:len(day_histogram)] += day_histogram
+        per_day[day] = {
+            'sessions': result['sessions'],
+            'user_turns': result['user_turns'],
+            'bot_turns': result['bot_turns'],
+            'fallback_rate': round(result['fallback_turns'] / result['bot_turns'], 4) if result['bot_turns'] else None,
+            'turns_per_session_p50': _percentile_from_histogram(day_histogram, 50)
+        }
+
+    bot_turns = sum(result['bot_turns'] for result in days.values())
+    fallback_turns = sum(result['fallback_turns'] for result in days.values())
+    return {
+        'days': per_day,
+        'totals': {
+            'sessions': sum(result['sessions'] for result in days.values()),
+            'user_turns': sum(result['user_turns'] for result in days.values()),
+            'bot_turns': bot_turns,
+            'fallback_rate': round(fallback_turns / bot_turns, 4) if bot_turns else None,
+            'turns_per_session_p50': _percentile_from_histogram(histogram, 50),
+            'turns_per_session_p90': _percentile_from_histogram(histogram, 90)
+        },
+        'intents': dict(sorted(intents.items(), key=lambda entry: -entry[1]))
+    }
+
+def run_report(source, since: str = None, until: str = None, concurrency: int = 16, cache: PartitionCache = None):
+    """
+    Aggregate every day in [since, until], reusing cached days whose objects have not changed
+
+    Returns:
+        tuple: (report dict, number of days processed, number of days served from cache)
+    """
+    cache = cache or PartitionCache(None)
+    results = {}
+    processed = cached = 0
+    for day in list_days(source):
+        if (since and day < since) or (until and day > until):
+            continue
+        objects = list_day_objects(source, day)
+        fingerprint = PartitionCache.fingerprint(objects)
+        result = cache.get(day, fingerprint)
+        if result is None:
+            bodies = fetch_objects(source, [key for key, _ in objects], concurrency)
+            records = (record for key, body in bodies for record in iter_records(key, body))
+            result = aggregate_day(iter_turns(records))
+            cache.put(day, fingerprint, result)
+            processed += 1
+        else:
+            cached += 1
+        results[day] = result
+    return build_report(results), processed, cached
+
+def format_table(report: dict) -> str:
+    lines = [f"{'day':<12}{'sessions':>10}{'user':>8}{'bot':>8}{'fallback':>10}{'p50 turns':>11}"]
+    for day, row in report['days'].items():
+        fallback = f"{row['fallback_rate']:.1%}" if row['fallback_rate'] is not None else '-'
+        p50 = row['turns_per_session_p50'] if row['turns_per_session_p50'] is not None else '-'
+        lines.append(f"{day:<12}{row['sessions']:>10}{row['user_turns']:>8}{row['bot_turns']:>8}{fallback:>10}{p50:>11}")
+    lines.append('')
+    lines.append(f"{'intent':<32}{'turns':>8}")
+    for intent, count in report['intents'].items():
+        lines.append(f"{intent:<32}{count:>8}")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Intent, fallback and turn-count reports over archived conversations')
+    location = parser.add_mutually_exclusive_group(required=True)
+    location.add_argument('--bucket', help='Conversation bucket to read')
+    location.add_argument('--local', help='Local directory laid out like the bucket')
+    parser.add_argument('--region', default=None, help='Bucket region')
+    parser.add_argument('--since', help='First day to include (YYYY-MM-DD)')
+    parser.add_argument('--until', help='Last day to include (YYYY-MM-DD)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum concurrent object downloads')
+    parser.add_argument('--cache-dir', default='.analytics-cache', help="Per-day result cache ('' disables)")
+    parser.add_argument('--format', choices=('json', 'table'), default='json')
+    args = parser.parse_args(argv)
+
+    source = LocalSource(args.local) if args.local else S3Source(args.bucket, args.region)
+    report, processed, cached = run_report(source, args.since, args.until, args.concurrency, PartitionCache(args.cache_dir or None))
+    logger.info(f"{processed} days processed, {cached} days from cache")
+    print(format_table(report) if args.format == 'table' else json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,462 @@
+"""
+Load and latency benchmark for the API, run in-process against local AWS stand-ins.
+
+Replays conversation traces at a target request rate through either entry point and reports
+throughput and p50/p95/p99 per endpoint and per stage (from the Server-Timing header) as JSON:
+
+    python -m tools.benchmark --mode chalice --rps 5 --duration 30
+    python -m tools.benchmark --mode asgi --rps 200 --duration 30 --output bench.json
+    python -m tools.benchmark --mode asgi --sweep 50,100,200,400 --slo-ms 1500
+    python -m tools.benchmark --trace sessions.jsonl --baseline bench-main.json
+
+--mode chalice drives app.py through Chalice's local test client one request at a time, as a
+single Lambda container would; time spent waiting for the container is reported as the 'queue'
+stage. --mode asgi drives asgi.py concurrently on one event loop. --sweep runs closed-loop
+sessions at each concurrency and reports the largest one whose p95 stays within --slo-ms.
+
+A trace is JSON Lines, one session per line:
+
+    {"steps": [{"route": "/transcribe", "audio_bytes": 48000, "content_type": "audio/ogg"},
+               {"route": "/chat", "message": "I want to book an appointment", "speak": true, "think_ms": 3000},
+               {"route": "/speech", "text": "See you soon."},
+               {"route": "/save-conversation"}]}
+
+Without --trace, sessions are generated from a fixed mix of FAQ, booking and voice conversations.
+Service latencies are log-normal around --latency medians (ms), e.g. --latency lex=120,polly=150.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCENTILES = (50, 95, 99)
+
+# Synthetic conversation mix: (weight, steps)
+SESSION_TEMPLATES = [
+    (4, [
+        {'route': '/chat', 'message': ['What are your hours?', 'When are you open?', 'What are your opening hours?']},
+        {'route': '/chat', 'message': ['Do you take my insurance?', 'Which insurance do you accept?'], 'think_ms': 4000},
+        {'route': '/save-conversation', 'think_ms': 1000}
+    ]),
+    (3, [
+        {'route': '/chat', 'message': ['I want to book an appointment', 'Can I book a cleaning?'], 'speak': True},
+        {'route': '/chat', 'message': ['Tomorrow', 'Monday works'], 'speak': True, 'think_ms': 3000},
+        {'route': '/chat', 'message': ['10 am please', '3 pm'], 'speak': True, 'think_ms': 3000},
+        {'route': '/chat', 'message': ['My name is Alex Smith', 'The name is Sam Lee'], 'speak': True, 'think_ms': 4000},
+        {'route': '/save-conversation', 'think_ms': 1000}
+    ]),
+    (2, [
+        {'route': '/transcribe', 'audio_bytes': [32000, 48000, 64000], 'content_type': 'audio/ogg'},
+        {'route': '/chat', 'message': ['I would like to book an appointment'], 'think_ms': 200},
+        {'route': '/speech', 'text': ['Sure, I can help you book an appointment.', 'What day works best for you?'], 'think_ms': 200},
+        {'route': '/transcribe', 'audio_bytes': [16000, 24000], 'content_type': 'audio/ogg', 'think_ms': 4000},
+        {'route': '/chat', 'message': ['Tomorrow'], 'think_ms': 200},
+        {'route': '/save-conversation', 'think_ms': 1000}
+    ]),
+    (1, [
+        {'route': '/chat', 'message': ['Where is the clinic?', 'Is there parking?'], 'speak': True},
+        {'route': '/chat', 'message': ['Can you whiten my teeth on the moon?'], 'think_ms': 5000},
+        {'route': '/save-conversation', 'think_ms': 1000}
+    ])
+]
+
+def synthetic_sessions(count: int, seed: int = 0) -> list:
+    """Draw sessions from SESSION_TEMPLATES, picking one variant of every choice"""
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in SESSION_TEMPLATES]
+    sessions = []
+    for _ in range(count):
+        template = rng.choices([steps for _, steps in SESSION_TEMPLATES], weights=weights)[0]
+        steps = []
+        for step in template:
+            steps.append({key: rng.choice(value) if isinstance(value, list) else value for key, value in step.items()})
+        sessions.append({'steps': steps})
+    return sessions
+
+def load_trace(path: str) -> list:
+    with open(path) as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+def parse_latency(spec: str) -> dict:
+    """'lex=120,polly=150' -> {'lex': 120.0, 'polly': 150.0}"""
+    latency = {}
+    for part in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, value = part.partition('=')
+        latency[name.strip()] = float(value)
+    return latency
+
+def parse_server_timing(header: str) -> dict:
+    """'lex;dur=120.1, polly;dur=80.0;desc="x2", total;dur=210.4' -> {'lex': 120.1, 'polly': 80.0}"""
+    stages = {}
+    for entry in filter(None, (entry.strip() for entry in (header or '').split(','))):
+        name, *params = entry.split(';')
+        if name == 'total':
+            continue
+        for param in params:
+            if param.startswith('dur='):
+                stages[name] = float(param[4:])
+    return stages
+
+class SessionState:
+    """Messages exchanged so far, to build /save-conversation bodies the way the client does"""
+
+    def __init__(self):
+        self.session_id = f"bench-{uuid.uuid4().hex[:16]}"
+        self.messages = []
+
+    def build_request(self, step: dict):
+        """Return (label, method, path, headers, body bytes) for a trace step"""
+        route = step['route']
+        if route == '/chat':
+            body = {'message': step['message'], 'session_id': self.session_id}
+            if step.get('speak'):
+                body['speak'] = True
+            self.messages.append({'id': uuid.uuid4().hex[:12], 'text': step['message'], 'sender': 'user'})
+            label = '/chat (speak)' if step.get('speak') else '/chat'
+            return label, 'POST', '/chat', {'Content-Type': 'application/json'}, json.dumps(body).encode('utf-8')
+        if route == '/speech':
+            body = {'text': step['text'], 'voice': step.get('voice', 'Joanna')}
+            return '/speech', 'POST', '/speech', {'Content-Type': 'application/json'}, json.dumps(body).encode('utf-8')
+        if route == '/transcribe':
+            audio = os.urandom(int(step.get('audio_bytes', 32000)))
+            return '/transcribe', 'POST', '/transcribe', {'Content-Type': step.get('content_type', 'audio/ogg')}, audio
+        if route == '/save-conversation':
+            body = {'session_id': self.session_id, 'messages': self.messages}
+            last_id = self.messages[-1]['id'] if self.messages else ''
+            headers = {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': f"{self.session_id}:{len(self.messages)}:{last_id}"
+            }
+            return '/save-conversation', 'POST', '/save-conversation', headers, json.dumps(body).encode('utf-8')
+        raise ValueError(f"Unsupported trace route {route}")
+
+    def record_reply(self, path: str, body):
+        if path == '/chat' and isinstance(body, dict) and body.get('text'):
+            self.messages.append({
+                'id': uuid.uuid4().hex[:12],
+                'text': body['text'],
+                'sender': 'bot',
+                'intent': body.get('intent')
+            })
+
+def is_error(status: int, body) -> bool:
+    """The API reports most failures as 200 responses with an error field; shed requests (429) are counted apart"""
+    if status == 429:
+        return False
+    if status >= 400:
+        return True
+    return isinstance(body, dict) and (bool(body.get('error')) or body.get('status') == 'error' or body.get('success') is False)
+
+class ChaliceTarget:
+    """app.py through Chalice's local gateway, serialized like one Lambda container"""
+
+    def __init__(self):
+        from chalice.test import Client
+        import app
+        self.client = Client(app.app, project_dir=SERVER_DIR)
+        self.container = threading.Lock()
+
+    def _call(self, method, path, headers, body):
+        queued = time.perf_counter()
+        with self.container:
+            queue_ms = (time.perf_counter() - queued) * 1000
+            response = self.client.http.request(method, path, headers=headers, body=body)
+        return response.status_code, response.headers, response.body, queue_ms
+
+    async def request(self, method, path, headers, body):
+        status, response_headers, payload, queue_ms = await asyncio.get_running_loop().run_in_executor(
+            None, self._call, method, path, headers, body
+        )
+        return status, response_headers, payload, {'queue': queue_ms}
+
+class AsgiTarget:
+    """asgi.py called directly on the benchmark's event loop"""
+
+    def __init__(self):
+        import asgi
+        self.app = asgi.app
+
+    async def request(self, method, path, headers, body):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                return {'type': 'http.disconnect'}
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        response = {'headers': {}, 'body': []}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode('latin-1'): value.decode('latin-1') for name, value in message['headers']}
+            else:
+                response['body'].append(message.get('body', b''))
+
+        await self.app(scope, receive, send)
+        return response['status'], response['headers'], b''.join(response['body']), {}
+
+class Recorder:
+    """Per-request samples collected during a run"""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, label: str, status: int, latency_ms: float, stages: dict, error: bool, finished: float):
+        self.samples.append((label, status, latency_ms, stages, error, finished))
+
+def _summary(values, errors: int = None, shed: int = None, elapsed: float = None) -> dict:
+    array = np.asarray(values, dtype=float)
+    summary = {'count': int(array.size)}
+    if errors is not None:
+        summary.update({'errors': errors, 'shed': shed})
+    if array.size:
+        summary.update({
+            'mean_ms': round(float(array.mean()), 2),
+            **{f"p{q}_ms": round(float(value), 2) for q, value in zip(PERCENTILES, np.percentile(array, PERCENTILES))},
+            'max_ms': round(float(array.max()), 2)
+        })
+    if elapsed:
+        summary['throughput_rps'] = round(array.size / elapsed, 2)
+    return summary
+
+def summarize(recorder: Recorder, started: float) -> dict:
+    """Aggregate samples into totals plus per-endpoint and per-stage percentiles"""
+    samples = recorder.samples
+    if not samples:
+        return {'requests': 0, 'errors': 0, 'throughput_rps': 0.0, 'endpoints': {}, 'stages': {}}
+    elapsed = max(finished for *_, finished in samples) - started
+    endpoints, stages = {}, {}
+    for label, status, latency_ms, sample_stages, error, _ in samples:
+        entry = endpoints.setdefault(label, {'latency': [], 'errors': 0, 'shed': 0})
+        entry['latency'].append(latency_ms)
+        entry['errors'] += error
+        entry['shed'] += status == 429
+        for stage, stage_ms in sample_stages.items():
+            stages.setdefault(stage, []).append(stage_ms)
+    errors = sum(1 for sample in samples if sample[4])
+    shed = sum(1 for sample in samples if sample[1] == 429)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4),
+        'shed': shed,
+        'shed_rate': round(shed / len(samples), 4),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        'latency': _summary([sample[2] for sample in samples]),
+        'endpoints': {label: _summary(entry['latency'], entry['errors'], entry['shed'], elapsed) for label, entry in sorted(endpoints.items())},
+        'stages': {stage: _summary(values) for stage, values in sorted(stages.items())}
+    }
+
+async def run_session(target, session: dict, recorder: Recorder, think_scale: float, stop_at: float = None):
+    state = SessionState()
+    for step in session['steps']:
+        think_ms = step.get('think_ms', 0) * think_scale
+        if think_ms:
+            await asyncio.sleep(think_ms / 1000)
+        if stop_at is not None and time.perf_counter() >= stop_at:
+            return
+        label, method, path, headers, body = state.build_request(step)
+        sent = time.perf_counter()
+        try:
+            status, response_headers, payload, extra_stages = await target.request(method, path, headers, body)
+        except Exception as e:
+            logger.error(f"{label} raised: {str(e)}")
+            recorder.add(label, 599, (time.perf_counter() - sent) * 1000, {}, True, time.perf_counter())
+            continue
+        finished = time.perf_counter()
+        try:
+            reply = json.loads(payload) if payload else None
+        except (ValueError, UnicodeDecodeError):
+            reply = None
+        lowered = {name.lower(): value for name, value in response_headers.items()}
+        stages = dict(parse_server_timing(lowered.get('server-timing')), **extra_stages)
+        recorder.add(label, status, (finished - sent) * 1000, stages, is_error(status, reply), finished)
+        state.record_reply(path, reply)
+
+async def replay(target, sessions: list, rps: float, duration: float, think_scale: float, seed: int, drain: float) -> dict:
+    """
+    Open-loop replay: sessions start as a Poisson process sized so requests arrive at ~rps
+
+    Returns:
+        dict: Summary from summarize()
+    """
+    rng = random.Random(seed)
+    steps_per_session = sum(len(session['steps']) for session in sessions) / len(sessions)
+    session_rate = rps / steps_per_session
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + duration
+    tasks = []
+    index = 0
+    next_start = started
+    while next_start < deadline:
+        await asyncio.sleep(max(0.0, next_start - time.perf_counter()))
+        tasks.append(asyncio.ensure_future(run_session(target, sessions[index % len(sessions)], recorder, think_scale)))
+        index += 1
+        next_start += rng.expovariate(session_rate)
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=drain)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} sessions still running after the {drain}s drain")
+    summary = summarize(recorder, started)
+    summary['offered_rps'] = rps
+    summary['sessions_started'] = index
+    return summary
+
+async def closed_loop(target, sessions: list, concurrency: int, duration: float, think_scale: float) -> dict:
+    """Keep `concurrency` sessions running back to back for `duration` seconds"""
+    recorder = Recorder()
+    started = time.perf_counter()
+    stop_at = started + duration
+    counter = iter(range(10 ** 9))
+
+    async def worker():
+        while time.perf_counter() < stop_at:
+            await run_session(target, sessions[next(counter) % len(sessions)], recorder, think_scale, stop_at)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    summary = summarize(recorder, started)
+    summary['sessions'] = concurrency
+    return summary
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Endpoints and stages whose p95 grew by more than max_regression (a fraction) over the baseline"""
+    regressions = []
+    for section in ('endpoints', 'stages'):
+        for name, current in report.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or not previous.get('p95_ms') or 'p95_ms' not in current:
+                continue
+            change = current['p95_ms'] / previous['p95_ms'] - 1
+            if change > max_regression:
+                regressions.append({'section': section, 'name': name, 'baseline_p95_ms': previous['p95_ms'],
+                                    'p95_ms': current['p95_ms'], 'change': round(change, 3)})
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay conversation traces against the API with local AWS stand-ins and report latency percentiles')
+    parser.add_argument('--mode', choices=['chalice', 'asgi'], default='chalice', help='Entry point to drive')
+    parser.add_argument('--trace', help='JSON Lines file of sessions; generated when omitted')
+    parser.add_argument('--sessions', type=int, default=200, help='Number of synthetic sessions to generate')
+    parser.add_argument('--rps', type=float, default=5.0, help='Target request rate for the open-loop replay')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to start new sessions (per level with --sweep)')
+    parser.add_argument('--drain', type=float, default=60.0, help='Seconds to wait for started sessions to finish')
+    parser.add_argument('--think-scale', type=float, default=1.0, help='Multiplier for think times between steps (0 for none)')
+    parser.add_argument('--sweep', help='Comma-separated concurrent session counts for a closed-loop sweep')
+    parser.add_argument('--slo-ms', type=float, default=1500.0, help='p95 latency a sweep level must meet to count as sustained')
+    parser.add_argument('--latency', default='', help='Median latency overrides in ms, e.g. lex=120,polly=150')
+    parser.add_argument('--jitter', type=float, default=0.3, help='Log-normal sigma applied to service latencies')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the session mix, arrivals and latencies')
+    parser.add_argument('--stage', default='dev', help='Chalice stage whose environment to use')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare p95 latencies against')
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help='Fail when a p95 exceeds the baseline by more than this fraction')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # Per-request logs and periodic metric lines would dominate the run; the report replaces them
+    os.environ['TRACING_ENABLED'] = 'true'
+    os.environ['TRACING_LOG_REQUESTS'] = 'false'
+    os.environ['TRACING_FLUSH_SECONDS'] = str(10 ** 9)
+    os.environ.setdefault('TRANSCRIBE_MODE', 'streaming')
+    from tools.provision import load_stage_environment
+    load_stage_environment(args.stage)
+
+    from tools import local_aws
+    latency_ms = parse_latency(args.latency)
+    factory = local_aws.install(latency_ms, jitter=args.jitter, seed=args.seed)
+    target = ChaliceTarget() if args.mode == 'chalice' else AsgiTarget()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    sessions = load_trace(args.trace) if args.trace else synthetic_sessions(args.sessions, args.seed)
+    report = {
+        'mode': args.mode,
+        'commit': git_commit(),
+        'started_at': datetime.utcnow().isoformat(),
+        'config': {
+            'trace': args.trace or f"synthetic:{args.sessions}",
+            'latency_ms': factory.latency.medians_ms,
+            'jitter': args.jitter,
+            'seed': args.seed,
+            'think_scale': args.think_scale
+        }
+    }
+
+    if args.sweep:
+        levels = [int(level) for level in args.sweep.split(',') if level.strip()]
+        report['config'].update({'sweep': levels, 'duration_s': args.duration, 'slo_ms': args.slo_ms})
+        report['sweep'] = []
+        sustained = 0
+        for level in levels:
+            summary = asyncio.run(closed_loop(target, sessions, level, args.duration, args.think_scale))
+            report['sweep'].append(summary)
+            p95 = summary.get('latency', {}).get('p95_ms')
+            ok = p95 is not None and p95 <= args.slo_ms and summary['error_rate'] + summary['shed_rate'] <= 0.01
+            logger.warning(f"{level} sessions: {summary['throughput_rps']} req/s, p95 {p95} ms{'' if ok else ' (over SLO)'}")
+            if ok:
+                sustained = level
+        report['sustained_sessions'] = sustained
+        # Endpoint and stage sections of the highest sustained level, for --baseline comparisons
+        best = next((summary for summary in report['sweep'] if summary['sessions'] == sustained), None)
+        report.update({key: best[key] for key in ('endpoints', 'stages')} if best else {})
+    else:
+        report['config'].update({'rps': args.rps, 'duration_s': args.duration})
+        report.update(asyncio.run(replay(target, sessions, args.rps, args.duration, args.think_scale, args.seed, args.drain)))
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report['regressions'] = compare(report, json.load(baseline_file), args.max_regression)
+        status = 1 if report['regressions'] else 0
+
+    # Metric lines still buffered by the tracing layer go to stderr, keeping stdout pure JSON
+    from chalicelib.utils.tracing_utils import histograms
+    with contextlib.redirect_stdout(sys.stderr):
+        histograms.flush(force=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Build-time synthesis of the bot's fixed prompts into the prompt pack served by the audio cache
+(chalicelib/utils/prompt_pack_utils.py).
+
+Prompts are collected from the Lex bot definition (the deployed bot version through the Lex
+models API, or an exported bot directory) and from the replies stored in the chat history table
+that recur at least --min-count times:
+
+    python -m tools.build_prompt_pack --stage dev
+    python -m tools.build_prompt_pack --bot-export ./DentalBot --local turns.jsonl
+
+Each prompt, and each sentence of it (segmented speech is cached per sentence), is synthesized
+once per voice in PROMPT_PACK_VOICES and written to --output, which is deployed with the code.
+Clips already present in the previous pack are reused, so a rebuild only pays for new prompts.
+Prompts that reference slot values ({Date}) differ per conversation and are left out.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from tools.provision import load_stage_environment
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chalicelib', 'prompts', 'prompt_pack.bin')
+
+def message_texts(node):
+    """Plain-text messages anywhere in a Lex intent or slot definition"""
+    texts = []
+    if isinstance(node, dict):
+        for key, child in node.items():
+            if key == 'plainTextMessage' and isinstance(child, dict):
+                if child.get('value'):
+                    texts.append(child['value'])
+            else:
+                texts.extend(message_texts(child))
+    elif isinstance(node, list):
+        for child in node:
+            texts.extend(message_texts(child))
+    return texts
+
+def load_bot_export(directory: str):
+    """
+    Prompts of an exported bot: Intent.json files, with their slots in Slots/<name>/Slot.json
+
+    Returns:
+        tuple: (list of prompt texts, {intent: {slot: [elicitation prompts]}})
+    """
+    prompts, slot_prompts = [], {}
+    for root, _, files in os.walk(directory):
+        if 'Intent.json' not in files:
+            continue
+        with open(os.path.join(root, 'Intent.json')) as f:
+            intent = json.load(f)
+        prompts.extend(message_texts(intent))
+        slots_dir = os.path.join(root, 'Slots')
+        for slot_name in sorted(os.listdir(slots_dir)) if os.path.isdir(slots_dir) else []:
+            slot_path = os.path.join(slots_dir, slot_name, 'Slot.json')
+            if not os.path.exists(slot_path):
+                continue
+            with open(slot_path) as f:
+                slot = json.load(f)
+            elicitation = message_texts(slot.get('valueElicitationSetting', {}).get('promptSpecification', {}))
+            prompts.extend(message_texts(slot))
+            if elicitation:
+                slot_prompts.setdefault(intent['name'], {})[slot['name']] = elicitation
+    return prompts, slot_prompts
+
+def load_bot_definition(region: str):
+    """
+    Prompts of the bot version behind LEX_BOT_ALIAS_ID, through the Lex models API
+
+    Returns:
+        tuple: (list of prompt texts, {intent: {slot: [elicitation prompts]}})
+    """
+    from chalicelib.utils.aws_utils import get_client
+
+    client = get_client('lexv2-models', region_name=region)
+    bot_id = os.environ['LEX_BOT_ID']
+    locale_id = os.environ.get('LEX_BOT_LOCALE_ID', 'en_CA')
+    bot_version = client.describe_bot_alias(botId=bot_id, botAliasId=os.environ['LEX_BOT_ALIAS_ID'])['botVersion']
+    scope = {'botId': bot_id, 'botVersion': bot_version, 'localeId': locale_id}
+
+    def paginate(method, key, **kwargs):
+        token = None
+        while True:
+            page = method(**scope, **kwargs, **({'nextToken': token} if token else {}))
+            yield from page.get(key, [])
+            token = page.get('nextToken')
+            if not token:
+                return
+
+    prompts, slot_prompts = [], {}
+    for summary in paginate(client.list_intents, 'intentSummaries'):
+        intent = client.describe_intent(intentId=summary['intentId'], **scope)
+        prompts.extend(message_texts(intent))
+        for slot_summary in paginate(client.list_slots, 'slotSummaries', intentId=summary['intentId']):
+            slot = client.describe_slot(slotId=slot_summary['slotId'], intentId=summary['intentId'], **scope)
+            elicitation = message_texts(slot.get('valueElicitationSetting', {}).get('promptSpecification', {}))
+            prompts.extend(message_texts(slot))
+            if elicitation:
+                slot_prompts.setdefault(summary['intentName'], {})[slot['slotName']] = elicitation
+    logger.info(f"Read bot {bot_id} version {bot_version} ({locale_id})")
+    return prompts, slot_prompts
+
+def load_local_responses(path: str):
+    """Reply texts from a JSON Lines file with a "response" field"""
+    with open(path) as f:
+        return [json.loads(line).get('response', '') for line in f if line.strip()]
+
+def load_table_responses(table_name: str, region: str, segments: int = 4):
+    """Reply texts from a parallel scan of the chat history table"""
+    from chalicelib.utils.aws_utils import get_client
+
+    client = get_client('dynamodb', region_name=region)
+
+    def scan_segment(segment):
+        pages = client.get_paginator('scan').paginate(
+            TableName=table_name,
+            ProjectionExpression='#response',
+            ExpressionAttributeNames={'#response': 'response'},
+            Segment=segment,
+            TotalSegments=segments
+        )
+        return [item['response']['S'] for page in pages for item in page.get('Items', []) if 'response' in item]
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return [response for responses in executor.map(scan_segment, range(segments)) for response in responses]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthesize the fixed bot prompts into a memory-mapped prompt pack')
+    bot = parser.add_mutually_exclusive_group()
+    bot.add_argument('--bot-export', help='Directory of an exported Lex bot (default: read the deployed bot)')
+    bot.add_argument('--skip-bot', action='store_true', help='Do not read prompts from the bot definition')
+    history = parser.add_mutually_exclusive_group()
+    history.add_argument('--local', help='JSON Lines file of stored turns with a "response" field')
+    history.add_argument('--table', help='Chat history table (default: DYNAMODB_TABLE of the stage)')
+    history.add_argument('--skip-history', action='store_true', help='Do not read replies from the chat history')
+    parser.add_argument('--stage', default='dev', help='Chalice stage whose environment to use')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Prompt pack path')
+    parser.add_argument('--voices', help='Comma-separated Polly voices (default: PROMPT_PACK_VOICES)')
+    parser.add_argument('--min-count', type=int, default=3, help='Times a stored reply must recur to be packed')
+    parser.add_argument('--max-history', type=int, default=500, help='Most frequent stored replies to pack')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent Polly requests')
+    parser.add_argument('--rebuild', action='store_true', help='Synthesize every clip, ignoring the previous pack')
+    args = parser.parse_args(argv)
+
+    load_stage_environment(args.stage)
+    from chalicelib.utils.aws_utils import get_client
+    from chalicelib.utils.audio_cache_utils import make_cache_key, normalize_text
+    from chalicelib.utils.lex_utils import LEX_FALLBACK_MESSAGE
+    from chalicelib.utils.polly_utils import POLLY_ENGINE, split_into_segments
+    from chalicelib.utils.prompt_pack_utils import PromptPack, write_prompt_pack
+
+    region = os.environ.get('AWS_REGION', 'ca-central-1')
+    voices = [voice.strip() for voice in (args.voices or os.environ.get('PROMPT_PACK_VOICES', 'Joanna')).split(',') if voice.strip()]
+    output_format = 'mp3'
+
+    prompts, slot_prompts = [LEX_FALLBACK_MESSAGE], {}
+    if args.bot_export:
+        bot_prompts, slot_prompts = load_bot_export(args.bot_export)
+        prompts.extend(bot_prompts)
+    elif not args.skip_bot:
+        bot_prompts, slot_prompts = load_bot_definition(region)
+        prompts.extend(bot_prompts)
+    bot_count = len(prompts)
+
+    if not args.skip_history:
+        if args.local:
+            responses = load_local_responses(args.local)
+        else:
+            responses = load_table_responses(args.table or os.environ.get('DYNAMODB_TABLE', 'dental-chat-history'), region)
+        counts = Counter(normalize_text(response) for response in responses if response.strip())
+        prompts.extend(response for response, count in counts.most_common(args.max_history) if count >= args.min_count)
+
+    # Whole replies serve /speech; their sentences serve segmented speech and /chat
+    texts = {}
+    for prompt in prompts:
+        if '{' in prompt:
+            continue
+        for text in [prompt] + split_into_segments(prompt):
+            texts.setdefault(normalize_text(text), None)
+    logger.info(f"{len(texts)} texts from {bot_count} bot prompts and {len(prompts) - bot_count} stored replies, "
+                f"{len(voices)} voice(s)")
+
+    previous = None
+    if not args.rebuild and os.path.exists(args.output):
+        previous = PromptPack(args.output)
+    wanted = {make_cache_key(text, voice, output_format, POLLY_ENGINE): (text, voice) for text in texts for voice in voices}
+    clips = {}
+    if previous is not None:
+        clips = {key: bytes(audio) for key, audio in previous.items() if key in wanted}
+        previous.close()
+    missing = [key for key in wanted if key not in clips]
+    logger.info(f"Reusing {len(clips)} clips, synthesizing {len(missing)}")
+
+    polly = get_client('polly', region_name=region)
+
+    def synthesize(key):
+        text, voice = wanted[key]
+        response = polly.synthesize_speech(Text=text, OutputFormat=output_format, VoiceId=voice, Engine=POLLY_ENGINE)
+        return key, response['AudioStream'].read()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for key, audio in executor.map(synthesize, missing):
+            clips[key] = audio
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    size = write_prompt_pack(args.output, clips, {
+        'built_at': datetime.utcnow().isoformat(),
+        'voices': voices,
+        'engine': POLLY_ENGINE,
+        'format': output_format,
+        'texts': len(texts),
+        'slot_prompts': slot_prompts
+    })
+    logger.info(f"Prompt pack written to {args.output} ({len(clips)} clips, {size / 1e6:.1f} MB)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+Local stand-ins for the AWS services the API calls, with configurable latency.
+
+Used by tools/benchmark.py: install() routes every client and resource created through
+chalicelib/utils/aws_utils.py to these objects, so the app runs unchanged without AWS.
+Latencies are log-normal around a median, in milliseconds:
+
+    from tools import local_aws
+    local_aws.install({'lex': 120, 'polly': 150}, jitter=0.3)
+    import app
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from io import BytesIO
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+# Median latency per service in milliseconds, roughly what the services take from Lambda
+DEFAULT_LATENCY_MS = {
+    'lex': 120.0,
+    'polly': 150.0,
+    'transcribe': 400.0,
+    'dynamodb': 8.0,
+    's3': 25.0
+}
+# Synthesized audio size, close to 24 kbps MP3 of speech
+AUDIO_BYTES_PER_CHAR = 200
+
+# Keyword -> (intent, reply, slot to elicit) for the local bot
+BOT_SCRIPT = [
+    ('hours', 'ClinicHours', 'We are open Monday to Friday from 8am to 6pm, and Saturdays from 9am to 1pm.', None),
+    ('open', 'ClinicHours', 'We are open Monday to Friday from 8am to 6pm, and Saturdays from 9am to 1pm.', None),
+    ('where', 'ClinicLocation', 'We are at 123 Main Street, second floor. There is parking behind the building.', None),
+    ('insurance', 'InsuranceAccepted', 'We accept most major insurance plans. Please bring your card to your visit.', None),
+    ('parking', 'Parking', 'Free parking is available behind the building.', None),
+    ('book', 'BookAppointment', 'Sure, I can help you book an appointment. What day works best for you?', 'date'),
+    ('appointment', 'BookAppointment', 'Sure, I can help you book an appointment. What day works best for you?', 'date'),
+    ('tomorrow', 'BookAppointment', 'What time would you like to come in?', 'time'),
+    ('monday', 'BookAppointment', 'What time would you like to come in?', 'time'),
+    ('am', 'BookAppointment', 'Can I have your name for the booking?', 'name'),
+    ('pm', 'BookAppointment', 'Can I have your name for the booking?', 'name'),
+    ('name', 'BookAppointment', 'Thanks! Your appointment is booked. See you soon.', None),
+    ('cancel', 'CancelAppointment', 'Your appointment has been cancelled.', None)
+]
+
+class Latency:
+    """Log-normal delay model per service"""
+
+    def __init__(self, medians_ms: dict = None, jitter: float = 0.3, seed: int = None):
+        self.medians_ms = dict(DEFAULT_LATENCY_MS, **(medians_ms or {}))
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, service: str, scale: float = 1.0):
+        median = self.medians_ms.get(service, 0.0) * scale
+        if median <= 0:
+            return
+        with self._lock:
+            factor = self._random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+        time.sleep(median * factor / 1000)
+
+class StreamingBody(BytesIO):
+    """Enough of botocore's StreamingBody for the utils"""
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def _client_error(code: str, operation: str, message: str = ''):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+class LocalLex:
+    """lexv2-runtime and lexv2-models"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def recognize_text(self, botId, botAliasId, localeId, sessionId, text, **kwargs):
+        self.latency.wait('lex')
+        lowered = text.lower()
+        intent, reply, slot = 'FallbackIntent', "Sorry, I didn't understand that. Could you rephrase?", None
+        for keyword, script_intent, script_reply, script_slot in BOT_SCRIPT:
+            if keyword in lowered.split() or keyword in lowered:
+                intent, reply, slot = script_intent, script_reply, script_slot
+                break
+        dialog_action = {'type': 'ElicitSlot', 'slotToElicit': slot} if slot else {'type': 'Close'}
+        return {
+            'messages': [{'content': sentence, 'contentType': 'PlainText'} for sentence in re.split(r'(?<=[.!?])\s+', reply)],
+            'sessionState': {'dialogAction': dialog_action, 'intent': {'name': intent, 'slots': {}}},
+            'interpretations': [{'intent': {'name': intent, 'slots': {}}}],
+            'sessionId': sessionId
+        }
+
+    def describe_bot_alias(self, botId, botAliasId, **kwargs):
+        return {'botAliasId': botAliasId, 'botVersion': '1'}
+
+class LocalPolly:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def synthesize_speech(self, Text, OutputFormat, VoiceId, Engine='standard', **kwargs):
+        # Synthesis time grows with the length of the text
+        self.latency.wait('polly', scale=max(1.0, len(Text) / 100))
+        seed = hashlib.sha256(f"{VoiceId}:{Text}".encode('utf-8')).digest()
+        size = max(len(Text) * AUDIO_BYTES_PER_CHAR, len(seed))
+        audio = (seed * (size // len(seed) + 1))[:size]
+        return {'AudioStream': StreamingBody(audio), 'ContentType': 'audio/mpeg'}
+
+class LocalS3:
+    """In-memory buckets"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, bucket: str) -> dict:
+        with self._lock:
+            return self.buckets.setdefault(bucket, {})
+
+    def head_bucket(self, Bucket, **kwargs):
+        return {}
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._bucket(Bucket)
+        return {}
+
+    def put_bucket_cors(self, **kwargs):
+        return {}
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType=None, **kwargs):
+        self.latency.wait('s3')
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+        etag = '"%08x"' % zlib.crc32(data)
+        self._bucket(Bucket)[Key] = (data, etag, ContentType)
+        return {'ETag': etag}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), ContentType=(ExtraArgs or {}).get('ContentType'))
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        self.latency.wait('s3')
+        stored = self._bucket(Bucket).get(Key)
+        if stored is None:
+            raise _client_error('NoSuchKey', 'GetObject')
+        data, etag, content_type = stored
+        if IfNoneMatch and IfNoneMatch == etag:
+            raise _client_error('304', 'GetObject', 'Not Modified')
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': StreamingBody(data), 'ETag': etag, 'ContentLength': len(data), 'ContentType': content_type}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        stored = self._bucket(Bucket).get(Key)
+        if stored is None:
+            raise _client_error('404', 'HeadObject')
+        return {'ETag': stored[1], 'ContentLength': len(stored[0])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._bucket(Bucket).pop(Key, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = Params or {}
+        return f"https://{params.get('Bucket')}.s3.local/{params.get('Key')}?expires={ExpiresIn}"
+
+    def get_paginator(self, operation: str):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix='', **kwargs):
+                keys = sorted(key for key in s3._bucket(Bucket) if key.startswith(Prefix))
+                yield {'Contents': [{'Key': key, 'Size': len(s3._bucket(Bucket)[key][0])} for key in keys]}
+
+        return Paginator()
+
+class LocalTranscribe:
+    """Batch jobs complete on the second status check"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.jobs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        self.latency.wait('s3')
+        self.jobs[TranscriptionJobName] = 0
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName, 'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def get_transcription_job(self, TranscriptionJobName, **kwargs):
+        if TranscriptionJobName not in self.jobs:
+            raise _client_error('BadRequestException', 'GetTranscriptionJob', 'The requested job couldn\'t be found')
+        self.jobs[TranscriptionJobName] += 1
+        status = 'COMPLETED' if self.jobs[TranscriptionJobName] > 1 else 'IN_PROGRESS'
+        return {'TranscriptionJob': {
+            'TranscriptionJobName': TranscriptionJobName,
+            'TranscriptionJobStatus': status,
+            'CompletionTime': datetime.now(timezone.utc) if status == 'COMPLETED' else None,
+            'Transcript': {'TranscriptFileUri': f"https://transcribe.local/{TranscriptionJobName}.json"}
+        }}
+
+    def delete_transcription_job(self, TranscriptionJobName, **kwargs):
+        self.jobs.pop(TranscriptionJobName, None)
+        return {}
+
+class LocalRecognizer:
+    """Streaming recognizer whose latency grows with the amount of audio"""
+
+    def __init__(self, latency: Latency, transcript: str = 'I would like to book an appointment'):
+        self.latency = latency
+        self.transcript = transcript
+
+    def transcribe(self, chunks, media_encoding: str, sample_rate: int):
+        size = sum(len(chunk) for chunk in chunks)
+        # Results arrive shortly after the audio finishes; scale on ~16 KB/s of compressed speech
+        self.latency.wait('transcribe', scale=max(0.5, size / 65536))
+        return [{'text': self.transcript, 'is_partial': False}]
+
+class LocalTable:
+    """The chat history table: put_item and query by session_id"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def load(self):
+        pass
+
+    def put_item(self, Item, **kwargs):
+        self.store.latency.wait('dynamodb')
+        self.store.put(Item)
+        return {}
+
+    def query(self, ExpressionAttributeValues, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, **kwargs):
+        self.store.latency.wait('dynamodb')
+        items = self.store.session_items(ExpressionAttributeValues[':sid'])
+        if not ScanIndexForward:
+            items.reverse()
+        if ExclusiveStartKey:
+            after = ExclusiveStartKey['timestamp']
+            items = [item for item in items if (item['timestamp'] > after if ScanIndexForward else item['timestamp'] < after)]
+        page = items[:Limit] if Limit else items
+        response = {'Items': page, 'Count': len(page)}
+        if Limit and len(items) > Limit:
+            response['LastEvaluatedKey'] = {'session_id': page[-1]['session_id'], 'timestamp': page[-1]['timestamp']}
+        return response
+
+class LocalDynamoDB:
+    """Client and resource over one in-memory table per name"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.items = {}
+        self._lock = threading.Lock()
+        self._deserializer = TypeDeserializer()
+
+    def put(self, item: dict):
+        with self._lock:
+            self.items[(item['session_id'], item['timestamp'])] = item
+
+    def session_items(self, session_id: str) -> list:
+        with self._lock:
+            return sorted((item for (sid, _), item in self.items.items() if sid == session_id), key=lambda item: item['timestamp'])
+
+    def Table(self, name: str):
+        return LocalTable(self)
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.latency.wait('dynamodb')
+        for requests in RequestItems.values():
+            for request in requests:
+                item = request['PutRequest']['Item']
+                self.put({key: self._deserializer.deserialize(value) for key, value in item.items()})
+        return {'UnprocessedItems': {}}
+
+    def describe_table(self, TableName, **kwargs):
+        return {'Table': {'TableName': TableName, 'TableStatus': 'ACTIVE', 'TableArn': f"arn:aws:dynamodb:local:000000000000:table/{TableName}"}}
+
+class LocalAWS:
+    """Client factory for aws_utils.set_client_factory"""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.lex = LocalLex(latency)
+        self.services = {
+            'lexv2-runtime': self.lex,
+            'lexv2-models': self.lex,
+            'polly': LocalPolly(latency),
+            's3': LocalS3(latency),
+            'transcribe': LocalTranscribe(latency),
+            'dynamodb': LocalDynamoDB(latency)
+        }
+
+    def client(self, service: str, region_name: str = None):
+        if service not in self.services:
+            raise ValueError(f"No local stand-in for {service}")
+        return self.services[service]
+
+    def resource(self, service: str, region_name: str = None):
+        return self.client(service, region_name)
+
+def _fake_transcript(job_response):
+    return 'I would like to book an appointment'
+
+def install(latency_ms: dict = None, jitter: float = 0.3, seed: int = None) -> LocalAWS:
+    """
+    Route every AWS client and resource to local stand-ins
+
+    Call before importing app.py or asgi.py, so the utils initialize against the stand-ins.
+
+    Args:
+        latency_ms (dict): Median latency overrides per service ('lex', 'polly', 'transcribe', 'dynamodb', 's3')
+        jitter (float): Log-normal sigma of the latency (0 for fixed delays)
+        seed (int): Seed for reproducible delays
+
+    Returns:
+        LocalAWS: The installed factory, for inspecting stored objects and items
+    """
+    from chalicelib.utils import aws_utils, transcribe_utils
+    factory = LocalAWS(Latency(latency_ms, jitter, seed))
+    aws_utils.set_client_factory(factory)
+    transcribe_utils.set_recognizer(LocalRecognizer(factory.latency))
+    # Batch transcripts are fetched over HTTP from the job's URI; answer locally instead
+    transcribe_utils._read_transcript = _fake_transcript
+    return factory
@@ -0,0 +1,53 @@
+"""
+Deploy-time provisioning for the resources the API expects to exist.
+
+Run before or after `chalice deploy` with the stage environment exported, e.g.:
+
+    python -m tools.provision --stage dev
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def load_stage_environment(stage: str):
+    """Export the stage's environment_variables from .chalice/config.json"""
+    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.chalice', 'config.json')
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    variables = dict(config.get('environment_variables', {}))
+    variables.update(config.get('stages', {}).get(stage, {}).get('environment_variables', {}))
+    for name, value in variables.items():
+        os.environ.setdefault(name, value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or migrate the DynamoDB table and create the S3 buckets used by the chatbot API')
+    parser.add_argument('--stage', default='dev', help='Chalice stage whose environment to use')
+    parser.add_argument('--skip-backfill', action='store_true',
+                        help='Do not rewrite existing items when migrating the table schema')
+    args = parser.parse_args(argv)
+
+    # Environment must be in place before the utils read their module-level settings
+    load_stage_environment(args.stage)
+    from chalicelib.utils.dynamo_utils import provision_table
+    from chalicelib.utils.s3_utils import provision_bucket
+    from chalicelib.utils.transcribe_utils import provision_recordings_bucket
+    from chalicelib.utils.admission_utils import ADMISSION_BACKEND, provision_admission_table
+
+    results = {
+        'dynamodb_table': provision_table(backfill=not args.skip_backfill),
+        'conversation_bucket': provision_bucket(),
+        'recordings_bucket': provision_recordings_bucket()
+    }
+    if ADMISSION_BACKEND == 'dynamodb':
+        results['admission_table'] = provision_admission_table()
+    for name, ok in results.items():
+        logger.info(f"{name}: {'ready' if ok else 'FAILED'}")
+    return 0 if all(results.values()) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Offline training of the intent pre-classifier used by /chat (chalicelib/utils/preclassifier_utils.py).
+
+Learns a softmax model over hashed n-grams from the message/intent pairs stored in the chat
+history table, or from a JSON Lines file with "message", "intent" and "response" fields:
+
+    python -m tools.train_intents --stage dev
+    python -m tools.train_intents --local turns.jsonl --output /tmp/intent_model.npz
+
+Turns whose intent did not come from Lex (answered by the pre-classifier itself, or the
+fallback reply while Lex was unavailable) are not used. One message in ten, chosen by a hash
+of the normalized text, is held out; the report gives accuracy and, per confidence threshold,
+how many held-out messages of the answerable intents would be answered locally and how
+precisely. The model is written to --output (a path or an s3:// URI) for deployment; run the
+API with PRECLASSIFIER_MODE=shadow first to confirm the precision on live traffic.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from tools.provision import load_stage_environment
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chalicelib', 'models', 'intent_model.npz')
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98)
+
+def load_local(path: str):
+    """(message, intent, response) triples from a JSON Lines file"""
+    examples = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if not record.get('intent_source'):
+                    examples.append((record['message'], record['intent'], record.get('response', '')))
+    return examples
+
+def load_table(table_name: str, region: str, segments: int = 4):
+    """(message, intent, response) triples from a parallel scan of the chat history table"""
+    from chalicelib.utils.aws_utils import get_client
+
+    client = get_client('dynamodb', region_name=region)
+
+    def scan_segment(segment):
+        examples = []
+        pages = client.get_paginator('scan').paginate(
+            TableName=table_name,
+            ProjectionExpression='message, intent, #response',
+            FilterExpression='attribute_not_exists(intent_source)',
+            ExpressionAttributeNames={'#response': 'response'},
+            Segment=segment,
+            TotalSegments=segments
+        )
+        for page in pages:
+            for item in page.get('Items', []):
+                if 'message' in item and 'intent' in item:
+                    examples.append((item['message']['S'], item['intent']['S'], item.get('response', {}).get('S', '')))
+        return examples
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return [example for examples in executor.map(scan_segment, range(segments)) for example in examples]
+
+def build_matrix(messages, dimensions: int):
+    """Hashed features of each message as a CSR matrix (indptr, indices, values)"""
+    from chalicelib.utils.preclassifier_utils import hash_features
+
+    indptr, indices, values = [0], [], []
+    for message in messages:
+        message_indices, message_values = hash_features(message, dimensions)
+        indices.extend(message_indices)
+        values.extend(message_values)
+        indptr.append(len(indices))
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64), np.array(values, dtype=np.float32)
+
+def predict_proba(weights, bias, indptr, indices, values):
+    # Every row has at least one feature, so reduceat sums each row's slice
+    scores = np.add.reduceat(weights[indices] * values[:, None], indptr[:-1], axis=0) + bias
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
+
+def train(indptr, indices, values, labels, classes: int, dimensions: int, epochs: int = 150,
+          learning_rate: float = 0.05, l2: float = 1e-5):
+    """
+    Fit multinomial logistic regression by full-batch Adam
+
+    Returns:
+        tuple: (weights of shape (dimensions, classes), bias)
+    """
+    rows = np.repeat(np.arange(len(labels)), np.diff(indptr))
+    weights = np.zeros((dimensions, classes), dtype=np.float32)
+    bias = np.zeros(classes, dtype=np.float32)
+    moments = [np.zeros_like(weights), np.zeros_like(weights), np.zeros_like(bias), np.zeros_like(bias)]
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+
+    for epoch in range(1, epochs + 1):
+        error = predict_proba(weights, bias, indptr, indices, values)
+        loss = -np.log(error[np.arange(len(labels)), labels] + 1e-12).mean()
+        error[np.arange(len(labels)), labels] -= 1.0
+        error /= len(labels)
+        contributions = error[rows] * values[:, None]
+        # Scatter-add per class: bincount is much faster than np.add.at
+        grad_weights = np.stack(
+            [np.bincount(indices, weights=contributions[:, k], minlength=dimensions) for k in range(classes)],
+            axis=1
+        ).astype(np.float32) + l2 * weights
+        grad_bias = error.sum(axis=0)
+
+        for param, grad, first, second in ((weights, grad_weights, moments[0], moments[1]), (bias, grad_bias, moments[2], moments[3])):
+            first *= beta1
+            first += (1 - beta1) * grad
+            second *= beta2
+            second += (1 - beta2) * grad * grad
+            param -= learning_rate * (first / (1 - beta1 ** epoch)) / (np.sqrt(second / (1 - beta2 ** epoch)) + epsilon)
+        if epoch % 25 == 0:
+            logger.info(f"Epoch {epoch}: training loss {loss:.4f}")
+    return weights, bias
+
+def stable_replies(examples, min_share: float):
+    """The reply of each intent whose responses are (almost) always the same text"""
+    responses = {}
+    for _, intent, response in examples:
+        responses.setdefault(intent, Counter())[response] += 1
+    replies = {}
+    for intent, counts in responses.items():
+        reply, count = counts.most_common(1)[0]
+        if reply and count >= min_share * sum(counts.values()):
+            replies[intent] = reply
+    return replies
+
+def evaluate(probabilities, labels, classes, answerable):
+    """Held-out accuracy, and coverage/precision of local answers per threshold"""
+    predicted = probabilities.argmax(axis=1)
+    confidence = probabilities.max(axis=1)
+    answerable_mask = np.isin(predicted, [classes.index(intent) for intent in answerable if intent in classes])
+    report = {
+        'held_out': int(len(labels)),
+        'accuracy': round(float((predicted == labels).mean()), 4) if len(labels) else None,
+        'thresholds': {}
+    }
+    for threshold in THRESHOLDS:
+        answered = answerable_mask & (confidence >= threshold)
+        report['thresholds'][str(threshold)] = {
+            'coverage': round(float(answered.mean()), 4) if len(labels) else None,
+            'precision': round(float((predicted[answered] == labels[answered]).mean()), 4) if answered.any() else None
+        }
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the local intent pre-classifier from stored conversation turns')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--local', help='JSON Lines file of message/intent/response records')
+    source.add_argument('--table', help='Chat history table (default: DYNAMODB_TABLE of the stage)')
+    parser.add_argument('--stage', default='dev', help='Chalice stage whose environment to use')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Model path or s3:// URI')
+    parser.add_argument('--dimensions', type=int, default=None, help='Hashed feature space size')
+    parser.add_argument('--epochs', type=int, default=150)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--l2', type=float, default=1e-5)
+    parser.add_argument('--min-examples', type=int, default=5, help='Intents with fewer examples are left out')
+    parser.add_argument('--min-reply-share', type=float, default=0.8,
+                        help='Share of turns an intent reply must account for to be served locally')
+    args = parser.parse_args(argv)
+
+    load_stage_environment(args.stage)
+    from chalicelib.utils.preclassifier_utils import DEFAULT_DIMENSIONS, PRECLASSIFIER_INTENTS, IntentModel, hash_features
+    from chalicelib.utils.faq_cache_utils import normalize_utterance
+
+    if args.local:
+        examples = load_local(args.local)
+    else:
+        table = args.table or os.environ.get('DYNAMODB_TABLE', 'dental-chat-history')
+        examples = load_table(table, os.environ.get('AWS_REGION', 'ca-central-1'))
+    dimensions = args.dimensions or DEFAULT_DIMENSIONS
+
+    examples = [example for example in examples if hash_features(example[0], dimensions)[0]]
+    counts = Counter(intent for _, intent, _ in examples)
+    classes = sorted(intent for intent, count in counts.items() if count >= args.min_examples)
+    examples = [example for example in examples if example[1] in classes]
+    if len(classes) < 2:
+        logger.error(f"Need at least two intents with {args.min_examples}+ examples, found {len(classes)}")
+        return 1
+    logger.info(f"{len(examples)} examples over {len(classes)} intents")
+
+    held_out = [zlib.crc32(normalize_utterance(message).encode('utf-8')) % 10 == 0 for message, _, _ in examples]
+    train_examples = [example for example, hold in zip(examples, held_out) if not hold]
+    test_examples = [example for example, hold in zip(examples, held_out) if hold]
+
+    def labels_of(subset):
+        return np.array([classes.index(intent) for _, intent, _ in subset], dtype=np.int64)
+
+    weights, bias = train(
+        *build_matrix([message for message, _, _ in train_examples], dimensions),
+        labels_of(train_examples), len(classes), dimensions,
+        epochs=args.epochs, learning_rate=args.learning_rate, l2=args.l2
+    )
+    report = {'examples': len(examples), 'intents': dict(sorted(counts.items()))}
+    if test_examples:
+        probabilities = predict_proba(weights, bias, *build_matrix([message for message, _, _ in test_examples], dimensions))
+        report['evaluation'] = evaluate(probabilities, labels_of(test_examples), classes, PRECLASSIFIER_INTENTS)
+
+    replies = stable_replies(examples, args.min_reply_share)
+    report['answerable'] = sorted(intent for intent in PRECLASSIFIER_INTENTS if intent in replies)
+    model = IntentModel(weights, bias, classes, replies, {
+        'trained_at': datetime.utcnow().isoformat(),
+        'examples': len(examples),
+        'accuracy': report.get('evaluation', {}).get('accuracy')
+    })
+
+    if args.output.startswith('s3://'):
+        from chalicelib.utils.aws_utils import get_client
+
+        local_path = '/tmp/intent_model.npz'
+        model.save(local_path)
+        bucket, _, key = args.output[len('s3://'):].partition('/')
+        get_client('s3', region_name=os.environ.get('AWS_REGION', 'ca-central-1')).upload_file(local_path, bucket, key)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        model.save(args.output)
+    logger.info(f"Model written to {args.output} ({weights.nbytes / 1e6:.1f} MB of weights)")
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())